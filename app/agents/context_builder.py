@@ -0,0 +1,164 @@
+import json
+import math
+import re
+from typing import List, Dict, Any, Tuple, Optional
+
+# Default per-model context budgets, in (estimated) tokens.
+DEFAULT_TOKEN_BUDGETS = {"gemini": 8000, "groq": 4000, "huggingface": 2000}
+
+
+def estimate_tokens(text: str) -> int:
+    # A provider-neutral estimate: roughly four characters per token for English text.
+    return math.ceil(len(text) / 4)
+
+
+# This class turns the ranked chunks returned by retrieval into the passages that are
+# actually sent to the LLM. Neighbouring chunks from the same source location repeat
+# text because of the splitter's overlap, so those are stitched back together with the
+# overlap appearing once; passages that are near-duplicates of a more relevant passage
+# are dropped; and the remainder is added in relevance order until the model's token
+# budget is full, the passage that overflows it being cut to fit. `build` also reports
+# how many tokens merging and deduplication saved, and how many the budget cut off.
+class ContextBuilder:
+    def __init__(self, token_budgets: Optional[Dict[str, int]] = None, default_budget: int = 3000,
+                 duplicate_threshold: float = 0.9, min_overlap: int = 20, max_overlap: int = 300,
+                 min_truncated_tokens: int = 20):
+        self.token_budgets = token_budgets if token_budgets is not None else dict(DEFAULT_TOKEN_BUDGETS)
+        self.default_budget = default_budget
+        self.duplicate_threshold = duplicate_threshold
+        self.min_overlap = min_overlap
+        self.max_overlap = max_overlap
+        # A passage is only cut to fit if at least this much of it would remain.
+        self.min_truncated_tokens = min_truncated_tokens
+
+    def build(self, model_name: str, chunks: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+        budget = self.token_budgets.get(model_name, self.default_budget)
+        tokens_in = sum(estimate_tokens(chunk["content"]) for chunk in chunks)
+
+        # Each passage remembers the best (lowest) retrieval rank of the chunks it contains.
+        passages = [
+            {"content": chunk["content"], "metadata": chunk["metadata"], "rank": rank}
+            for rank, chunk in enumerate(chunks)
+        ]
+        passages = self._merge_overlaps(passages)
+        passages, duplicates = self._drop_near_duplicates(passages)
+
+        tokens_kept = sum(estimate_tokens(passage["content"]) for passage in passages)
+        packed, tokens_out, over_budget, truncated = [], 0, 0, 0
+        for passage in sorted(passages, key=lambda p: p["rank"]):
+            content = passage["content"]
+            remaining = budget - tokens_out
+            if estimate_tokens(content) > remaining:
+                # The first passage that overflows is cut to the remaining budget; once the
+                # budget is full, every later (less relevant) passage is dropped.
+                if remaining < self.min_truncated_tokens:
+                    over_budget += 1
+                    continue
+                content = _truncate(content, remaining * 4)
+                truncated += 1
+            packed.append({"content": content, "metadata": passage["metadata"]})
+            tokens_out += estimate_tokens(content)
+
+        stats = {
+            "chunks_in": len(chunks),
+            "passages_out": len(packed),
+            "duplicates_dropped": duplicates,
+            "over_budget_dropped": over_budget,
+            "passages_truncated": truncated,
+            "token_budget": budget,
+            "tokens_in": tokens_in,
+            "tokens_out": tokens_out,
+            # Tokens removed by merging overlaps and dropping near-duplicates, which lose no
+            # information, and tokens cut off to fit the budget, which do.
+            "tokens_saved": tokens_in - tokens_kept,
+            "tokens_truncated": tokens_kept - tokens_out
+        }
+        return packed, stats
+
+    def _merge_overlaps(self, passages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        # Only chunks with identical metadata (same source and page/slide/row) can be neighbours.
+        groups: Dict[str, List[Dict[str, Any]]] = {}
+        for passage in passages:
+            groups.setdefault(json.dumps(passage["metadata"], sort_keys=True, default=str), []).append(passage)
+
+        merged_passages = []
+        for group in groups.values():
+            # Keep merging pairs until no two passages in the group overlap any more.
+            merged = True
+            while merged and len(group) > 1:
+                merged = False
+                for i in range(len(group)):
+                    for j in range(len(group)):
+                        if i == j:
+                            continue
+                        combined = self._stitch(group[i]["content"], group[j]["content"])
+                        if combined is None:
+                            continue
+                        group[i] = {
+                            "content": combined,
+                            "metadata": group[i]["metadata"],
+                            "rank": min(group[i]["rank"], group[j]["rank"])
+                        }
+                        del group[j]
+                        merged = True
+                        break
+                    if merged:
+                        break
+            merged_passages.extend(group)
+        return merged_passages
+
+    def _stitch(self, first: str, second: str) -> Optional[str]:
+        # Returns `first` followed by `second` with their shared overlap written once, or None.
+        if second in first:
+            return first
+        longest = min(len(first), len(second), self.max_overlap)
+        for size in range(longest, self.min_overlap - 1, -1):
+            if first.endswith(second[:size]):
+                return first + second[size:]
+        return None
+
+    def _drop_near_duplicates(self, passages: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], int]:
+        # Compares word-shingle sets; the more relevant passage of a near-duplicate pair is kept.
+        kept: List[Tuple[Dict[str, Any], set]] = []
+        dropped = 0
+        for passage in sorted(passages, key=lambda p: p["rank"]):
+            shingles = _shingles(passage["content"])
+            if any(_jaccard(shingles, other) >= self.duplicate_threshold for _, other in kept):
+                dropped += 1
+                continue
+            kept.append((passage, shingles))
+        return [passage for passage, _ in kept], dropped
+
+
+def _truncate(text: str, max_chars: int) -> str:
+    # Cuts at the last sentence or word break before `max_chars`, if one is reasonably close.
+    if len(text) <= max_chars:
+        return text
+    for separator in ("\n", ". ", " "):
+        end = text.rfind(separator, 0, max_chars)
+        if end >= max_chars // 2:
+            return text[:end + len(separator)].rstrip()
+    return text[:max_chars]
+
+
+def _shingles(text: str, size: int = 3) -> set:
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def _jaccard(a: set, b: set) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def parse_token_budgets(spec: str) -> Dict[str, int]:
+    # Parses "gemini=8000,groq=4000" on top of the defaults.
+    budgets = dict(DEFAULT_TOKEN_BUDGETS)
+    for entry in spec.split(","):
+        if "=" in entry:
+            model, budget = entry.split("=", 1)
+            budgets[model.strip()] = int(budget)
+    return budgets
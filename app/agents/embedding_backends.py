@@ -0,0 +1,126 @@
+import os
+import threading
+import numpy as np
+from chromadb.utils import embedding_functions
+from typing import List, Any, Optional
+
+# --- Embedding Backends ---
+# Both backends compute all-MiniLM-L6-v2 sentence embeddings (mean-pooled, L2-normalized)
+# and present themselves to Chroma as the same SentenceTransformer embedding function, so
+# a collection built with one can be searched with the other.
+
+
+# Chroma's SentenceTransformer embedding function, except that importing
+# sentence-transformers (and torch) and loading the model happen on the first call (or
+# in RetrievalAgent.warmup) rather than when the agent is constructed. Its name and
+# config are unchanged, so collections created with the eager version still match.
+class LazySentenceTransformerEmbeddingFunction(embedding_functions.SentenceTransformerEmbeddingFunction):
+    _load_lock = threading.Lock()
+
+    def __init__(self, model_name: str, device: str = "cpu", normalize_embeddings: bool = False, **kwargs: Any):
+        self.model_name = model_name
+        self.device = device
+        self.normalize_embeddings = normalize_embeddings
+        self.kwargs = kwargs
+
+    @property
+    def cache_name(self) -> str:
+        # Identifies the vectors this function produces in the embedding cache. The backends'
+        # vectors are close but not identical, so each keeps its own cache entries.
+        return f"{self.model_name}:torch"
+
+    @property
+    def _model(self):
+        # Loaded models are shared through the class-level cache of the parent class.
+        if self.model_name not in self.models:
+            with self._load_lock:
+                if self.model_name not in self.models:
+                    from sentence_transformers import SentenceTransformer
+                    self.models[self.model_name] = SentenceTransformer(
+                        model_name_or_path=self.model_name, device=self.device, **self.kwargs
+                    )
+        return self.models[self.model_name]
+
+
+# Runs an ONNX export of the model (int8-quantized by default, see onnx_export.py) on
+# ONNX Runtime, without torch. `model_dir` holds the model file and its tokenizer.json.
+# Texts are encoded in batches of `batch_size`, sorted by length so each batch is padded
+# as little as possible; `threads` caps ONNX Runtime's intra-op threads (0 lets it decide).
+class OnnxEmbeddingFunction(LazySentenceTransformerEmbeddingFunction):
+    def __init__(self, model_name: str, model_dir: str, model_file: str = "model_int8.onnx",
+                 threads: int = 0, batch_size: int = 32, **kwargs: Any):
+        super().__init__(model_name, **kwargs)
+        self.model_path = os.path.join(model_dir, model_file)
+        self.tokenizer_path = os.path.join(model_dir, "tokenizer.json")
+        self.threads = threads
+        self.batch_size = batch_size
+        self._session = None
+        self._tokenizer = None
+        self._input_names: List[str] = []
+
+    @property
+    def cache_name(self) -> str:
+        return f"{self.model_name}:onnx:{os.path.basename(self.model_path)}"
+
+    def load(self):
+        if self._session is not None:
+            return
+        with self._load_lock:
+            if self._session is not None:
+                return
+            import onnxruntime
+            from tokenizers import Tokenizer
+            options = onnxruntime.SessionOptions()
+            options.intra_op_num_threads = self.threads
+            # Requests are already parallel across the server's threads; one inter-op thread avoids oversubscription.
+            options.inter_op_num_threads = 1
+            options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+            session = onnxruntime.InferenceSession(self.model_path, options, providers=["CPUExecutionProvider"])
+            tokenizer = Tokenizer.from_file(self.tokenizer_path)
+            # The exported tokenizer.json carries the model's maximum sequence length.
+            if tokenizer.truncation is None:
+                tokenizer.enable_truncation(max_length=512)
+            tokenizer.enable_padding(pad_id=tokenizer.token_to_id("[PAD]") or 0, pad_token="[PAD]")
+            self._input_names = [model_input.name for model_input in session.get_inputs()]
+            self._tokenizer = tokenizer
+            self._session = session
+
+    def __call__(self, input: List[str]) -> List[np.ndarray]:
+        self.load()
+        texts = list(input)
+        vectors: List[Optional[np.ndarray]] = [None] * len(texts)
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            for i, vector in zip(batch, self._encode([texts[i] for i in batch])):
+                vectors[i] = vector
+        return vectors
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        encodings = self._tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask,
+                 "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64)}
+        token_embeddings = self._session.run(None, {name: feeds[name] for name in self._input_names})[0]
+        # Mean pooling over the real (unpadded) tokens, then L2 normalization, as in the
+        # SentenceTransformer pipeline of all-MiniLM-L6-v2.
+        mask = attention_mask[:, :, None].astype(np.float32)
+        pooled = (token_embeddings * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        return (pooled / np.maximum(norms, 1e-12)).astype(np.float32)
+
+
+def create_embedding_function(backend: str, model_name: str) -> LazySentenceTransformerEmbeddingFunction:
+    # EMBEDDING_BACKEND=torch (the default) uses sentence-transformers; onnx uses ONNX Runtime.
+    if backend == "torch":
+        return LazySentenceTransformerEmbeddingFunction(model_name=model_name)
+    if backend == "onnx":
+        return OnnxEmbeddingFunction(
+            model_name=model_name,
+            model_dir=os.environ.get("EMBEDDING_ONNX_DIR", "onnx_model"),
+            model_file=os.environ.get("EMBEDDING_ONNX_FILE", "model_int8.onnx"),
+            threads=int(os.environ.get("EMBEDDING_THREADS", "0")),
+            batch_size=int(os.environ.get("EMBEDDING_BATCH_SIZE", "32"))
+        )
+    raise ValueError(f"Unknown EMBEDDING_BACKEND {backend!r}; expected 'torch' or 'onnx'.")
@@ -0,0 +1,120 @@
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+import numpy as np
+from typing import List, Dict, Any, Optional, Callable
+
+# This class is a two-tier, content-addressed cache for embedding vectors.
+# Entries are keyed by a hash of the model name and the text, so the same text is only
+# ever encoded once per model, no matter which collection or upload it comes from.
+# The first tier is a bounded in-memory LRU; the second is a SQLite file on disk.
+class EmbeddingCache:
+    def __init__(self, model_name: str, max_memory_entries: int = 20000, path: Optional[str] = None):
+        self.model_name = model_name
+        self.max_memory_entries = max_memory_entries
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        # The disk tier is optional; without a path the cache is memory-only.
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)")
+            self._db.commit()
+
+        # Hit/miss counters reported by stats().
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        # Looks every text up in memory first, then on disk. Disk hits are promoted to memory.
+        keys = [self.key(text) for text in texts]
+        results: List[Optional[np.ndarray]] = [None] * len(texts)
+        with self._lock:
+            missing = {}
+            for i, key in enumerate(keys):
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    results[i] = vector
+                    self.memory_hits += 1
+                else:
+                    missing.setdefault(key, []).append(i)
+
+            for key, vector in self._load_from_disk(list(missing)).items():
+                self._remember(key, vector)
+                for i in missing.pop(key):
+                    results[i] = vector
+                    self.disk_hits += 1
+
+            self.misses += sum(len(positions) for positions in missing.values())
+        return results
+
+    def put_many(self, texts: List[str], vectors: List[np.ndarray]):
+        entries = {self.key(text): np.asarray(vector, dtype=np.float32) for text, vector in zip(texts, vectors)}
+        with self._lock:
+            for key, vector in entries.items():
+                self._remember(key, vector)
+            if self._db is not None:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                    [(key, vector.tobytes()) for key, vector in entries.items()]
+                )
+                self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "model_name": self.model_name,
+                "memory_entries": len(self._memory),
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0
+            }
+
+    def _remember(self, key: str, vector: np.ndarray):
+        # Inserts into the memory tier, evicting the least recently used entries over the cap.
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _load_from_disk(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        found = {}
+        if self._db is None or not keys:
+            return found
+        # Stay well below SQLite's limit on the number of bound parameters.
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows = self._db.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch)
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+
+# Wraps any embedding function (a callable from a list of texts to a list of vectors)
+# so that only texts missing from the cache are actually encoded.
+class CachedEmbeddingFunction:
+    def __init__(self, embedding_function: Callable[[List[str]], List[Any]], cache: EmbeddingCache):
+        self.embedding_function = embedding_function
+        self.cache = cache
+
+    def __call__(self, input: List[str]) -> List[np.ndarray]:
+        vectors = self.cache.get_many(input)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            # Encode each distinct missing text once, even if it repeats within the batch.
+            missing_texts = list(dict.fromkeys(input[i] for i in missing))
+            encoded = dict(zip(missing_texts, self.embedding_function(missing_texts)))
+            self.cache.put_many(missing_texts, [encoded[text] for text in missing_texts])
+            for i in missing:
+                vectors[i] = np.asarray(encoded[input[i]], dtype=np.float32)
+        return vectors
@@ -0,0 +1,38 @@
+import json
+import os
+import threading
+from typing import List, Dict, Any, Optional
+
+# This class records, for every indexed file, the hash of its content and the IDs of
+# the chunks it produced. It lets the RetrievalAgent skip unchanged re-uploads and
+# delete the chunks of a file that are no longer present after it changes.
+class IndexManifest:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self._entries = json.load(f)
+
+    def get(self, source: str) -> Optional[Dict[str, Any]]:
+        # Returns {"file_hash": ..., "chunk_ids": [...]} for a file, or None if it was never indexed.
+        with self._lock:
+            return self._entries.get(source)
+
+    def set(self, source: str, file_hash: str, chunk_ids: List[str]):
+        with self._lock:
+            self._entries[source] = {"file_hash": file_hash, "chunk_ids": chunk_ids}
+            self._save()
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+            self._save()
+
+    def _save(self):
+        # Write to a temporary file first so a crash never leaves a half-written manifest.
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._entries, f)
+        os.replace(tmp_path, self.path)
@@ -1,103 +1,302 @@
 import os
-import pandas as pd
-import docx
-from pptx import Presentation
-from pypdf import PdfReader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from typing import List, Dict, Any
+import codecs
+import hashlib
+import json
+import time
+from itertools import islice
+from types import SimpleNamespace
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple
+
+from ..telemetry import timed
+
+# Number of CSV rows read and converted to text at a time.
+CSV_BLOCK_ROWS = 10000
+
+# Bytes of a text file read and decoded at a time, and the most characters of it passed
+# to the splitter as one document.
+TXT_READ_BYTES = 1024 * 1024
+TXT_BLOCK_CHARS = 100000
+
+# Target chunk size and overlap of the text splitter, in characters.
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 100
+
+# File types whose parsers yield many small units, with the metadata key numbering a unit
+# and the separator used when consecutive units are packed into one chunk.
+PACKED_UNITS = {
+    ".docx": ("paragraph", "\n\n"),
+    ".pptx": ("slide", "\n\n"),
+    ".csv": ("row", "\n")
+}
+
+# Slide layouts that open a new part of a presentation, so packing never crosses them.
+SECTION_LAYOUTS = {"Title Slide", "Section Header"}
+
+PPTX_SECTIONS_NS = "{http://schemas.microsoft.com/office/powerpoint/2010/main}"
 
 # This agent is responsible for all document processing tasks.
 # It takes raw uploaded files, parses them into text, and splits them into chunks.
+# Parsing and splitting are generators, so a file flows through page by page (or row
+# block by row block) and memory use does not grow with the size of the file.
+# The parsing libraries are imported by the parser that needs them, and the splitter is
+# built on first use: most parsing happens in worker processes, so the server itself
+# starts without loading them.
+# Word paragraphs, slides and CSV rows are usually far shorter than a chunk, so
+# consecutive ones are packed together (up to CHUNK_SIZE, never across a heading or
+# section break) before splitting. The chunk's metadata then gives the range it covers,
+# e.g. {"paragraph": 12, "paragraph_end": 19}. INGEST_PACK_UNITS=0 turns this off.
 class IngestionAgent:
-    def __init__(self):
-        # Initialize the text splitter. This will be used to break down large texts.
-        # It recursively tries to split on paragraphs, then sentences, then words.
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=100
-        )
+    def __init__(self, pack_units: Optional[bool] = None):
+        self._text_splitter = None
+        self.pack_units = pack_units if pack_units is not None else os.environ.get("INGEST_PACK_UNITS", "1") != "0"
+
+    @property
+    def text_splitter(self):
+        if self._text_splitter is None:
+            from langchain_text_splitters import RecursiveCharacterTextSplitter
+            # Initialize the text splitter. This will be used to break down large texts.
+            # It recursively tries to split on paragraphs, then sentences, then words.
+            self._text_splitter = RecursiveCharacterTextSplitter(
+                chunk_size=CHUNK_SIZE,
+                chunk_overlap=CHUNK_OVERLAP
+            )
+        return self._text_splitter
 
     def process_files(self, files: List[Any]) -> List[Dict[str, Any]]:
         # This is the main public method for the agent. It orchestrates the entire ingestion pipeline.
-        all_docs = []
-        # First, parse all uploaded files to extract text and initial metadata.
-        for file in files:
-            all_docs.extend(self._parse_document(file))
-            
-        # Second, chunk the parsed documents into smaller pieces.
         final_chunks = []
-        doc_id_counter = 0
-        for doc in all_docs:
+        for file in files:
+            # Parse each file to extract text and metadata, then chunk it into smaller pieces.
+            final_chunks.extend(self.iter_chunks(self._parse_document(file)))
+        return final_chunks
+
+    def split_documents(self, all_docs: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        # Splits parsed documents into chunks ready for the vector database.
+        return list(self.iter_chunks(all_docs))
+
+    def iter_chunks(self, docs: Iterable[Dict[str, Any]], timings: Optional[Dict[str, float]] = None,
+                    counts: Optional[Dict[str, int]] = None) -> Iterator[Dict[str, Any]]:
+        # Lazily splits a stream of parsed documents, yielding chunks as soon as each document is split.
+        # If `timings` is given, the seconds spent parsing and splitting are added to it. If
+        # `counts` is given, "merged_units" is increased by the number of chunks packing saved.
+        timings = timings if timings is not None else {}
+        counts = counts if counts is not None else {}
+        for doc in timed(docs, timings, "parse"):
+            # A packed document fits in one chunk, where each of its units would have been one.
+            counts["merged_units"] = counts.get("merged_units", 0) + doc.get("units", 1) - 1
+            start = time.perf_counter()
             split_chunks = self.text_splitter.split_text(doc["content"])
+            timings["split"] = timings.get("split", 0.0) + time.perf_counter() - start
             for chunk in split_chunks:
                 # Ensure each chunk retains the metadata of its parent document.
                 chunk_metadata = doc["metadata"].copy()
-                # Create a unique ID for each individual chunk for the vector database.
-                chunk_id = f"{doc['metadata']['source']}-chunk-{doc_id_counter}"
-                
-                final_chunks.append({
+                # Create a stable, content-addressed ID so re-uploads map to the same chunks.
+                chunk_id = make_chunk_id(chunk, chunk_metadata)
+
+                yield {
                     "id": chunk_id,
                     "content": chunk,
                     "metadata": chunk_metadata
-                })
-                doc_id_counter += 1
-        return final_chunks
+                }
 
-    def _parse_document(self, file: Any) -> List[Dict[str, Any]]:
+    def _parse_document(self, file: Any) -> Iterator[Dict[str, Any]]:
         # This private method acts as a router, calling the correct parser based on file extension.
         file_extension = os.path.splitext(file.filename)[1].lower()
-        
+
         if file_extension == ".pdf":
-            return self._parse_pdf(file)
+            docs = self._parse_pdf(file)
         elif file_extension == ".docx":
-            return self._parse_docx(file)
+            docs = self._parse_docx(file)
         elif file_extension == ".pptx":
-            return self._parse_pptx(file)
+            docs = self._parse_pptx(file)
         elif file_extension == ".csv":
-            return self._parse_csv(file)
+            docs = self._parse_csv(file)
         elif file_extension in [".txt", ".md"]:
-            return self._parse_txt(file)
+            docs = self._parse_txt(file)
         else:
-            return []
+            return iter([])
+        if self.pack_units and file_extension in PACKED_UNITS:
+            unit_key, separator = PACKED_UNITS[file_extension]
+            docs = pack_units(docs, unit_key, CHUNK_SIZE, separator)
+        return self._tag_file_type(docs, file_extension.lstrip("."))
+
+    def _tag_file_type(self, docs: Iterator[Dict[str, Any]], file_type: str) -> Iterator[Dict[str, Any]]:
+        # Records the file type in every document's metadata so searches can filter on it.
+        for doc in docs:
+            doc["metadata"]["file_type"] = file_type
+            yield doc
 
     # --- Specialized Parsing Methods ---
     # Each of the following methods handles a specific file type.
-    # They all return a list of dictionaries, each containing 'content' and 'metadata'.
+    # They are generators yielding dictionaries, each containing 'content' and 'metadata'.
+    # Units that begin a new heading or section are also marked with 'section_start'.
 
-    def _parse_pdf(self, file: Any) -> List[Dict[str, Any]]:
+    def _parse_pdf(self, file: Any) -> Iterator[Dict[str, Any]]:
+        # Pages are extracted one at a time, so only the current page's text is held in memory.
+        from pypdf import PdfReader
         reader = PdfReader(file.file)
-        chunks = []
         for i, page in enumerate(reader.pages):
             text = page.extract_text()
-            if text: chunks.append({"content": text, "metadata": {"source": file.filename, "page": i + 1}})
-        return chunks
+            if text: yield {"content": text, "metadata": {"source": file.filename, "page": i + 1}}
 
-    def _parse_docx(self, file: Any) -> List[Dict[str, Any]]:
+    def _parse_docx(self, file: Any) -> Iterator[Dict[str, Any]]:
+        import docx
         document = docx.Document(file.file)
-        chunks = []
+        section_start = False
         for i, para in enumerate(document.paragraphs):
-            if para.text.strip(): chunks.append({"content": para.text, "metadata": {"source": file.filename, "paragraph": i + 1}})
-        return chunks
+            style = para.style.name if para.style is not None else ""
+            section_start = section_start or style.startswith("Heading") or style == "Title"
+            if para.text.strip():
+                yield {"content": para.text, "metadata": {"source": file.filename, "paragraph": i + 1},
+                       "section_start": section_start}
+                section_start = False
+            # A section break is stored on the last paragraph of the section it ends.
+            if para._p.pPr is not None and para._p.pPr.sectPr is not None:
+                section_start = True
 
-    def _parse_pptx(self, file: Any) -> List[Dict[str, Any]]:
+    def _parse_pptx(self, file: Any) -> Iterator[Dict[str, Any]]:
+        from pptx import Presentation
         pres = Presentation(file.file)
-        chunks = []
+        # The first slide of every section the deck is divided into (PowerPoint 2010 sections).
+        section_first_slides = set()
+        for section in pres.element.iter(PPTX_SECTIONS_NS + "section"):
+            slide_ids = [int(slide_id.get("id")) for slide_id in section.iter(PPTX_SECTIONS_NS + "sldId")]
+            if slide_ids: section_first_slides.add(slide_ids[0])
+        section_start = False
         for slide_num, slide in enumerate(pres.slides):
+            section_start = section_start or slide.slide_id in section_first_slides or slide.slide_layout.name in SECTION_LAYOUTS
             slide_text = ""
             for shape in slide.shapes:
                 if hasattr(shape, "text"): slide_text += shape.text + "\n"
-            if slide_text.strip(): chunks.append({"content": slide_text, "metadata": {"source": file.filename, "slide": slide_num + 1}})
-        return chunks
-
-    def _parse_csv(self, file: Any) -> List[Dict[str, Any]]:
-        df = pd.read_csv(file.file)
-        chunks = []
-        # Convert each row of the CSV into a single text string.
-        for i, row in df.iterrows():
-            row_text = ", ".join(f"{col}: {val}" for col, val in row.items())
-            chunks.append({"content": row_text, "metadata": {"source": file.filename, "row": i + 1}})
-        return chunks
-
-    def _parse_txt(self, file: Any) -> List[Dict[str, Any]]:
-        content = file.file.read().decode('utf-8')
-        return [{"content": content, "metadata": {"source": file.filename}}]
\ No newline at end of file
+            if slide_text.strip():
+                yield {"content": slide_text, "metadata": {"source": file.filename, "slide": slide_num + 1},
+                       "section_start": section_start}
+                section_start = False
+
+    def _parse_csv(self, file: Any) -> Iterator[Dict[str, Any]]:
+        # The CSV is read in blocks of rows. Each row is converted into a single
+        # "column: value, ..." string with vectorized column operations rather than row by row.
+        import pandas as pd
+        for block in pd.read_csv(file.file, chunksize=CSV_BLOCK_ROWS):
+            row_text = None
+            for col in block.columns:
+                column_text = f"{col}: " + block[col].astype(str)
+                row_text = column_text if row_text is None else row_text + ", " + column_text
+            if row_text is None:
+                continue
+            # The row index keeps counting across blocks, so row numbers stay file-relative.
+            for row_number, text in zip((block.index + 1).tolist(), row_text.tolist()):
+                yield {"content": text, "metadata": {"source": file.filename, "row": row_number}}
+
+    def _parse_txt(self, file: Any) -> Iterator[Dict[str, Any]]:
+        # The file is decoded incrementally and yielded in documents of at most TXT_BLOCK_CHARS,
+        # each ending at a paragraph (or else line) break where possible, so only about one
+        # block of text is held in memory. A smaller file is a single document.
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        pending = ""
+        while True:
+            data = file.file.read(TXT_READ_BYTES)
+            pending += decoder.decode(data, final=not data)
+            while len(pending) > TXT_BLOCK_CHARS:
+                end = _block_end(pending, TXT_BLOCK_CHARS)
+                yield {"content": pending[:end], "metadata": {"source": file.filename}}
+                pending = pending[end:]
+            if not data:
+                break
+        if pending:
+            yield {"content": pending, "metadata": {"source": file.filename}}
+
+
+def _block_end(text: str, limit: int) -> int:
+    # The end of the last paragraph, or else line, that fits within `limit` characters.
+    for separator in ("\n\n", "\n"):
+        end = text.rfind(separator, 0, limit)
+        if end > 0:
+            return end + len(separator)
+    return limit
+
+
+# --- Unit Packing ---
+def pack_units(docs: Iterable[Dict[str, Any]], unit_key: str, max_chars: int, separator: str = "\n\n") -> Iterator[Dict[str, Any]]:
+    # Merges runs of consecutive units (paragraphs, slides, rows) into documents of at most
+    # `max_chars`, starting a new one at every unit marked 'section_start'. A unit longer
+    # than `max_chars` is passed on alone and left to the splitter. Each document records
+    # how many units it holds under 'units'.
+    group: List[Dict[str, Any]] = []
+    size = 0
+    for doc in docs:
+        length = len(doc["content"].strip())
+        if group and (doc.get("section_start") or size + len(separator) + length > max_chars):
+            yield _merge_units(group, unit_key, separator)
+            group, size = [], 0
+        size += length + (len(separator) if group else 0)
+        group.append(doc)
+    if group:
+        yield _merge_units(group, unit_key, separator)
+
+
+def _merge_units(group: List[Dict[str, Any]], unit_key: str, separator: str) -> Dict[str, Any]:
+    # The metadata is the first unit's, plus the number of the last one, e.g. "slide_end".
+    metadata = group[0]["metadata"].copy()
+    metadata[f"{unit_key}_end"] = group[-1]["metadata"][unit_key]
+    return {"content": separator.join(doc["content"].strip() for doc in group), "metadata": metadata, "units": len(group)}
+
+
+def iter_batches(items: Iterable[Any], batch_size: int) -> Iterator[List[Any]]:
+    # Groups a stream into lists of at most `batch_size` items without materializing the stream.
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+# --- Content Addressing ---
+def make_chunk_id(content: str, metadata: Dict[str, Any]) -> str:
+    # The ID is derived from the chunk text and its location (source, page, ...), so an
+    # unchanged chunk always gets the same ID and a changed one always gets a new ID.
+    digest = hashlib.sha256()
+    digest.update(json.dumps(metadata, sort_keys=True).encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(content.encode("utf-8"))
+    return f"{metadata['source']}-{digest.hexdigest()[:32]}"
+
+
+def file_sha256(path: str) -> str:
+    # Hashes a file on disk in blocks, without reading it into memory at once.
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# --- Spooled Upload Support ---
+# UploadFile objects cannot be sent to another process, so uploads are first
+# spooled to disk and described by this small, picklable record instead.
+# `sha256` is the file's hash when it is already known (e.g. verified on upload).
+class SpooledUpload:
+    def __init__(self, filename: str, path: str, sha256: Optional[str] = None):
+        self.filename = filename
+        self.path = path
+        self.sha256 = sha256
+
+
+def iter_upload_chunks(upload: SpooledUpload, agent: IngestionAgent = None,
+                       timings: Optional[Dict[str, float]] = None,
+                       counts: Optional[Dict[str, int]] = None) -> Iterator[Dict[str, Any]]:
+    # Streams the chunks of a spooled file: parse, pack, then split, one document at a time.
+    # The regular parsers only need `.filename` and `.file` attributes.
+    agent = agent or IngestionAgent()
+    with open(upload.path, "rb") as fh:
+        file = SimpleNamespace(filename=upload.filename, file=fh)
+        yield from agent.iter_chunks(agent._parse_document(file), timings, counts)
+
+
+def chunk_spooled_upload(upload: SpooledUpload) -> Tuple[List[Dict[str, Any]], Dict[str, float], Dict[str, int]]:
+    # Entry point for worker processes: parses and splits a whole (reasonably sized) file.
+    # Returns the chunks, the seconds spent parsing and splitting them, and the packing counts.
+    timings: Dict[str, float] = {}
+    counts: Dict[str, int] = {}
+    return list(iter_upload_chunks(upload, timings=timings, counts=counts)), timings, counts
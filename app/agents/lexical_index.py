@@ -0,0 +1,112 @@
+import math
+import re
+import threading
+from collections import Counter
+from typing import List, Dict, Any, Tuple, Optional, Collection
+
+from .metadata_filters import matches_where
+
+# Words, numbers and compound identifiers such as "AB-1234", "v2.1" or "order_id".
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-_./:][a-z0-9]+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    # Compound identifiers are kept whole (so "AB-1234" matches exactly) and are also
+    # split into their parts (so "1234" on its own still matches).
+    tokens = []
+    for match in TOKEN_PATTERN.findall(text.lower()):
+        tokens.append(match)
+        parts = re.split(r"[-_./:]", match)
+        if len(parts) > 1:
+            tokens.extend(part for part in parts if part)
+    return tokens
+
+
+# This class is an in-process inverted index scored with Okapi BM25.
+# It complements dense vector search, which tends to miss exact identifiers,
+# part numbers and field values. It keeps the chunk text and metadata so lexical
+# hits can be returned without a round trip to the vector database.
+class BM25Index:
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._docs: Dict[str, Dict[str, Any]] = {}
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._total_length = 0
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def __contains__(self, chunk_id: str) -> bool:
+        return chunk_id in self._docs
+
+    def add(self, chunks: List[Dict[str, Any]]):
+        # Indexes chunks in the same {"id", "content", "metadata"} form used by the RetrievalAgent.
+        with self._lock:
+            for chunk in chunks:
+                if chunk["id"] in self._docs:
+                    continue
+                term_counts = Counter(tokenize(chunk["content"]))
+                length = sum(term_counts.values())
+                self._docs[chunk["id"]] = {
+                    "content": chunk["content"],
+                    "metadata": chunk["metadata"],
+                    "length": length,
+                    "terms": list(term_counts)
+                }
+                self._total_length += length
+                for term, count in term_counts.items():
+                    self._postings.setdefault(term, {})[chunk["id"]] = count
+
+    def remove(self, ids: List[str]):
+        with self._lock:
+            for chunk_id in ids:
+                doc = self._docs.pop(chunk_id, None)
+                if doc is None:
+                    continue
+                self._total_length -= doc["length"]
+                for term in doc["terms"]:
+                    postings = self._postings.get(term)
+                    if postings is not None:
+                        postings.pop(chunk_id, None)
+                        if not postings:
+                            del self._postings[term]
+
+    def clear(self):
+        with self._lock:
+            self._docs = {}
+            self._postings = {}
+            self._total_length = 0
+
+    def get(self, chunk_id: str) -> Dict[str, Any]:
+        doc = self._docs[chunk_id]
+        return {"content": doc["content"], "metadata": doc["metadata"]}
+
+    def search(self, query: str, top_k: int = 5, where: Optional[Dict[str, Any]] = None,
+               also_ids: Optional[Collection[str]] = None) -> List[Tuple[str, float]]:
+        # Returns (chunk_id, score) pairs, best first. `where` restricts the search to chunks
+        # whose metadata matches, using the same clause format as the vector query, and to
+        # those in `also_ids`.
+        allowed: Dict[str, bool] = {}
+        with self._lock:
+            doc_count = len(self._docs)
+            if doc_count == 0:
+                return []
+            average_length = self._total_length / doc_count
+            scores: Dict[str, float] = {}
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for chunk_id, term_frequency in postings.items():
+                    if where is not None:
+                        if chunk_id not in allowed:
+                            allowed[chunk_id] = matches_where(self._docs[chunk_id]["metadata"], where) or \
+                                (also_ids is not None and chunk_id in also_ids)
+                        if not allowed[chunk_id]:
+                            continue
+                    length_norm = self.k1 * (1 - self.b + self.b * self._docs[chunk_id]["length"] / average_length)
+                    scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * term_frequency * (self.k1 + 1) / (term_frequency + length_norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
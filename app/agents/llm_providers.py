@@ -0,0 +1,297 @@
+import asyncio
+import os
+import threading
+from typing import List, Dict, Any, AsyncIterator, Optional
+
+from ..telemetry import LLM_REQUESTS
+
+# Shared instructions for the chat-style providers (Groq and Hugging Face).
+SYSTEM_PROMPT = "You are a helpful AI assistant. Your task is to synthesize a clear and concise answer to the user's question based exclusively on the provided context. If the answer is not in the context, say 'I could not find an answer to that in the provided documents.'"
+
+# --- Provider Errors ---
+# Providers translate their SDK-specific exceptions into these, so the LLMResponseAgent
+# can decide when to fall back to another model and the API can pick a status code.
+class ProviderError(Exception):
+    pass
+
+class ProviderQuotaError(ProviderError):
+    # The provider rejected the request because a rate limit or quota was exhausted.
+    pass
+
+class ProviderTimeoutError(ProviderError):
+    # The provider did not answer (or stopped streaming) within its timeout.
+    pass
+
+class ProviderNotConfiguredError(ProviderError):
+    # No API key is set for the requested model (and for none of its fallbacks).
+    pass
+
+class UnknownModelError(ProviderError):
+    # The requested model is not one this server knows about (a client error).
+    pass
+
+
+def outcome_of(error: Exception) -> str:
+    if isinstance(error, ProviderQuotaError):
+        return "quota"
+    if isinstance(error, ProviderTimeoutError):
+        return "timeout"
+    return "error"
+
+
+# This is the base class for every LLM backend. Subclasses implement `_complete` and
+# `_stream`; the base class wraps them with a per-provider concurrency limit and timeout
+# and maps SDK errors onto the ProviderError hierarchy via `_translate_error`.
+# The SDK client is built by `_build_client` the first time `client` is used (or when the
+# server warms up), so importing the app does not import every SDK or open connections.
+class LLMProvider:
+    name = "base"
+
+    def __init__(self, max_concurrency: int = 8, timeout: float = 60.0):
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = self._build_client()
+        return self._client
+
+    def _build_client(self):
+        return None
+
+    async def complete(self, context: str, query: str) -> str:
+        async with self._semaphore:
+            try:
+                answer = await asyncio.wait_for(self._complete(context, query), timeout=self.timeout)
+            except asyncio.TimeoutError:
+                self._count("timeout")
+                raise ProviderTimeoutError(f"{self.name} did not respond within {self.timeout} seconds.")
+            except Exception as e:
+                error = e if isinstance(e, ProviderError) else self._translate_error(e)
+                self._count(outcome_of(error))
+                if error is e:
+                    raise
+                raise error from e
+            self._count("success")
+            return answer
+
+    async def stream(self, context: str, query: str) -> AsyncIterator[str]:
+        # The timeout applies to the wait for each fragment, not to the whole answer.
+        async with self._semaphore:
+            try:
+                fragments = self._stream(context, query).__aiter__()
+                while True:
+                    try:
+                        fragment = await asyncio.wait_for(fragments.__anext__(), timeout=self.timeout)
+                    except StopAsyncIteration:
+                        break
+                    if fragment:
+                        yield fragment
+            except asyncio.TimeoutError:
+                self._count("timeout")
+                raise ProviderTimeoutError(f"{self.name} stalled for more than {self.timeout} seconds.")
+            except Exception as e:
+                error = e if isinstance(e, ProviderError) else self._translate_error(e)
+                self._count(outcome_of(error))
+                if error is e:
+                    raise
+                raise error from e
+            self._count("success")
+
+    def _count(self, outcome: str):
+        # Feeds the per-provider request and error rates exported on /metrics.
+        LLM_REQUESTS.inc(provider=self.name, outcome=outcome)
+
+    async def aclose(self):
+        # Releases pooled connections; overridden by providers that hold any.
+        pass
+
+    async def _complete(self, context: str, query: str) -> str:
+        raise NotImplementedError
+
+    async def _stream(self, context: str, query: str) -> AsyncIterator[str]:
+        raise NotImplementedError
+        yield
+
+    def _translate_error(self, error: Exception) -> Exception:
+        return error
+
+    def _build_chat_messages(self, context: str, query: str) -> List[Dict[str, str]]:
+        return [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": f"CONTEXT: {context} \n\n QUESTION: {query}"}
+        ]
+
+
+# --- Google Gemini ---
+class GeminiProvider(LLMProvider):
+    name = "gemini"
+
+    def __init__(self, api_key: str, model: str = "gemini-1.5-flash", **kwargs):
+        super().__init__(**kwargs)
+        self.api_key = api_key
+        self.model = model
+
+    def _build_client(self):
+        import google.generativeai as genai
+        genai.configure(api_key=self.api_key)
+        # The SDK keeps a single async gRPC channel per model, which is reused for every call.
+        return genai.GenerativeModel(self.model)
+
+    async def _complete(self, context: str, query: str) -> str:
+        response = await self.client.generate_content_async(self._build_prompt(context, query))
+        return response.text
+
+    async def _stream(self, context: str, query: str) -> AsyncIterator[str]:
+        response = await self.client.generate_content_async(self._build_prompt(context, query), stream=True)
+        async for chunk in response:
+            yield chunk.text
+
+    def _translate_error(self, error: Exception) -> Exception:
+        from google.api_core.exceptions import ResourceExhausted, DeadlineExceeded
+        if isinstance(error, ResourceExhausted):
+            return ProviderQuotaError(str(error))
+        if isinstance(error, DeadlineExceeded):
+            return ProviderTimeoutError(str(error))
+        return error
+
+    def _build_prompt(self, context: str, query: str) -> str:
+        return f"""
+            You are a helpful AI assistant. Your task is to synthesize a clear and concise answer to the user's question based exclusively on the provided `CONTEXT` below.
+            If the answer cannot be found within the context, you must state 'I could not find an answer to that in the provided documents.'
+            --- CONTEXT BEGIN ---
+            {context}
+            --- CONTEXT END ---
+            Question: {query}
+            """
+
+
+# --- Groq ---
+class GroqProvider(LLMProvider):
+    name = "groq"
+
+    def __init__(self, api_key: str, model: str = "llama-3.1-8b-instant", max_concurrency: int = 8, **kwargs):
+        super().__init__(max_concurrency=max_concurrency, **kwargs)
+        self.api_key = api_key
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.http_client: Optional[Any] = None
+
+    def _build_client(self):
+        import httpx
+        from groq import AsyncGroq
+        # One pooled HTTP client, sized to the concurrency limit, is shared by all requests.
+        self.http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency)
+        )
+        return AsyncGroq(api_key=self.api_key, http_client=self.http_client, max_retries=0)
+
+    async def _complete(self, context: str, query: str) -> str:
+        # Groq uses the standard OpenAI message format (system and user roles).
+        chat_completion = await self.client.chat.completions.create(
+            messages=self._build_chat_messages(context, query),
+            model=self.model
+        )
+        return chat_completion.choices[0].message.content
+
+    async def _stream(self, context: str, query: str) -> AsyncIterator[str]:
+        stream = await self.client.chat.completions.create(
+            messages=self._build_chat_messages(context, query),
+            model=self.model,
+            stream=True
+        )
+        async for chunk in stream:
+            # The final chunk of an OpenAI-style stream carries no content.
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    def _translate_error(self, error: Exception) -> Exception:
+        from groq import RateLimitError, APITimeoutError
+        if isinstance(error, RateLimitError):
+            return ProviderQuotaError(str(error))
+        if isinstance(error, APITimeoutError):
+            return ProviderTimeoutError(str(error))
+        return error
+
+    async def aclose(self):
+        if self.http_client is not None:
+            await self.http_client.aclose()
+
+
+# --- Hugging Face Inference API ---
+class HuggingFaceProvider(LLMProvider):
+    name = "huggingface"
+
+    def __init__(self, api_key: str, model: str = "meta-llama/Meta-Llama-3-8B-Instruct", **kwargs):
+        super().__init__(**kwargs)
+        self.api_key = api_key
+        self.model = model
+
+    def _build_client(self):
+        from huggingface_hub import AsyncInferenceClient
+        return AsyncInferenceClient(model=self.model, token=self.api_key)
+
+    async def _complete(self, context: str, query: str) -> str:
+        response = await self.client.chat_completion(
+            messages=self._build_chat_messages(context, query),
+            max_tokens=500
+        )
+        return response.choices[0].message.content
+
+    async def _stream(self, context: str, query: str) -> AsyncIterator[str]:
+        stream = await self.client.chat_completion(
+            messages=self._build_chat_messages(context, query),
+            max_tokens=500,
+            stream=True
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    def _translate_error(self, error: Exception) -> Exception:
+        from huggingface_hub.errors import HfHubHTTPError
+        if isinstance(error, HfHubHTTPError) and error.response is not None and error.response.status_code == 429:
+            return ProviderQuotaError(str(error))
+        return error
+
+
+# --- Local Stub ---
+# A deterministic, offline provider for tests and benchmarks. `delay` simulates latency
+# and `fail_with` makes every call raise, which is useful for exercising fallbacks.
+class StubProvider(LLMProvider):
+    name = "stub"
+
+    def __init__(self, delay: float = 0.0, fail_with: Exception = None, **kwargs):
+        super().__init__(**kwargs)
+        self.delay = delay
+        self.fail_with = fail_with
+
+    async def _complete(self, context: str, query: str) -> str:
+        await asyncio.sleep(self.delay)
+        if self.fail_with is not None:
+            raise self.fail_with
+        return self._answer(context, query)
+
+    async def _stream(self, context: str, query: str) -> AsyncIterator[str]:
+        await asyncio.sleep(self.delay)
+        if self.fail_with is not None:
+            raise self.fail_with
+        for word in self._answer(context, query).split(" "):
+            yield word + " "
+
+    def _answer(self, context: str, query: str) -> str:
+        return f"Stub answer to '{query}' using {len(context)} characters of context."
+
+
+def provider_settings(name: str) -> Dict[str, Any]:
+    # Per-provider limits, e.g. GROQ_MAX_CONCURRENCY, falling back to LLM_MAX_CONCURRENCY / LLM_TIMEOUT_SECONDS.
+    prefix = name.upper()
+    return {
+        "max_concurrency": int(os.environ.get(f"{prefix}_MAX_CONCURRENCY", os.environ.get("LLM_MAX_CONCURRENCY", "8"))),
+        "timeout": float(os.environ.get(f"{prefix}_TIMEOUT_SECONDS", os.environ.get("LLM_TIMEOUT_SECONDS", "60")))
+    }
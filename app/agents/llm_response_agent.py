@@ -1,81 +1,158 @@
+import asyncio
 import os
-import google.generativeai as genai
-from groq import Groq
-from huggingface_hub import InferenceClient
 from dotenv import load_dotenv
-from typing import List, Dict
+from typing import List, Dict, AsyncIterator, Optional
+
+from .llm_providers import (
+    LLMProvider, GeminiProvider, GroqProvider, HuggingFaceProvider, StubProvider,
+    ProviderError, ProviderQuotaError, ProviderTimeoutError, ProviderNotConfiguredError, UnknownModelError,
+    provider_settings
+)
 
 # Load API keys from the .env file into environment variables
 load_dotenv()
 
+# Errors after which the next model in a fallback chain is tried.
+FALLBACK_ERRORS = (ProviderQuotaError, ProviderTimeoutError)
+
+# Hosted models and the environment variable holding each one's API key. A model whose
+# key is not set is disabled rather than failing when the app starts.
+PROVIDER_CLASSES = {
+    "gemini": (GeminiProvider, "GOOGLE_API_KEY"),
+    "groq": (GroqProvider, "GROQ_API_KEY"),
+    "huggingface": (HuggingFaceProvider, "HUGGINGFACE_API_KEY")
+}
+
 # This agent is responsible for communicating with all external Large Language Models.
 # It formats the final prompt and generates the synthesized answer.
+# Calls are asynchronous and go through pluggable providers, each with its own pooled
+# connections, concurrency limit and timeout. On quota or timeout errors a request can
+# fall back to the next model in a configurable chain, and it can optionally be hedged:
+# if the current model is slower than a threshold, the next one is started in parallel
+# and whichever answers first wins.
 class LLMResponseAgent:
-    def __init__(self):
-        # --- LLM Client Initialization ---
-        # Initialize the client for the Google Gemini API.
-        self.gemini_client = genai.GenerativeModel('gemini-1.5-flash')
-        genai.configure(api_key=os.environ["GOOGLE_API_KEY"])
-
-        # Initialize the client for the Groq API.
-        self.groq_client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
-
-        # Initialize the client for the Hugging Face Inference API.
-        self.hf_client = InferenceClient(
-            model="meta-llama/Meta-Llama-3-8B-Instruct",
-            token=os.environ.get("HUGGINGFACE_API_KEY")
-        )
-
-    def generate_response(self, model_name: str, context_chunks: List[Dict], history: List[Dict], query: str) -> str:
-        
+    def __init__(self, providers: Optional[Dict[str, LLMProvider]] = None,
+                 fallbacks: Optional[Dict[str, List[str]]] = None, hedge_after: Optional[float] = None):
+        # --- LLM Provider Initialization ---
+        # Providers are cheap to construct; each SDK client is only built on first use.
+        self.disabled: List[str] = []
+        if providers is None:
+            providers = {}
+            for name, (provider_class, key_variable) in PROVIDER_CLASSES.items():
+                api_key = os.environ.get(key_variable)
+                if api_key:
+                    providers[name] = provider_class(api_key=api_key, **provider_settings(name))
+                else:
+                    self.disabled.append(name)
+            # Deterministic offline model for tests and benchmarks, selectable as "stub" only
+            # when LLM_ENABLE_STUB=1, so production clients cannot pick it.
+            if os.environ.get("LLM_ENABLE_STUB", "0") != "0":
+                providers["stub"] = StubProvider(**provider_settings("stub"))
+        self.providers = providers
+
+        # Fallback chains, e.g. LLM_FALLBACKS="gemini=groq,huggingface;groq=gemini".
+        self.fallbacks = fallbacks if fallbacks is not None else parse_fallbacks(os.environ.get("LLM_FALLBACKS", ""))
+
+        # Seconds to wait before hedging with the next model in the chain; 0 disables hedging.
+        self.hedge_after = hedge_after if hedge_after is not None else float(os.environ.get("LLM_HEDGE_AFTER_SECONDS", "0"))
+
+    async def generate_response(self, model_name: str, context_chunks: List[Dict], history: List[Dict], query: str) -> str:
+        self._check_model(model_name)
+
         # --- Context Preparation ---
         # Consolidate all retrieved document chunks into a single string for the prompt.
+        context_for_llm = self._build_context(context_chunks)
+        return await self._complete_with_fallback(self._chain(model_name), context_for_llm, query)
+
+    def warmup(self):
+        # Builds every configured SDK client ahead of the first request (run by the
+        # server's background warmup, since importing an SDK can take a second).
+        for provider in self.providers.values():
+            provider.client
+
+    async def stream_response(self, model_name: str, context_chunks: List[Dict], history: List[Dict], query: str) -> AsyncIterator[str]:
+        # Streaming counterpart of generate_response: yields text fragments as the provider produces them.
+        # A stream can only fall back before its first fragment, since text already sent cannot be
+        # taken back; for the same reason streams are not hedged.
+        self._check_model(model_name)
+        context_for_llm = self._build_context(context_chunks)
+        chain = self._chain(model_name)
+        for position, name in enumerate(chain):
+            started = False
+            try:
+                async for fragment in self.providers[name].stream(context_for_llm, query):
+                    started = True
+                    yield fragment
+                return
+            except FALLBACK_ERRORS:
+                if started or position == len(chain) - 1:
+                    raise
+
+    async def aclose(self):
+        for provider in self.providers.values():
+            await provider.aclose()
+
+    def _check_model(self, model_name: str):
+        if model_name not in self.providers and model_name not in self.disabled:
+            raise UnknownModelError(f"Unknown model {model_name!r}.")
+
+    def _chain(self, model_name: str) -> List[str]:
+        # The requested model followed by its configured fallbacks, skipping unknown and
+        # disabled names. A disabled model is served by its fallbacks when it has any.
+        chain = [model_name] + self.fallbacks.get(model_name, [])
+        chain = [name for name in dict.fromkeys(chain) if name in self.providers]
+        if not chain:
+            raise ProviderNotConfiguredError(f"{model_name} is not configured: set its API key to enable it.")
+        return chain
+
+    async def _complete_with_fallback(self, chain: List[str], context: str, query: str) -> str:
+        remaining = list(chain)
+        running: Dict[asyncio.Task, str] = {}
+        last_error: Optional[ProviderError] = None
+
+        def launch_next():
+            name = remaining.pop(0)
+            running[asyncio.ensure_future(self.providers[name].complete(context, query))] = name
+
+        launch_next()
+        try:
+            while running:
+                # While there are untried models, only wait `hedge_after` seconds before hedging.
+                hedge_timeout = self.hedge_after if self.hedge_after > 0 and remaining else None
+                done, _ = await asyncio.wait(running, timeout=hedge_timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    launch_next()
+                    continue
+
+                for task in done:
+                    running.pop(task)
+                    try:
+                        return task.result()
+                    except FALLBACK_ERRORS as e:
+                        last_error = e
+
+                # Every in-flight attempt failed with a retryable error: move down the chain.
+                if not running and remaining:
+                    launch_next()
+            raise last_error
+        finally:
+            # Cancel the slower attempts once one has answered (or a fatal error propagated).
+            for task in running:
+                task.cancel()
+
+    def _build_context(self, context_chunks: List[Dict]) -> str:
         context_for_llm = ""
         for source in context_chunks:
             context_for_llm += source['content'] + "\n\n"
+        return context_for_llm
+
 
-        # --- Model-Specific Logic ---
-        # Select the appropriate model and prompt format based on the user's choice.
-        if model_name == 'gemini':
-            prompt = f"""
-            You are a helpful AI assistant. Your task is to synthesize a clear and concise answer to the user's question based exclusively on the provided `CONTEXT` below.
-            If the answer cannot be found within the context, you must state 'I could not find an answer to that in the provided documents.'
-            --- CONTEXT BEGIN ---
-            {context_for_llm}
-            --- CONTEXT END ---
-            Question: {query}
-            """
-            response = self.gemini_client.generate_content(prompt)
-            return response.text
-
-        elif model_name == 'groq':
-            # Groq uses the standard OpenAI message format (system and user roles).
-            chat_completion = self.groq_client.chat.completions.create(
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a helpful AI assistant. Your task is to synthesize a clear and concise answer to the user's question based exclusively on the provided context. If the answer is not in the context, say 'I could not find an answer to that in the provided documents.'"
-                    },
-                    {
-                        "role": "user",
-                        "content": f"CONTEXT: {context_for_llm} \n\n QUESTION: {query}"
-                    }
-                ],
-                model="llama-3.1-8b-instant", 
-            )
-            return chat_completion.choices[0].message.content
-        
-        elif model_name == 'huggingface':
-            # Hugging Face also uses a similar message format.
-            system_prompt = "You are a helpful AI assistant. Your task is to synthesize a clear and concise answer to the user's question based exclusively on the provided context. If the answer is not in the context, say 'I could not find an answer to that in the provided documents.'"
-            user_prompt = f"CONTEXT: {context_for_llm} \n\n QUESTION: {query}"
-            
-            response = self.hf_client.chat_completion(
-                messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt}],
-                max_tokens=500
-            )
-            return response.choices[0].message.content
-
-        else:
-            # Fallback for an invalid model name.
-            return "Error: Invalid model selected."
\ No newline at end of file
+def parse_fallbacks(spec: str) -> Dict[str, List[str]]:
+    # Parses "gemini=groq,huggingface;groq=gemini" into {"gemini": ["groq", "huggingface"], "groq": ["gemini"]}.
+    fallbacks = {}
+    for entry in spec.split(";"):
+        if "=" not in entry:
+            continue
+        model, chain = entry.split("=", 1)
+        fallbacks[model.strip()] = [name.strip() for name in chain.split(",") if name.strip()]
+    return fallbacks
@@ -0,0 +1,396 @@
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import weakref
+from types import SimpleNamespace
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+from .metadata_filters import where_to_sql
+
+# Rows scored per step of a brute-force search. Bounds the temporary float32 copy of a
+# quantized block (16384 x 384 dims is 24 MB) while keeping each matrix product large.
+BLOCK_ROWS = 16384
+
+# Initial number of vector slots; the files double in size whenever they fill up.
+INITIAL_CAPACITY = 1024
+
+DTYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+
+
+# This class is a lightweight alternative to ChromaDB's client. It implements the part of
+# the client and collection API that the RetrievalAgent uses, so it can be swapped in
+# with VECTOR_BACKEND=memmap. Each collection is a directory holding:
+#   vectors.bin  - a contiguous, memory-mapped (capacity x dim) array of unit vectors,
+#                  stored as float32, float16, or int8 with a per-vector scale
+#   scales.bin   - the float32 int8 scales (int8 only)
+#   live.bin     - one byte per row; 0 marks a deleted row
+#   chunks.sqlite- chunk ID, text and JSON metadata per row
+#   meta.json    - dimension, dtype, row count and capacity
+# Opening a collection maps the files without reading them, so it is nearly instant, and
+# processes that open the same collection share its pages through the OS page cache.
+class MemmapVectorStore:
+    def __init__(self, path: str, dtype: str = "int8"):
+        if dtype not in DTYPES:
+            raise ValueError(f"Unsupported vector dtype {dtype!r}; expected one of {sorted(DTYPES)}.")
+        self.path = path
+        self.dtype = dtype
+        os.makedirs(path, exist_ok=True)
+        # Collections currently open, so each is opened once and can be closed before it is deleted.
+        self._open: "weakref.WeakValueDictionary[str, MemmapCollection]" = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+
+    def get_or_create_collection(self, name: str, embedding_function: Any = None, **kwargs) -> "MemmapCollection":
+        # Embeddings are always passed in explicitly, so the embedding function is not needed.
+        with self._lock:
+            collection = self._open.get(name)
+            if collection is None:
+                collection = MemmapCollection(name, os.path.join(self.path, name), self.dtype)
+                self._open[name] = collection
+            return collection
+
+    def get_collection(self, name: str, embedding_function: Any = None, **kwargs) -> "MemmapCollection":
+        # Like Chroma, raises instead of creating a collection that does not exist.
+        if not os.path.isdir(os.path.join(self.path, name)):
+            raise ValueError(f"Collection {name} does not exist.")
+        return self.get_or_create_collection(name)
+
+    def list_collections(self) -> List[Any]:
+        return [SimpleNamespace(name=name) for name in sorted(os.listdir(self.path))
+                if os.path.isdir(os.path.join(self.path, name))]
+
+    def delete_collection(self, name: str):
+        # Open files cannot be deleted on Windows, so the collection is closed first.
+        with self._lock:
+            collection = self._open.pop(name, None)
+            if collection is not None:
+                collection.close()
+            if os.path.isdir(os.path.join(self.path, name)):
+                shutil.rmtree(os.path.join(self.path, name))
+
+
+class MemmapCollection:
+    def __init__(self, name: str, path: str, dtype: str):
+        self.name = name
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.RLock()
+        # Serializes writers, which may wait (releasing _lock) while the files are resized.
+        self._write_lock = threading.Lock()
+        # Searches score outside the lock using the current maps; a resize waits until none
+        # is running, and new ones wait for the resize.
+        self._searches_done = threading.Condition(self._lock)
+        self._active_searches = 0
+        self._resizing = False
+
+        self._db = sqlite3.connect(os.path.join(path, "chunks.sqlite"), check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS chunks (row INTEGER PRIMARY KEY, id TEXT UNIQUE NOT NULL, "
+                         "document TEXT NOT NULL, metadata TEXT NOT NULL)")
+        self._db.commit()
+
+        meta_path = os.path.join(path, "meta.json")
+        meta = {}
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        # An existing collection keeps the dtype it was written with.
+        self.dtype = meta.get("dtype", dtype)
+        self.dim: Optional[int] = meta.get("dim")
+        self._capacity = meta.get("capacity", 0)
+        # Rows committed to SQLite after meta.json was last written are still valid, since
+        # their vectors are flushed first.
+        max_row = self._db.execute("SELECT MAX(row) FROM chunks").fetchone()[0]
+        self._count = max(meta.get("count", 0), max_row + 1 if max_row is not None else 0)
+
+        self._vectors = self._scales = self._live = None
+        if self.dim is not None and self._capacity:
+            self._map_files()
+        # Bumped whenever rows are renumbered, so a search that raced with it is repeated.
+        self._layout_version = 0
+
+    # --- Storage ---
+
+    def _map_files(self):
+        self._vectors = np.memmap(os.path.join(self.path, "vectors.bin"), dtype=DTYPES[self.dtype], mode="r+",
+                                  shape=(self._capacity, self.dim))
+        self._live = np.memmap(os.path.join(self.path, "live.bin"), dtype=np.uint8, mode="r+", shape=(self._capacity,))
+        if self.dtype == "int8":
+            self._scales = np.memmap(os.path.join(self.path, "scales.bin"), dtype=np.float32, mode="r+",
+                                     shape=(self._capacity,))
+
+    def _unmap_files(self):
+        # Flushes the maps and drops them, which closes the files. Called with the lock held
+        # and no search running (see _wait_for_searches).
+        for array in (self._vectors, self._scales, self._live):
+            if array is not None:
+                array.flush()
+        self._vectors = self._scales = self._live = None
+
+    def _wait_for_searches(self):
+        # Called with the lock held; returns (holding it again) once no search is scoring with
+        # the current maps. New searches wait meanwhile, so they cannot start on the old maps.
+        self._resizing = True
+        try:
+            self._searches_done.wait_for(lambda: self._active_searches == 0)
+        finally:
+            self._resizing = False
+            self._searches_done.notify_all()
+
+    def _grow(self, needed: int):
+        # Extends the files (new space reads as zeros, i.e. not live) and maps them again.
+        # Windows cannot resize a file while it is mapped, so the maps are closed first.
+        capacity = max(self._capacity, INITIAL_CAPACITY)
+        while capacity < needed:
+            capacity *= 2
+        if capacity == self._capacity:
+            return
+        itemsize = np.dtype(DTYPES[self.dtype]).itemsize
+        sizes = {"vectors.bin": capacity * self.dim * itemsize, "live.bin": capacity}
+        if self.dtype == "int8":
+            sizes["scales.bin"] = capacity * 4
+        self._wait_for_searches()
+        self._unmap_files()
+        for filename, size in sizes.items():
+            with open(os.path.join(self.path, filename), "ab") as f:
+                f.truncate(size)
+        self._capacity = capacity
+        self._map_files()
+
+    def close(self):
+        # Flushes and closes the files (e.g. before the collection is deleted); it cannot be used afterwards.
+        with self._write_lock, self._lock:
+            self._wait_for_searches()
+            self._unmap_files()
+            self._db.close()
+
+    def _write_meta(self):
+        meta = {"dim": self.dim, "dtype": self.dtype, "count": self._count, "capacity": self._capacity}
+        tmp_path = os.path.join(self.path, "meta.json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, os.path.join(self.path, "meta.json"))
+
+    def _encode(self, embeddings: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        # Vectors are normalized so a dot product is cosine similarity. For int8, each vector
+        # is scaled so its largest component maps to +/-127 and the scale is kept alongside.
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        unit = embeddings / np.where(norms == 0, 1, norms)
+        if self.dtype != "int8":
+            return unit.astype(DTYPES[self.dtype]), None
+        scales = np.abs(unit).max(axis=1) / 127
+        scales[scales == 0] = 1
+        return np.round(unit / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+    # --- Collection API (the subset of ChromaDB's used by the RetrievalAgent) ---
+
+    def count(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def add(self, ids: List[str], embeddings: Any, documents: List[str], metadatas: List[Dict[str, Any]]):
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        with self._write_lock, self._lock:
+            existing = set(self.get(ids=ids, include=[])["ids"])
+            keep = [i for i, chunk_id in enumerate(ids) if chunk_id not in existing]
+            if not keep:
+                return
+            if self.dim is None:
+                self.dim = embeddings.shape[1]
+            vectors, scales = self._encode(embeddings[keep])
+
+            start = self._count
+            self._grow(start + len(keep))
+            self._vectors[start:start + len(keep)] = vectors
+            if scales is not None:
+                self._scales[start:start + len(keep)] = scales
+            self._live[start:start + len(keep)] = 1
+            self._vectors.flush()
+            self._live.flush()
+            if self._scales is not None:
+                self._scales.flush()
+
+            self._db.executemany("INSERT INTO chunks (row, id, document, metadata) VALUES (?, ?, ?, ?)", [
+                (start + n, ids[i], documents[i], json.dumps(metadatas[i]))
+                for n, i in enumerate(keep)
+            ])
+            self._db.commit()
+            self._count = start + len(keep)
+            self._write_meta()
+
+    def delete(self, ids: List[str]):
+        with self._write_lock, self._lock:
+            rows = self._rows_for_ids(ids)
+            if not rows:
+                return
+            self._live[np.array(rows)] = 0
+            self._live.flush()
+            self._db.executemany("DELETE FROM chunks WHERE row = ?", [(row,) for row in rows])
+            self._db.commit()
+            # Deleted rows are only marked dead; the files are compacted once they make up most of them.
+            if self.count() < self._count // 2:
+                self._compact()
+
+    def get(self, ids: Optional[List[str]] = None, limit: Optional[int] = None, offset: int = 0,
+            include: Optional[List[str]] = None) -> Dict[str, Any]:
+        include = ["documents", "metadatas"] if include is None else include
+        with self._lock:
+            if ids is not None:
+                found = []
+                for start in range(0, len(ids), 500):
+                    batch = ids[start:start + 500]
+                    found.extend(self._db.execute(
+                        f"SELECT id, document, metadata FROM chunks WHERE id IN ({','.join('?' * len(batch))})", batch
+                    ).fetchall())
+            else:
+                found = self._db.execute("SELECT id, document, metadata FROM chunks ORDER BY row LIMIT ? OFFSET ?",
+                                         (limit if limit is not None else -1, offset)).fetchall()
+        return self._format(found, include)
+
+    def query(self, query_embeddings: Any, n_results: int = 10, where: Optional[Dict[str, Any]] = None,
+              include: Optional[List[str]] = None, ids: Optional[List[str]] = None) -> Dict[str, Any]:
+        # As in Chroma, `ids` restricts the search to those chunks.
+        include = ["documents", "metadatas", "distances"] if include is None else include
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / np.where(norms == 0, 1, norms)
+
+        # Scoring runs outside the lock so concurrent searches (and adds) do not wait on each other.
+        while True:
+            with self._lock:
+                self._searches_done.wait_for(lambda: not self._resizing)
+                count, vectors, scales, version = self._count, self._vectors, self._scales, self._layout_version
+                if vectors is None or count == 0:
+                    return self._empty(len(queries), include)
+                mask = np.array(self._live[:count], dtype=bool)
+                if where:
+                    allowed = np.zeros(count, dtype=bool)
+                    clause, params = where_to_sql(where)
+                    rows = [row for (row,) in self._db.execute(f"SELECT row FROM chunks WHERE {clause}", params)]
+                    allowed[rows] = True
+                    mask &= allowed
+                if ids is not None:
+                    allowed = np.zeros(count, dtype=bool)
+                    allowed[[row for row in self._rows_for_ids(list(ids)) if row < count]] = True
+                    mask &= allowed
+                self._active_searches += 1
+
+            try:
+                top_rows, top_scores = self._top_k(queries, vectors, scales, mask, count, n_results)
+            finally:
+                # Drop the references to the maps so a resize waiting on this search can close them.
+                vectors = scales = None
+                with self._lock:
+                    self._active_searches -= 1
+                    self._searches_done.notify_all()
+
+            self._lock.acquire()
+            if version == self._layout_version:
+                break
+            self._lock.release()
+
+        result: Dict[str, Any] = {"ids": []}
+        for key in ("documents", "metadatas", "distances"):
+            if key in include:
+                result[key] = []
+        try:
+            for rows, scores in zip(top_rows, top_scores):
+                by_row = {row: (chunk_id, document, metadata) for row, chunk_id, document, metadata in self._db.execute(
+                    f"SELECT row, id, document, metadata FROM chunks WHERE row IN ({','.join('?' * len(rows))})",
+                    [int(row) for row in rows]
+                )} if len(rows) else {}
+                # A row deleted since the scores were computed is simply skipped.
+                hits = [(by_row[int(row)], score) for row, score in zip(rows, scores) if int(row) in by_row]
+                result["ids"].append([hit[0] for hit, _ in hits])
+                if "documents" in include:
+                    result["documents"].append([hit[1] for hit, _ in hits])
+                if "metadatas" in include:
+                    result["metadatas"].append([json.loads(hit[2]) for hit, _ in hits])
+                if "distances" in include:
+                    result["distances"].append([float(1 - score) for _, score in hits])
+        finally:
+            self._lock.release()
+        return result
+
+    # --- Search ---
+
+    def _top_k(self, queries: np.ndarray, vectors: np.ndarray, scales: Optional[np.ndarray], mask: np.ndarray,
+               count: int, k: int) -> Tuple[List[np.ndarray], List[np.ndarray]]:
+        # Exact (brute-force) cosine search, one block of rows at a time. Each block keeps only
+        # its best k candidates per query, and the candidates are merged at the end.
+        k = min(k, int(mask.sum()))
+        if k <= 0:
+            return [np.empty(0, dtype=np.int64)] * len(queries), [np.empty(0, dtype=np.float32)] * len(queries)
+
+        candidate_rows, candidate_scores = [], []
+        for start in range(0, count, BLOCK_ROWS):
+            stop = min(start + BLOCK_ROWS, count)
+            block_mask = mask[start:stop]
+            if not block_mask.any():
+                continue
+            scores = queries @ np.asarray(vectors[start:stop], dtype=np.float32).T
+            if scales is not None:
+                scores *= scales[start:stop]
+            scores[:, ~block_mask] = -np.inf
+            block_k = min(k, stop - start)
+            best = np.argpartition(-scores, block_k - 1, axis=1)[:, :block_k]
+            candidate_rows.append(best + start)
+            candidate_scores.append(np.take_along_axis(scores, best, axis=1))
+
+        rows = np.concatenate(candidate_rows, axis=1)
+        scores = np.concatenate(candidate_scores, axis=1)
+        order = np.argsort(-scores, axis=1)[:, :k]
+        top_rows = np.take_along_axis(rows, order, axis=1)
+        top_scores = np.take_along_axis(scores, order, axis=1)
+        # Masked-out rows can only surface when fewer than k rows are allowed in total.
+        return ([r[np.isfinite(s)] for r, s in zip(top_rows, top_scores)],
+                [s[np.isfinite(s)] for s in top_scores])
+
+    # --- Helpers ---
+
+    def _rows_for_ids(self, ids: List[str]) -> List[int]:
+        rows = []
+        for start in range(0, len(ids), 500):
+            batch = ids[start:start + 500]
+            rows.extend(row for (row,) in self._db.execute(
+                f"SELECT row FROM chunks WHERE id IN ({','.join('?' * len(batch))})", batch))
+        return rows
+
+    def _compact(self):
+        # Moves the live rows to the front of the files, in order, and renumbers them.
+        live_rows = [row for (row,) in self._db.execute("SELECT row FROM chunks ORDER BY row")]
+        for new_row, old_row in enumerate(live_rows):
+            if new_row != old_row:
+                self._vectors[new_row] = self._vectors[old_row]
+                if self._scales is not None:
+                    self._scales[new_row] = self._scales[old_row]
+        self._live[:len(live_rows)] = 1
+        self._live[len(live_rows):self._count] = 0
+        self._vectors.flush()
+        self._live.flush()
+        if self._scales is not None:
+            self._scales.flush()
+        # Renumbering in increasing order never collides, since every row only moves down.
+        self._db.executemany("UPDATE chunks SET row = ? WHERE row = ?",
+                             [(new_row, old_row) for new_row, old_row in enumerate(live_rows) if new_row != old_row])
+        self._db.commit()
+        self._count = len(live_rows)
+        self._layout_version += 1
+        self._write_meta()
+
+    def _format(self, found: List[Tuple[str, str, str]], include: List[str]) -> Dict[str, Any]:
+        result: Dict[str, Any] = {"ids": [chunk_id for chunk_id, _, _ in found]}
+        if "documents" in include:
+            result["documents"] = [document for _, document, _ in found]
+        if "metadatas" in include:
+            result["metadatas"] = [json.loads(metadata) for _, _, metadata in found]
+        return result
+
+    def _empty(self, query_count: int, include: List[str]) -> Dict[str, Any]:
+        result: Dict[str, Any] = {"ids": [[] for _ in range(query_count)]}
+        for key in ("documents", "metadatas", "distances"):
+            if key in include:
+                result[key] = [[] for _ in range(query_count)]
+        return result
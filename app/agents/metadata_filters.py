@@ -0,0 +1,80 @@
+from typing import List, Dict, Any, Optional, Tuple
+
+# Search filters arrive as a plain dict, e.g.
+#   {"source": ["a.pdf", "b.pdf"], "file_type": "pdf", "page_from": 3, "page_to": 10}
+# and are translated into a ChromaDB `where` clause so they are applied inside the
+# vector query. `matches_where` evaluates the same clause in Python, and `where_to_sql`
+# turns it into SQL over metadata stored as JSON.
+
+
+def build_where(filters: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    if not filters:
+        return None
+
+    conditions: List[Dict[str, Any]] = []
+    for field in ("source", "file_type"):
+        value = filters.get(field)
+        if value is None:
+            continue
+        if isinstance(value, (list, tuple)):
+            conditions.append({field: {"$in": list(value)}})
+        else:
+            conditions.append({field: {"$eq": value}})
+    if filters.get("page_from") is not None:
+        conditions.append({"page": {"$gte": filters["page_from"]}})
+    if filters.get("page_to") is not None:
+        conditions.append({"page": {"$lte": filters["page_to"]}})
+
+    if not conditions:
+        return None
+    if len(conditions) == 1:
+        return conditions[0]
+    return {"$and": conditions}
+
+
+def matches_where(metadata: Dict[str, Any], where: Optional[Dict[str, Any]]) -> bool:
+    # Supports the subset of ChromaDB's operators produced by build_where.
+    if not where:
+        return True
+    if "$and" in where:
+        return all(matches_where(metadata, clause) for clause in where["$and"])
+    for field, condition in where.items():
+        value = metadata.get(field)
+        for operator, operand in condition.items():
+            if operator == "$eq" and value != operand:
+                return False
+            if operator == "$in" and value not in operand:
+                return False
+            if operator == "$gte" and (value is None or value < operand):
+                return False
+            if operator == "$lte" and (value is None or value > operand):
+                return False
+    return True
+
+
+def where_to_sql(where: Dict[str, Any]) -> Tuple[str, List[Any]]:
+    # Translates the `where` clauses produced by build_where into SQL over a JSON `metadata`
+    # column, so filtering is done by SQLite rather than row by row in Python.
+    if "$and" in where:
+        parts = [where_to_sql(clause) for clause in where["$and"]]
+        return " AND ".join(f"({clause})" for clause, _ in parts), [param for _, params in parts for param in params]
+
+    clauses, params = [], []
+    for field, condition in where.items():
+        column = "json_extract(metadata, ?)"
+        for operator, operand in condition.items():
+            if operator == "$eq":
+                clauses.append(f"{column} = ?")
+                params.extend([f"$.{field}", operand])
+            elif operator == "$in":
+                clauses.append(f"{column} IN ({','.join('?' * len(operand))})")
+                params.extend([f"$.{field}", *operand])
+            elif operator == "$gte":
+                clauses.append(f"{column} >= ?")
+                params.extend([f"$.{field}", operand])
+            elif operator == "$lte":
+                clauses.append(f"{column} <= ?")
+                params.extend([f"$.{field}", operand])
+            else:
+                raise ValueError(f"Unsupported filter operator {operator!r}.")
+    return " AND ".join(clauses) or "1", params
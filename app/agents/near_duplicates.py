@@ -0,0 +1,223 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import numpy as np
+from typing import List, Dict, Any, Optional, Iterable, Tuple
+
+from .metadata_filters import where_to_sql
+
+SIMHASH_BITS = 64
+
+# Text shorter than this (in words) is only ever collapsed into an identical copy: a
+# short fingerprint has too few features to tell "Total: 10" from "Total: 12".
+MIN_WORDS_FOR_NEAR_MATCH = 8
+
+
+def word_count(text: str) -> int:
+    return len(re.findall(r"\w+", text))
+
+
+def _features(text: str, size: int = 3) -> List[str]:
+    # Overlapping three-word shingles, as in ContextBuilder's duplicate check.
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < size:
+        return [" ".join(words)]
+    return [" ".join(words[i:i + size]) for i in range(len(words) - size + 1)]
+
+
+def simhash(text: str) -> int:
+    # 64-bit SimHash: every shingle votes on each bit with its own hash, and the
+    # fingerprint keeps the majority. Similar texts get fingerprints a few bits apart.
+    features = _features(text)
+    hashes = np.frombuffer(b"".join(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+                                    for feature in features), dtype=">u8")
+    bits = (hashes[:, None] >> np.arange(SIMHASH_BITS, dtype=np.uint64)) & np.uint64(1)
+    majority = bits.sum(axis=0) * 2 > len(features)
+    return sum(1 << bit for bit in np.flatnonzero(majority).tolist())
+
+
+def _signed(value: int) -> int:
+    # SQLite integers are signed 64-bit.
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+# This class detects duplicate chunks for one tenant and remembers where every copy came
+# from. It is persisted in SQLite next to the tenant's collection:
+#   fingerprints: the SimHash of every stored chunk, split into bands for lookup
+#   occurrences:  every chunk a file produced (keyed by its own chunk ID, as in the
+#                 manifest), the stored chunk it maps to, its metadata, and its text
+#                 when that differs from the stored chunk's
+# The caller stores a chunk once and records each further copy as an occurrence of it.
+# With `max_distance` 0 only identical fingerprints are candidates (the caller checks the
+# text is identical too); a positive `max_distance` also offers near-duplicates. A stored
+# chunk is deleted once none of its occurrences remain, and replaced by one of the others
+# once its own is gone (see `promote`). Below 0 nothing is collapsed, but occurrences are
+# still tracked.
+class FingerprintIndex:
+    def __init__(self, path: str, max_distance: int = 0):
+        if max_distance > 15:
+            raise ValueError("DEDUP_MAX_DISTANCE must be at most 15 (out of 64 bits).")
+        self.max_distance = max_distance
+        # Any two fingerprints within max_distance bits agree exactly on at least one of
+        # max_distance + 1 bands, so candidates can be looked up by band.
+        self.bands = max(max_distance, 0) + 1
+        self._band_bits = SIMHASH_BITS // self.bands
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS fingerprints (chunk_id TEXT PRIMARY KEY, fingerprint INTEGER, near INTEGER);
+            CREATE INDEX IF NOT EXISTS fingerprints_by_value ON fingerprints (fingerprint);
+            CREATE TABLE IF NOT EXISTS bands (band INTEGER, chunk_id TEXT);
+            CREATE INDEX IF NOT EXISTS bands_by_band ON bands (band);
+            CREATE TABLE IF NOT EXISTS occurrences (occurrence_id TEXT PRIMARY KEY, chunk_id TEXT, metadata TEXT, content TEXT);
+            CREATE INDEX IF NOT EXISTS occurrences_by_chunk ON occurrences (chunk_id);
+            CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT);
+        """)
+        if "content" not in [column[1] for column in self._db.execute("PRAGMA table_info(occurrences)")]:
+            self._db.execute("ALTER TABLE occurrences ADD COLUMN content TEXT")
+        row = self._db.execute("SELECT value FROM settings WHERE key = 'bands'").fetchone()
+        if row is None or int(row[0]) != self.bands:
+            self._rebuild_bands()
+        self._db.commit()
+
+    def count(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM fingerprints").fetchone()[0]
+
+    def candidates(self, fingerprint: int, near: bool = True) -> List[str]:
+        # Returns the IDs of stored chunks within max_distance bits, closest first. With
+        # max_distance 0, or near=False (short text), only identical fingerprints match.
+        if self.max_distance < 0:
+            return []
+        with self._lock:
+            if self.max_distance == 0 or not near:
+                return [row[0] for row in self._db.execute(
+                    "SELECT chunk_id FROM fingerprints WHERE fingerprint = ? ORDER BY rowid", (_signed(fingerprint),))]
+            bands = self._band_keys(fingerprint)
+            rows = self._db.execute(
+                f"SELECT DISTINCT f.chunk_id, f.fingerprint FROM bands b JOIN fingerprints f ON f.chunk_id = b.chunk_id "
+                f"WHERE b.band IN ({','.join('?' * len(bands))}) AND f.near = 1", bands
+            ).fetchall()
+        distances = {chunk_id: bin((stored & (1 << 64) - 1) ^ fingerprint).count("1") for chunk_id, stored in rows}
+        return sorted((chunk_id for chunk_id, distance in distances.items() if distance <= self.max_distance),
+                      key=distances.get)
+
+    def add(self, chunk_id: str, fingerprint: int, near: bool = True):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?)", (chunk_id, _signed(fingerprint), int(near)))
+            self._db.executemany("INSERT INTO bands VALUES (?, ?)", [(band, chunk_id) for band in self._band_keys(fingerprint)])
+
+    def add_occurrence(self, occurrence_id: str, chunk_id: str, metadata: Dict[str, Any], content: Optional[str] = None):
+        # `content` is the occurrence's own text, if it is not identical to the stored chunk's.
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO occurrences VALUES (?, ?, ?, ?)",
+                             (occurrence_id, chunk_id, json.dumps(metadata, sort_keys=True), content))
+
+    def resolve(self, occurrence_ids: List[str]) -> Dict[str, str]:
+        # Maps the occurrences that are already indexed to the chunk each one is stored as.
+        with self._lock:
+            return dict(self._select("SELECT occurrence_id, chunk_id FROM occurrences WHERE occurrence_id IN ({})", occurrence_ids))
+
+    def occurrences(self, chunk_ids: List[str]) -> Dict[str, List[Tuple[str, Dict[str, Any], Optional[str]]]]:
+        # The (occurrence ID, metadata, own text or None) of every copy of each stored chunk,
+        # oldest first. A chunk's own copy has its chunk ID as occurrence ID; untracked chunks
+        # are left out.
+        found: Dict[str, List[Tuple[str, Dict[str, Any], Optional[str]]]] = {}
+        with self._lock:
+            rows = self._select("SELECT chunk_id, occurrence_id, metadata, content FROM occurrences "
+                                "WHERE chunk_id IN ({}) ORDER BY rowid", chunk_ids)
+        for chunk_id, occurrence_id, metadata, content in rows:
+            found.setdefault(chunk_id, []).append((occurrence_id, json.loads(metadata), content))
+        return found
+
+    def matching_copies(self, where: Dict[str, Any]) -> List[str]:
+        # The stored chunks whose own metadata does not match a filter (from
+        # metadata_filters.build_where) but a collapsed copy's does, so a copy is found under
+        # its own source and pages. Chunks matching by their own metadata are not included.
+        clause, params = where_to_sql(where)
+        with self._lock:
+            return [row[0] for row in self._db.execute(
+                f"SELECT DISTINCT chunk_id FROM occurrences AS copy WHERE occurrence_id != chunk_id AND ({clause}) "
+                f"AND NOT EXISTS (SELECT 1 FROM occurrences WHERE occurrence_id = copy.chunk_id AND ({clause}))",
+                params + params
+            )]
+
+    def release(self, occurrence_ids: Iterable[str]) -> Tuple[List[str], List[str]]:
+        # Forgets occurrences (a file no longer produces them). Returns the stored chunks that
+        # are no longer referenced by anything, which the caller should delete, and those whose
+        # own occurrence is gone while other copies remain, which the caller should replace
+        # with one of them (see `promote`). IDs that were never tracked are returned as orphaned.
+        # Changes are not committed until `commit`.
+        occurrence_ids = list(occurrence_ids)
+        with self._lock:
+            mapping = dict(self._select("SELECT occurrence_id, chunk_id FROM occurrences WHERE occurrence_id IN ({})", occurrence_ids))
+            self._execute_many("DELETE FROM occurrences WHERE occurrence_id IN ({})", occurrence_ids)
+            candidates = set(mapping.values()) | (set(occurrence_ids) - set(mapping))
+            still_used = {row[0] for row in self._select("SELECT DISTINCT chunk_id FROM occurrences WHERE chunk_id IN ({})", list(candidates))}
+            orphaned = list(candidates - still_used)
+            self._execute_many("DELETE FROM fingerprints WHERE chunk_id IN ({})", orphaned)
+            self._execute_many("DELETE FROM bands WHERE chunk_id IN ({})", orphaned)
+            owned = {row[0] for row in self._select("SELECT occurrence_id FROM occurrences WHERE occurrence_id IN ({})", list(still_used))}
+        return orphaned, list(still_used - owned)
+
+    def promote(self, chunk_id: str, stored_content: str) -> Tuple[str, Dict[str, Any], str]:
+        # Makes the oldest remaining occurrence of a stored chunk the stored copy in its place,
+        # so the chunk is stored under that occurrence's ID, metadata and text. Returns those;
+        # the caller replaces the stored chunk with them. `stored_content` is the current text.
+        with self._lock:
+            rows = self._db.execute("SELECT occurrence_id, metadata, content FROM occurrences WHERE chunk_id = ? ORDER BY rowid",
+                                    (chunk_id,)).fetchall()
+            new_id, metadata, content = rows[0]
+            content = content if content is not None else stored_content
+            if content != stored_content:
+                # Copies identical to the old text now differ from the stored one, and vice versa.
+                self._db.execute("UPDATE occurrences SET content = ? WHERE chunk_id = ? AND content IS NULL", (stored_content, chunk_id))
+                self._db.execute("UPDATE occurrences SET content = NULL WHERE chunk_id = ? AND content = ?", (chunk_id, content))
+            self._db.execute("UPDATE occurrences SET chunk_id = ? WHERE chunk_id = ?", (new_id, chunk_id))
+            self._db.execute("DELETE FROM fingerprints WHERE chunk_id = ?", (chunk_id,))
+            self._db.execute("DELETE FROM bands WHERE chunk_id = ?", (chunk_id,))
+            fingerprint = simhash(content)
+            self._db.execute("INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?)",
+                             (new_id, _signed(fingerprint), int(word_count(content) >= MIN_WORDS_FOR_NEAR_MATCH)))
+            self._db.executemany("INSERT INTO bands VALUES (?, ?)", [(band, new_id) for band in self._band_keys(fingerprint)])
+        return new_id, json.loads(metadata), content
+
+    def commit(self):
+        with self._lock:
+            self._db.commit()
+
+    def rollback(self):
+        with self._lock:
+            self._db.rollback()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _band_keys(self, fingerprint: int) -> List[int]:
+        # Each band's bits, tagged with the band's position so equal bits in different bands don't collide.
+        mask = (1 << self._band_bits) - 1
+        return [_signed((band << self._band_bits) | (fingerprint >> (band * self._band_bits) & mask)) for band in range(self.bands)]
+
+    def _rebuild_bands(self):
+        # The band layout depends on max_distance, so it is rebuilt when that setting changes.
+        self._db.execute("DELETE FROM bands")
+        for chunk_id, fingerprint in self._db.execute("SELECT chunk_id, fingerprint FROM fingerprints").fetchall():
+            self._db.executemany("INSERT INTO bands VALUES (?, ?)",
+                                 [(band, chunk_id) for band in self._band_keys(fingerprint & (1 << 64) - 1)])
+        self._db.execute("INSERT OR REPLACE INTO settings VALUES ('bands', ?)", (str(self.bands),))
+
+    def _select(self, query: str, values: List[str], batch_size: int = 500) -> List[Any]:
+        # Runs an "IN (...)" query in batches, staying under SQLite's parameter limit.
+        rows = []
+        for start in range(0, len(values), batch_size):
+            batch = values[start:start + batch_size]
+            rows.extend(self._db.execute(query.format(",".join("?" * len(batch))), batch).fetchall())
+        return rows
+
+    def _execute_many(self, statement: str, values: List[str], batch_size: int = 500):
+        for start in range(0, len(values), batch_size):
+            batch = values[start:start + batch_size]
+            self._db.execute(statement.format(",".join("?" * len(batch))), batch)
@@ -0,0 +1,64 @@
+# Exports the embedding model to ONNX for EMBEDDING_BACKEND=onnx and quantizes it to int8.
+# The export needs the torch stack (sentence-transformers) and the onnx package, but only
+# on the machine that runs it; serving the exported model needs neither.
+#
+# Writes to the output directory:
+#   model.onnx       the float32 export (token embeddings; pooling is done at query time)
+#   model_int8.onnx  the same model with int8 weights (dynamic quantization), used by default
+#   tokenizer.json   the model's tokenizer, truncating at its maximum sequence length
+#
+# Usage (from the project root):
+#   python -m app.agents.onnx_export --output onnx_model
+# then compare it with the torch model:
+#   python -m benchmarks.embedding_backends --onnx-dir onnx_model
+import argparse
+import os
+
+from .retrieval_agent import EMBEDDING_MODEL_NAME
+
+INPUT_NAMES = ("input_ids", "attention_mask", "token_type_ids")
+
+
+def export(model_name: str, output_dir: str, opset: int = 17):
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    model = SentenceTransformer(model_name, device="cpu")
+    transformer = model[0].auto_model.eval()
+    os.makedirs(output_dir, exist_ok=True)
+
+    # The transformer's forward takes (input_ids, attention_mask, token_type_ids) in this order.
+    sample = model.tokenizer(["An example sentence to trace the model with."], return_tensors="pt")
+    input_names = [name for name in INPUT_NAMES if name in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names + ["last_hidden_state"]}
+    float_path = os.path.join(output_dir, "model.onnx")
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer, tuple(sample[name] for name in input_names), float_path,
+            input_names=input_names, output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes, opset_version=opset
+        )
+
+    # Per-channel int8 weights keep the quantized vectors closest to the float ones.
+    quantize_dynamic(float_path, os.path.join(output_dir, "model_int8.onnx"),
+                     weight_type=QuantType.QInt8, per_channel=True)
+
+    tokenizer = model.tokenizer.backend_tokenizer
+    tokenizer.no_padding()
+    tokenizer.enable_truncation(max_length=model.max_seq_length)
+    tokenizer.save(os.path.join(output_dir, "tokenizer.json"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the embedding model to int8 ONNX for EMBEDDING_BACKEND=onnx.")
+    parser.add_argument("--model", default=EMBEDDING_MODEL_NAME)
+    parser.add_argument("--output", default="onnx_model")
+    parser.add_argument("--opset", type=int, default=17)
+    args = parser.parse_args()
+    export(args.model, args.output, args.opset)
+    print(f"Exported {args.model} to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Any, Callable
+
+# This class coalesces concurrent requests into batches. Callers block in submit()
+# while a dispatcher thread collects whatever arrives within `max_wait_ms` of the first
+# request (up to `max_batch_size` items), runs `batch_fn` once on the whole batch and
+# hands each caller its own result. `batch_fn` must return one result per input item.
+class QueryBatcher:
+    def __init__(self, batch_fn: Callable[[List[Any]], List[Any]], max_batch_size: int = 32, max_wait_ms: float = 5.0):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue: "queue.Queue" = queue.Queue()
+
+        # Counters for observing how well requests are being coalesced.
+        self.batches = 0
+        self.items = 0
+
+        self._dispatcher = threading.Thread(target=self._run, name="query-batcher", daemon=True)
+        self._dispatcher.start()
+
+    def submit(self, item: Any) -> Any:
+        future: Future = Future()
+        self._queue.put((item, future))
+        return future.result()
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": self.items / self.batches if self.batches else 0.0
+        }
+
+    def _run(self):
+        while True:
+            # Block until the first request of the next batch arrives.
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            items = [item for item, _ in batch]
+            try:
+                results = self.batch_fn(items)
+            except Exception as e:
+                # A failed batch fails every caller in it rather than killing the dispatcher.
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.items += len(batch)
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
@@ -1,61 +1,640 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import chromadb
-from chromadb.utils import embedding_functions
-from typing import List, Dict, Any
+from chromadb.errors import NotFoundError
+from typing import List, Dict, Any, Callable, Tuple, Optional
+
+from .index_manifest import IndexManifest
+from .embedding_cache import EmbeddingCache, CachedEmbeddingFunction
+from .embedding_backends import create_embedding_function
+from .lexical_index import BM25Index
+from .query_batcher import QueryBatcher
+from .metadata_filters import build_where, matches_where
+from .memmap_store import MemmapVectorStore
+from .tenant_registry import TenantRegistry
+from .near_duplicates import FingerprintIndex, simhash, word_count, MIN_WORDS_FOR_NEAR_MATCH
+from ..telemetry import Trace, current_trace, span
+
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+
+# Constant from the reciprocal-rank fusion paper; dampens the advantage of the very top ranks.
+RRF_K = 60
+
+# Tenant used when a request does not name one. Its collection keeps the original
+# name, so an index created before namespacing existed is still found.
+DEFAULT_TENANT = "default"
+
+# At most this many other locations of a collapsed chunk are listed in a search result.
+MAX_DUPLICATE_REFERENCES = 50
+
+# Filters whose matching collapsed copies are cached per namespace (see _copy_matches).
+MAX_CACHED_FILTERS = 32
+
+
+def collection_name_for(tenant_id: str) -> str:
+    # Tenant IDs are arbitrary strings, but Chroma collection names are restricted,
+    # so every other tenant gets a name derived from a hash of its ID.
+    if tenant_id == DEFAULT_TENANT:
+        return "document_collection"
+    return f"docs-{hashlib.sha256(tenant_id.encode('utf-8')).hexdigest()[:32]}"
+
+
+# Everything the RetrievalAgent holds for one tenant: its vector collection, its
+# in-memory lexical index, its file manifest and its near-duplicate fingerprints.
+class _Namespace:
+    def __init__(self, tenant_id: str, collection: Any, manifest: IndexManifest, fingerprints: FingerprintIndex):
+        self.tenant_id = tenant_id
+        self.collection = collection
+        self.manifest = manifest
+        self.fingerprints = fingerprints
+        self.lexical_index = BM25Index()
+        self.last_used = time.time()
+        # Chunks matching each recently used filter through a collapsed copy, valid while
+        # `version` is unchanged.
+        self.version = 0
+        self.copy_matches: Dict[str, Tuple[int, set]] = {}
+
 
 # This agent is responsible for all interactions with the vector database.
 # It handles embedding creation, storage, and semantic search.
+# Documents are namespaced per tenant: each tenant has its own collection, created
+# on its first upload, so a search only ever scans that tenant's corpus. Namespaces
+# that sit idle are unloaded from memory (their data stays on disk), and tenants left
+# unused for long enough can be deleted with purge_idle_tenants.
 class RetrievalAgent:
-    def __init__(self):
-        # Initialize the SentenceTransformer model that will be used to create embeddings.
+    def __init__(self, persist_dir: str = None, vector_backend: str = None, vector_dtype: str = None,
+                 embedding_backend: str = None):
+        # The SentenceTransformer model that will be used to create embeddings, loaded on first use.
         # This is passed to ChromaDB to ensure consistency between indexing and querying.
-        self.embedding_function = embedding_functions.SentenceTransformerEmbeddingFunction(
-            model_name="all-MiniLM-L6-v2"
+        # EMBEDDING_BACKEND=onnx runs a quantized ONNX export of the same model instead of
+        # torch; its vectors are interchangeable with the ones already stored.
+        self.embedding_function = create_embedding_function(
+            embedding_backend or os.environ.get("EMBEDDING_BACKEND", "torch"), EMBEDDING_MODEL_NAME
         )
-        # Initialize the ChromaDB client.
-        client = chromadb.Client()
-        # Get or create a collection (like a table in a traditional DB)
-        # This collection will use our specified model to embed documents automatically.
-        self.collection = client.get_or_create_collection(
-            name="document_collection",
-            embedding_function=self.embedding_function
+        # Initialize a persistent ChromaDB client so the index survives restarts. With
+        # VECTOR_BACKEND=memmap a memory-mapped NumPy store is used instead. It searches
+        # exhaustively over vectors stored as int8 by default; VECTOR_DTYPE=float16 or float32
+        # trades memory and speed for exact scores (see benchmarks/vector_backends.py).
+        self.persist_dir = persist_dir or os.environ.get("CHROMA_PERSIST_DIR", "chroma_db")
+        self.vector_backend = vector_backend or os.environ.get("VECTOR_BACKEND", "chroma")
+        if self.vector_backend == "memmap":
+            self.client = MemmapVectorStore(
+                os.path.join(self.persist_dir, "vectors"),
+                dtype=vector_dtype or os.environ.get("VECTOR_DTYPE", "int8")
+            )
+        elif self.vector_backend == "chroma":
+            self.client = chromadb.PersistentClient(path=self.persist_dir)
+        else:
+            raise ValueError(f"Unknown VECTOR_BACKEND {self.vector_backend!r}; expected 'chroma' or 'memmap'.")
+        # All embeddings are computed through a content-addressed cache, so identical text is
+        # never re-encoded, even after the collection is cleared and the documents re-uploaded.
+        # The cache is shared by every tenant's collection. Its entries are keyed by the
+        # backend and model file too, so switching EMBEDDING_BACKEND never serves vectors
+        # computed by the other backend.
+        self.embedding_cache = EmbeddingCache(
+            model_name=self.embedding_function.cache_name,
+            max_memory_entries=int(os.environ.get("EMBEDDING_CACHE_SIZE", "20000")),
+            path=os.path.join(self.persist_dir, "embedding_cache.sqlite")
         )
+        self.embedder = CachedEmbeddingFunction(self.embedding_function, self.embedding_cache)
+        # Loaded tenant namespaces, least recently used first.
+        self._namespaces: "OrderedDict[str, _Namespace]" = OrderedDict()
+        self._namespaces_lock = threading.Lock()
+        # Per-tenant locks held while a namespace loads, and a count of deletions, which
+        # tells a load that finished after a clear or purge to discard what it read.
+        self._loading: Dict[str, threading.Lock] = {}
+        self._deletions = 0
+        self.namespace_idle_seconds = float(os.environ.get("NAMESPACE_IDLE_SECONDS", "1800"))
+        self.max_loaded_namespaces = int(os.environ.get("NAMESPACE_MAX_LOADED", "64"))
+        # When each tenant was last used, so abandoned tenants can be deleted (see purge_idle_tenants).
+        self.tenant_registry = TenantRegistry(os.path.join(self.persist_dir, "tenants.sqlite"))
+        # Runs the vector and lexical retrievers of a search concurrently.
+        self._search_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="search")
+        # Coalesces concurrent vector searches so the embedding model encodes many queries per
+        # forward pass and Chroma answers them in one multi-query lookup. A batch size of 1
+        # disables coalescing and queries are served one at a time.
+        max_batch_size = int(os.environ.get("QUERY_BATCH_SIZE", "32"))
+        self.query_batcher = None
+        if max_batch_size > 1:
+            self.query_batcher = QueryBatcher(
+                self._vector_search_batch,
+                max_batch_size=max_batch_size,
+                max_wait_ms=float(os.environ.get("QUERY_BATCH_WAIT_MS", "5"))
+            )
+        # Identical chunks are stored once (e.g. a disclaimer repeated on every page, or the
+        # same paragraph in two files). A positive value also collapses chunks whose SimHash
+        # fingerprints differ in at most that many of 64 bits; -1 stores every chunk.
+        self.dedup_max_distance = int(os.environ.get("DEDUP_MAX_DISTANCE", "0"))
+        # Callbacks fired with a tenant ID whenever that tenant's documents change (e.g. to
+        # invalidate caches). The ID is None when every tenant was cleared at once.
+        self._change_listeners: List[Callable[[Optional[str]], None]] = []
 
-    def clear_collection(self):
-        # Clears all data from the vector store to start a fresh session.
-        # The most robust way is to delete and immediately re-create the collection.
-        client = chromadb.Client()
-        client.delete_collection(name="document_collection")
-        self.collection = client.get_or_create_collection(
-            name="document_collection",
-            embedding_function=self.embedding_function
-        )
+    def warmup(self):
+        # Loads the embedding model and runs it once, then opens the default namespace, so
+        # the first request does not pay for either. Run in the background at server start.
+        self.embedding_function(["warmup"])
+        self._namespace(DEFAULT_TENANT)
+
+    # --- Namespace Management ---
+
+    def _namespace(self, tenant_id: str, create: bool = False) -> Optional[_Namespace]:
+        # Returns the tenant's namespace, loading it on first use. Only ingestion creates a
+        # collection (create=True); reading a tenant that has none returns None, so looking
+        # up an unknown tenant leaves nothing behind on disk. Loading reads the whole
+        # collection, so it runs outside the namespaces lock, under a lock of its own tenant:
+        # opening a large tenant only delays the requests for that tenant.
+        while True:
+            with self._namespaces_lock:
+                namespace = self._namespaces.get(tenant_id)
+                if namespace is not None:
+                    return self._use_namespace(namespace)
+                loading_lock = self._loading.setdefault(tenant_id, threading.Lock())
+            with loading_lock:
+                try:
+                    with self._namespaces_lock:
+                        # Another request may have loaded it while this one waited.
+                        namespace = self._namespaces.get(tenant_id)
+                        if namespace is not None:
+                            return self._use_namespace(namespace)
+                        deletions = self._deletions
+                    try:
+                        namespace = self._open_namespace(tenant_id, create)
+                    except Exception:
+                        # Reading fails if the collection is deleted meanwhile, which is retried below.
+                        if self._deletions == deletions:
+                            raise
+                        namespace = None
+                    with self._namespaces_lock:
+                        if self._deletions != deletions:
+                            # Documents were cleared while it loaded, so what it read may be gone: start over.
+                            if namespace is not None:
+                                namespace.fingerprints.close()
+                            continue
+                        if namespace is None:
+                            return None
+                        self._namespaces[tenant_id] = namespace
+                        return self._use_namespace(namespace)
+                finally:
+                    with self._namespaces_lock:
+                        if self._loading.get(tenant_id) is loading_lock:
+                            del self._loading[tenant_id]
+
+    def _open_namespace(self, tenant_id: str, create: bool) -> Optional[_Namespace]:
+        name = collection_name_for(tenant_id)
+        # Embeddings are always passed in explicitly; the collection keeps the same model
+        # configured so it stays consistent with the vectors we store.
+        if create:
+            collection = self.client.get_or_create_collection(name=name, embedding_function=self.embedding_function)
+        else:
+            try:
+                collection = self.client.get_collection(name=name, embedding_function=self.embedding_function)
+            except (NotFoundError, ValueError):
+                return None
+        # Tracks which files are indexed, with their content hash and chunk IDs.
+        manifest = IndexManifest(self._manifest_path(name))
+        fingerprints = FingerprintIndex(self._fingerprints_path(name), max_distance=self.dedup_max_distance)
+        namespace = _Namespace(tenant_id, collection, manifest, fingerprints)
+        # The lexical (BM25) index lives in memory, so it is rebuilt from the collection.
+        try:
+            self._load_lexical_index(namespace)
+        except Exception:
+            fingerprints.close()
+            raise
+        return namespace
+
+    def _use_namespace(self, namespace: _Namespace) -> _Namespace:
+        # Marks a loaded namespace as used. Called with the namespaces lock held.
+        namespace.last_used = time.time()
+        self.tenant_registry.touch(collection_name_for(namespace.tenant_id), namespace.tenant_id, namespace.last_used)
+        self._namespaces.move_to_end(namespace.tenant_id)
+        self._evict_idle_namespaces(keep=namespace.tenant_id)
+        return namespace
+
+    def _manifest_path(self, collection_name: str) -> str:
+        if collection_name == collection_name_for(DEFAULT_TENANT):
+            return os.path.join(self.persist_dir, "manifest.json")
+        manifest_dir = os.path.join(self.persist_dir, "manifests")
+        os.makedirs(manifest_dir, exist_ok=True)
+        return os.path.join(manifest_dir, f"{collection_name}.json")
+
+    def _fingerprints_path(self, collection_name: str) -> str:
+        fingerprints_dir = os.path.join(self.persist_dir, "fingerprints")
+        os.makedirs(fingerprints_dir, exist_ok=True)
+        return os.path.join(fingerprints_dir, f"{collection_name}.sqlite")
+
+    def _evict_idle_namespaces(self, keep: str):
+        # Unloads namespaces that have been idle too long, or the least recently used ones
+        # beyond the cap. Only memory is released; the collections remain on disk. The
+        # fingerprint database is closed when the last reference to it goes, since a search
+        # may still be using it.
+        now = time.time()
+        for tenant_id, namespace in list(self._namespaces.items()):
+            if tenant_id == keep:
+                continue
+            if now - namespace.last_used > self.namespace_idle_seconds or len(self._namespaces) > self.max_loaded_namespaces:
+                del self._namespaces[tenant_id]
+
+    def _load_lexical_index(self, namespace: _Namespace, page_size: int = 1000):
+        # A collection indexed before near-duplicate detection existed has no fingerprints
+        # yet; they are computed on the same pass so later uploads are checked against it.
+        backfill = namespace.fingerprints.count() == 0
+        offset = 0
+        while True:
+            page = namespace.collection.get(limit=page_size, offset=offset, include=["documents", "metadatas"])
+            if not page['ids']:
+                break
+            chunks = [
+                {"id": chunk_id, "content": content, "metadata": metadata}
+                for chunk_id, content, metadata in zip(page['ids'], page['documents'], page['metadatas'])
+            ]
+            namespace.lexical_index.add(chunks)
+            if backfill:
+                for chunk in chunks:
+                    namespace.fingerprints.add(chunk['id'], simhash(chunk['content']),
+                                               word_count(chunk['content']) >= MIN_WORDS_FOR_NEAR_MATCH)
+                    namespace.fingerprints.add_occurrence(chunk['id'], chunk['id'], chunk['metadata'])
+            offset += len(page['ids'])
+        namespace.fingerprints.commit()
+
+    def loaded_namespaces(self) -> List[str]:
+        with self._namespaces_lock:
+            return list(self._namespaces)
+
+    def add_change_listener(self, listener: Callable[[Optional[str]], None]):
+        self._change_listeners.append(listener)
+
+    def _notify_change(self, tenant_id: Optional[str]):
+        for listener in self._change_listeners:
+            listener(tenant_id)
+
+    def clear_collection(self, tenant_id: Optional[str] = None):
+        # Clears a tenant's documents, or every tenant's when no ID is given.
+        # The most robust way is to delete the collections; they are re-created on the next upload.
+        with self._namespaces_lock:
+            self._deletions += 1
+            existing = [collection.name for collection in self.client.list_collections()]
+            if tenant_id is None:
+                for name in existing:
+                    if name == "document_collection" or name.startswith("docs-"):
+                        self.client.delete_collection(name=name)
+                for namespace in self._namespaces.values():
+                    namespace.fingerprints.close()
+                self._namespaces.clear()
+                # The fingerprint databases were closed above; open files cannot be deleted on Windows.
+                for directory in ("manifests", "fingerprints"):
+                    if os.path.isdir(os.path.join(self.persist_dir, directory)):
+                        shutil.rmtree(os.path.join(self.persist_dir, directory))
+                IndexManifest(self._manifest_path(collection_name_for(DEFAULT_TENANT))).clear()
+                self.tenant_registry.remove()
+            else:
+                self._delete_namespace(collection_name_for(tenant_id), tenant_id, existing)
+        self._notify_change(tenant_id)
+
+    def _delete_namespace(self, name: str, tenant_id: Optional[str], existing: List[str]):
+        # Deletes one tenant's collection, manifest and fingerprints. Called with the namespaces lock held.
+        self._deletions += 1
+        if name in existing:
+            self.client.delete_collection(name=name)
+        if tenant_id is not None:
+            namespace = self._namespaces.pop(tenant_id, None)
+            if namespace is not None:
+                namespace.fingerprints.close()
+        fingerprints_path = self._fingerprints_path(name)
+        if os.path.exists(fingerprints_path):
+            os.remove(fingerprints_path)
+        manifest_path = self._manifest_path(name)
+        if name == collection_name_for(DEFAULT_TENANT):
+            IndexManifest(manifest_path).clear()
+        elif os.path.exists(manifest_path):
+            os.remove(manifest_path)
+        self.tenant_registry.remove(name)
+
+    def purge_idle_tenants(self, max_idle_seconds: float) -> int:
+        # Deletes the documents of every tenant (other than the default one) that has not been
+        # searched or uploaded to for longer than max_idle_seconds, e.g. those of browser
+        # sessions that were closed. Returns the number of tenants deleted.
+        purged = []
+        with self._namespaces_lock:
+            existing = [collection.name for collection in self.client.list_collections()]
+            self.tenant_registry.register([name for name in existing if name.startswith("docs-")])
+            loaded = {collection_name_for(tenant_id): tenant_id for tenant_id in self._namespaces}
+            for name, tenant_id in self.tenant_registry.idle(max_idle_seconds):
+                if name == collection_name_for(DEFAULT_TENANT):
+                    continue
+                self._delete_namespace(name, tenant_id if tenant_id is not None else loaded.get(name), existing)
+                purged.append(tenant_id)
+        for tenant_id in purged:
+            if tenant_id is not None:
+                self._notify_change(tenant_id)
+        return len(purged)
 
-    def add_documents(self, final_chunks: List[Dict[str, Any]]):
-        # Adds a batch of processed document chunks to the ChromaDB collection.
-        if not final_chunks:
+    def add_documents(self, final_chunks: List[Dict[str, Any]], tenant_id: str = DEFAULT_TENANT) -> int:
+        # Adds a batch of processed document chunks to the tenant's ChromaDB collection.
+        # Chunk IDs are content-addressed, so chunks that are already stored are skipped
+        # instead of being embedded a second time. A chunk with the same text as a stored one
+        # (in this upload or an earlier one), or a near-duplicate if DEDUP_MAX_DISTANCE allows,
+        # is not stored either: it is recorded as another occurrence of that chunk, with its
+        # own metadata, which filtered searches match and search results list.
+        # Returns the number of chunks collapsed into an existing one.
+        unique_chunks = {chunk['id']: chunk for chunk in final_chunks}
+        if not unique_chunks:
+            return 0
+
+        namespace = self._namespace(tenant_id, create=True)
+        fingerprints = namespace.fingerprints
+        known_ids = fingerprints.resolve(list(unique_chunks))
+        unknown_ids = [chunk_id for chunk_id in unique_chunks if chunk_id not in known_ids]
+        existing_ids = set(namespace.collection.get(ids=unknown_ids, include=[])['ids']) if unknown_ids else set()
+        new_chunks, collapsed = {}, 0
+        try:
+            with span("dedup"):
+                for chunk_id in unknown_ids:
+                    chunk = unique_chunks[chunk_id]
+                    if chunk_id in existing_ids:
+                        # Stored, but its occurrence was never recorded (e.g. an interrupted upload).
+                        fingerprints.add_occurrence(chunk_id, chunk_id, chunk['metadata'])
+                        continue
+                    fingerprint = simhash(chunk['content'])
+                    near = word_count(chunk['content']) >= MIN_WORDS_FOR_NEAR_MATCH
+                    match = self._find_duplicate(namespace, chunk['content'], fingerprint, near, new_chunks)
+                    if match is not None:
+                        match_id, stored_content = match
+                        fingerprints.add_occurrence(chunk_id, match_id, chunk['metadata'],
+                                                    None if chunk['content'] == stored_content else chunk['content'])
+                        collapsed += 1
+                        continue
+                    fingerprints.add(chunk_id, fingerprint, near)
+                    fingerprints.add_occurrence(chunk_id, chunk_id, chunk['metadata'])
+                    new_chunks[chunk_id] = chunk
+
+            if new_chunks:
+                self._store_chunks(namespace, list(new_chunks.values()))
+            # Fingerprints are only kept once the chunks they describe are stored.
+            fingerprints.commit()
+        except Exception:
+            fingerprints.rollback()
+            raise
+        finally:
+            namespace.version += 1
+        if new_chunks or collapsed:
+            self._notify_change(tenant_id)
+        return collapsed
+
+    def _find_duplicate(self, namespace: _Namespace, content: str, fingerprint: int, near: bool,
+                        new_chunks: Dict[str, Dict[str, Any]]) -> Optional[Tuple[str, str]]:
+        # Returns (ID, text) of the stored chunk a new chunk duplicates, or None. Equal
+        # fingerprints do not guarantee equal text (SimHash ignores case and punctuation), so
+        # unless near-duplicates are allowed the text itself must match.
+        exact = self.dedup_max_distance == 0 or not near
+        for candidate in namespace.fingerprints.candidates(fingerprint, near):
+            if candidate in new_chunks:
+                stored_content = new_chunks[candidate]['content']
+            elif candidate in namespace.lexical_index:
+                stored_content = namespace.lexical_index.get(candidate)['content']
+            else:
+                continue
+            if not exact or stored_content == content:
+                return candidate, stored_content
+        return None
+
+    def _store_chunks(self, namespace: _Namespace, chunks: List[Dict[str, Any]]):
+        documents = [chunk['content'] for chunk in chunks]
+        with span("embed"):
+            embeddings = self.embedder(documents)
+        with span("add"):
+            namespace.collection.add(
+                ids=[chunk['id'] for chunk in chunks],
+                embeddings=embeddings,
+                documents=documents,
+                metadatas=[chunk['metadata'] for chunk in chunks]
+            )
+            namespace.lexical_index.add(chunks)
+
+    # --- Incremental Re-indexing ---
+    # A file is indexed by checking its hash, adding its chunks, then finalizing it,
+    # which removes whatever chunks the previous version of the file had but this one lacks.
+
+    def is_source_unchanged(self, source: str, file_hash: str, tenant_id: str = DEFAULT_TENANT) -> bool:
+        namespace = self._namespace(tenant_id)
+        entry = namespace.manifest.get(source) if namespace is not None else None
+        return entry is not None and entry["file_hash"] == file_hash
+
+    def finalize_source(self, source: str, file_hash: str, chunk_ids: List[str], tenant_id: str = DEFAULT_TENANT):
+        namespace = self._namespace(tenant_id, create=True)
+        entry = namespace.manifest.get(source)
+        if entry is not None:
+            stale_ids = set(entry["chunk_ids"]) - set(chunk_ids)
+            if stale_ids:
+                self._release(namespace, stale_ids)
+                self._notify_change(tenant_id)
+        # Preserve order while dropping duplicate IDs (identical chunks on the same page).
+        namespace.manifest.set(source, file_hash, list(dict.fromkeys(chunk_ids)))
+
+    def discard_chunks(self, source: str, chunk_ids: List[str], tenant_id: str = DEFAULT_TENANT):
+        # Undoes a file whose indexing failed part-way: removes the chunks it added that its
+        # indexed version (if any) does not have, so the index matches the manifest again.
+        namespace = self._namespace(tenant_id)
+        if namespace is None:
             return
+        entry = namespace.manifest.get(source)
+        stale_ids = set(chunk_ids) - set(entry["chunk_ids"] if entry is not None else [])
+        if stale_ids:
+            self._release(namespace, stale_ids)
+            self._notify_change(tenant_id)
 
-        self.collection.add(
-            ids=[chunk['id'] for chunk in final_chunks],
-            documents=[chunk['content'] for chunk in final_chunks],
-            metadatas=[chunk['metadata'] for chunk in final_chunks]
-        )
+    def _release(self, namespace: _Namespace, stale_ids: set):
+        # Removes chunks a file no longer produces. A stored chunk stays while another file
+        # (or page) still has a copy of it, but if the copy it was stored from is gone it is
+        # stored again as the oldest remaining copy, with that copy's ID, metadata and text.
+        fingerprints = namespace.fingerprints
+        try:
+            orphaned_ids, replaced_ids = fingerprints.release(stale_ids)
+            promoted = []
+            for chunk_id in replaced_ids:
+                new_id, metadata, content = fingerprints.promote(chunk_id, namespace.lexical_index.get(chunk_id)['content'])
+                promoted.append({"id": new_id, "content": content, "metadata": metadata})
+            removed_ids = orphaned_ids + replaced_ids
+            if removed_ids:
+                namespace.collection.delete(ids=removed_ids)
+                namespace.lexical_index.remove(removed_ids)
+            if promoted:
+                self._store_chunks(namespace, promoted)
+            fingerprints.commit()
+        except Exception:
+            fingerprints.rollback()
+            raise
+        finally:
+            namespace.version += 1
 
-    def search(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
-        # Performs a semantic search on the vector database.
-        results = self.collection.query(
-            query_texts=[query],
-            n_results=top_k,
-            include=["metadatas", "documents"]
-        )
-        
-        # Safely extract the content and metadata from the search results.
-        retrieved_docs_content = results.get('documents', [[]])[0]
-        retrieved_docs_metadata = results.get('metadatas', [[]])[0]
-        
-        # Format the results into a clean list of dictionaries for the CoordinatorAgent.
-        sources = [
-            {"content": content, "metadata": metadata}
-            for content, metadata in zip(retrieved_docs_content, retrieved_docs_metadata)
+    def embed_query(self, query: str) -> Any:
+        # Embeds a single query through the shared cache.
+        return self.embedder([query])[0]
+
+    def search(self, query: str, top_k: int = 5, vector_weight: float = 1.0, lexical_weight: float = 1.0,
+               tenant_id: str = DEFAULT_TENANT, filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        # Performs a hybrid search over one tenant's documents: dense vector similarity and BM25 run
+        # concurrently and their rankings are merged with reciprocal-rank fusion. Setting a weight to 0
+        # disables that retriever. Metadata filters (source, file_type, page range) are applied inside
+        # both retrievers rather than to their results, and match any copy of a collapsed chunk.
+        # Each retriever ranks a deeper candidate list than top_k so fusion has something to work with.
+        namespace = self._namespace(tenant_id)
+        if namespace is None:
+            return []
+        where = build_where(filters)
+        candidates = top_k * 4
+        lexical_future = self._search_pool.submit(self._lexical_search, namespace, query, candidates, where, current_trace()) if lexical_weight > 0 else None
+        vector_hits = self._vector_search(namespace, query, candidates, where) if vector_weight > 0 else []
+        lexical_hits = lexical_future.result() if lexical_future else []
+        return self._fuse(namespace, vector_hits, lexical_hits, top_k, vector_weight, lexical_weight, where)
+
+    def search_batch(self, queries: List[str], top_k: int = 5, vector_weight: float = 1.0, lexical_weight: float = 1.0,
+                     tenant_id: str = DEFAULT_TENANT, filters: Optional[Dict[str, Any]] = None,
+                     trace: Optional[Trace] = None) -> List[List[Dict[str, Any]]]:
+        # Batch counterpart of search() for many queries that share a tenant, filters and weights.
+        # All queries are embedded in one pass and looked up in one multi-query vector search
+        # (bypassing the query batcher, which exists to coalesce single requests), while their
+        # lexical searches run on the search pool. Returns one result list per query.
+        if not queries:
+            return []
+        namespace = self._namespace(tenant_id)
+        if namespace is None:
+            return [[] for _ in queries]
+        where = build_where(filters)
+        candidates = top_k * 4
+        lexical_futures = [
+            self._search_pool.submit(self._lexical_search, namespace, query, candidates, where, trace) if lexical_weight > 0 else None
+            for query in queries
         ]
-        return sources
\ No newline at end of file
+        if vector_weight > 0:
+            vector_hits = self._vector_search_batch([(namespace, where, query, candidates, trace) for query in queries])
+        else:
+            vector_hits = [[] for _ in queries]
+        return [
+            self._fuse(namespace, hits, future.result() if future else [], top_k, vector_weight, lexical_weight, where)
+            for hits, future in zip(vector_hits, lexical_futures)
+        ]
+
+    def _fuse(self, namespace: _Namespace, vector_hits: List[Any], lexical_hits: List[Any], top_k: int,
+              vector_weight: float, lexical_weight: float, where: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        # Merges the two rankings with weighted reciprocal-rank fusion.
+        fused_scores: Dict[str, float] = {}
+        documents: Dict[str, Dict[str, Any]] = {}
+        for rank, (chunk_id, document) in enumerate(vector_hits, start=1):
+            fused_scores[chunk_id] = fused_scores.get(chunk_id, 0.0) + vector_weight / (RRF_K + rank)
+            documents[chunk_id] = document
+        for rank, (chunk_id, _) in enumerate(lexical_hits, start=1):
+            fused_scores[chunk_id] = fused_scores.get(chunk_id, 0.0) + lexical_weight / (RRF_K + rank)
+            if chunk_id not in documents:
+                documents[chunk_id] = namespace.lexical_index.get(chunk_id)
+
+        # Format the results into a clean list of dictionaries for the CoordinatorAgent.
+        ranked_ids = sorted(fused_scores, key=fused_scores.get, reverse=True)[:top_k]
+        return self._with_duplicates(namespace, ranked_ids, documents, where)
+
+    def _with_duplicates(self, namespace: _Namespace, ranked_ids: List[str], documents: Dict[str, Dict[str, Any]],
+                         where: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        # Adds every other location of each result's text, from the chunks collapsed into it,
+        # as "duplicates" (metadata, at most MAX_DUPLICATE_REFERENCES) and "duplicate_count".
+        # With filters, the result is reported as the first copy that matched them.
+        occurrences = namespace.fingerprints.occurrences(ranked_ids)
+        results = []
+        for chunk_id in ranked_ids:
+            document = documents[chunk_id]
+            copies = occurrences.get(chunk_id)
+            if copies is None:
+                results.append(document)
+                continue
+            shown = next((copy for copy in copies if matches_where(copy[1], where)), copies[0]) if where else \
+                next((copy for copy in copies if copy[0] == chunk_id), copies[0])
+            others = [copy_metadata for occurrence_id, copy_metadata, _ in copies if occurrence_id != shown[0]]
+            results.append({
+                "content": shown[2] if shown[2] is not None else document["content"],
+                "metadata": shown[1],
+                "duplicates": others[:MAX_DUPLICATE_REFERENCES],
+                "duplicate_count": len(others)
+            })
+        return results
+
+    def _copy_matches(self, namespace: _Namespace, where: Optional[Dict[str, Any]]) -> set:
+        # The stored chunks that match a filter only through a collapsed copy's metadata. The
+        # vector store and the lexical index filter stored chunks by their own metadata, and
+        # search these by ID as well, so a copy is found under its own source and pages.
+        # Cached until the namespace next changes.
+        if where is None:
+            return set()
+        key = json.dumps(where, sort_keys=True)
+        version = namespace.version
+        cached = namespace.copy_matches.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        matches = set(namespace.fingerprints.matching_copies(where))
+        if len(namespace.copy_matches) >= MAX_CACHED_FILTERS:
+            namespace.copy_matches.clear()
+        namespace.copy_matches[key] = (version, matches)
+        return matches
+
+    def _lexical_search(self, namespace: _Namespace, query: str, top_k: int, where: Optional[Dict[str, Any]],
+                        trace: Optional[Trace]) -> List[Tuple[str, float]]:
+        # Runs on the search pool, which does not inherit the caller's trace, so it is passed in.
+        with span("lexical_search", [trace]):
+            return namespace.lexical_index.search(query, top_k, where=where, also_ids=self._copy_matches(namespace, where))
+
+    def _vector_search(self, namespace: _Namespace, query: str, top_k: int, where: Optional[Dict[str, Any]]) -> List[Any]:
+        # Performs a semantic search on the vector database, returning (id, document) pairs.
+        request = (namespace, where, query, top_k, current_trace())
+        if self.query_batcher is not None:
+            return self.query_batcher.submit(request)
+        return self._vector_search_batch([request])[0]
+
+    def _vector_search_batch(self, requests: List[Tuple[_Namespace, Optional[Dict[str, Any]], str, int, Optional[Trace]]]) -> List[List[Any]]:
+        # Embeds a batch of (namespace, where, query, top_k, trace) requests in one call, then runs
+        # one multi-query lookup per distinct collection and filter, sized for that group's largest
+        # top_k; each request's hits are then trimmed to its own top_k. Every request's trace
+        # gets the duration of the shared batch steps it took part in.
+        with span("embed_query", [request[4] for request in requests]):
+            embeddings = self.embedder([request[2] for request in requests])
+
+        groups: Dict[Tuple[str, str], List[int]] = {}
+        for i, (namespace, where, _, _, _) in enumerate(requests):
+            groups.setdefault((namespace.tenant_id, json.dumps(where, sort_keys=True)), []).append(i)
+
+        all_hits: List[List[Any]] = [[] for _ in requests]
+        include = ["metadatas", "documents", "distances"]
+        for positions in groups.values():
+            namespace, where = requests[positions[0]][:2]
+            copy_ids = self._copy_matches(namespace, where)
+            query_embeddings = [embeddings[i] for i in positions]
+            n_results = max(requests[i][3] for i in positions)
+            with span("vector_search", [requests[i][4] for i in positions]):
+                results = namespace.collection.query(
+                    query_embeddings=query_embeddings,
+                    n_results=n_results,
+                    where=where,
+                    include=include
+                )
+                # Chunks that only match through a collapsed copy are looked up by ID and
+                # merged in by distance.
+                copies = namespace.collection.query(
+                    query_embeddings=query_embeddings,
+                    n_results=min(n_results, len(copy_ids)),
+                    ids=list(copy_ids),
+                    include=include
+                ) if copy_ids else None
+
+            # Safely extract the IDs, content and metadata from the search results.
+            for row, i in enumerate(positions):
+                hits = list(zip(results['distances'][row], results['ids'][row], results['documents'][row], results['metadatas'][row]))
+                if copies is not None:
+                    hits += zip(copies['distances'][row], copies['ids'][row], copies['documents'][row], copies['metadatas'][row])
+                    hits.sort(key=lambda hit: hit[0])
+                all_hits[i] = [
+                    (chunk_id, {"content": content, "metadata": metadata})
+                    for _, chunk_id, content, metadata in hits[:requests[i][3]]
+                ]
+        return all_hits
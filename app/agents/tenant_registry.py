@@ -0,0 +1,61 @@
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+# This class records when each tenant's collection was last used, on disk, so that
+# tenants nobody has used for a long time (e.g. abandoned browser sessions) can be found
+# and deleted even across restarts. A use is written at most once per `resolution_seconds`
+# per tenant, so busy tenants do not cost a write on every search.
+class TenantRegistry:
+    def __init__(self, path: str, resolution_seconds: float = 60.0):
+        self.resolution_seconds = resolution_seconds
+        self._lock = threading.Lock()
+        self._written: Dict[str, float] = {}
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS tenants (collection TEXT PRIMARY KEY, "
+                         "tenant_id TEXT, last_used REAL NOT NULL)")
+        self._db.commit()
+
+    def touch(self, collection_name: str, tenant_id: str, now: Optional[float] = None):
+        now = time.time() if now is None else now
+        with self._lock:
+            if now - self._written.get(collection_name, float("-inf")) < self.resolution_seconds:
+                return
+            self._written[collection_name] = now
+            self._db.execute("INSERT INTO tenants (collection, tenant_id, last_used) VALUES (?, ?, ?) "
+                             "ON CONFLICT(collection) DO UPDATE SET tenant_id = excluded.tenant_id, "
+                             "last_used = MAX(last_used, excluded.last_used)", (collection_name, tenant_id, now))
+            self._db.commit()
+
+    def register(self, collection_names: List[str], now: Optional[float] = None):
+        # Records collections whose use was never seen (created before the registry existed)
+        # as used now, so they are only deleted after a full idle period.
+        now = time.time() if now is None else now
+        with self._lock:
+            self._db.executemany("INSERT OR IGNORE INTO tenants (collection, tenant_id, last_used) VALUES (?, NULL, ?)",
+                                 [(name, now) for name in collection_names])
+            self._db.commit()
+
+    def idle(self, max_idle_seconds: float, now: Optional[float] = None) -> List[Tuple[str, Optional[str]]]:
+        # Returns (collection name, tenant ID or None if unknown) for every tenant unused for longer than this.
+        now = time.time() if now is None else now
+        with self._lock:
+            return self._db.execute("SELECT collection, tenant_id FROM tenants WHERE last_used < ? ORDER BY last_used",
+                                    (now - max_idle_seconds,)).fetchall()
+
+    def remove(self, collection_name: Optional[str] = None):
+        # Forgets one tenant, or all of them when no name is given.
+        with self._lock:
+            if collection_name is None:
+                self._db.execute("DELETE FROM tenants")
+                self._written.clear()
+            else:
+                self._db.execute("DELETE FROM tenants WHERE collection = ?", (collection_name,))
+                self._written.pop(collection_name, None)
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,126 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from typing import Optional, Dict, List, Any, Callable, Tuple
+
+# This class caches final answers in front of the retrieve-and-generate pipeline.
+# A query hits the cache if its normalized text matches a stored query exactly, or if
+# its embedding is at least `similarity_threshold` cosine-similar to one. Entries are
+# scoped to the tenant, model and retrieval settings that produced them, expire after
+# `ttl_seconds`, and are dropped whenever that tenant's documents change.
+class AnswerCache:
+    def __init__(self, embed_query: Callable[[str], Any], ttl_seconds: float = 3600,
+                 similarity_threshold: float = 0.95, max_entries: int = 1000):
+        self.embed_query = embed_query
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+
+        # (tenant, scope, normalized query) -> entry, kept in least-recently-used order.
+        self._entries: "OrderedDict[Tuple[str, str, str], Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Bumped on every invalidation (globally, or for one tenant). Answers computed against
+        # an older generation are not stored, so a query racing with an upload can never
+        # cache a stale answer.
+        self._epoch = 0
+        self._tenant_generations: Dict[str, int] = {}
+
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    def generation(self, tenant_id: str) -> Tuple[int, int]:
+        # Captured before answering a query and passed back to `store`.
+        with self._lock:
+            return self._epoch, self._tenant_generations.get(tenant_id, 0)
+
+    def lookup(self, query: str, tenant_id: str, scope: str) -> Optional[Dict[str, Any]]:
+        # Returns {"answer": ..., "sources": [...]} for a cached answer, or None on a miss.
+        key = (tenant_id, scope, normalize_query(query))
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return entry
+
+            candidates = [(k, e) for k, e in self._entries.items() if k[0] == tenant_id and k[1] == scope]
+
+        # Embedding happens outside the lock; the embedding cache makes repeats cheap.
+        if candidates and self.similarity_threshold <= 1.0:
+            query_vector = _unit(self.embed_query(query))
+            matrix = np.stack([e["embedding"] for _, e in candidates])
+            similarities = matrix @ query_vector
+            best = int(np.argmax(similarities))
+            if similarities[best] >= self.similarity_threshold:
+                with self._lock:
+                    best_key, best_entry = candidates[best]
+                    if best_key in self._entries:
+                        self._entries.move_to_end(best_key)
+                        self.semantic_hits += 1
+                        return best_entry
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def store(self, query: str, tenant_id: str, scope: str, answer: str, sources: List[Dict[str, Any]],
+              generation: Tuple[int, int]):
+        embedding = _unit(self.embed_query(query))
+        with self._lock:
+            if generation != (self._epoch, self._tenant_generations.get(tenant_id, 0)):
+                return
+            key = (tenant_id, scope, normalize_query(query))
+            self._entries[key] = {
+                "answer": answer,
+                "sources": sources,
+                "embedding": embedding,
+                "expires_at": time.time() + self.ttl_seconds
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, tenant_id: Optional[str] = None):
+        # Drops one tenant's answers, or every answer when no tenant is given.
+        with self._lock:
+            if tenant_id is None:
+                self._entries.clear()
+                self._epoch += 1
+                return
+            for key in [key for key in self._entries if key[0] == tenant_id]:
+                del self._entries[key]
+            self._tenant_generations[tenant_id] = self._tenant_generations.get(tenant_id, 0) + 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.exact_hits + self.semantic_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": (self.exact_hits + self.semantic_hits) / lookups if lookups else 0.0
+            }
+
+    def _expire(self, now: float):
+        expired = [key for key, entry in self._entries.items() if entry["expires_at"] <= now]
+        for key in expired:
+            del self._entries[key]
+
+
+def normalize_query(query: str) -> str:
+    # Case, surrounding whitespace and trailing punctuation do not change the question.
+    query = re.sub(r"\s+", " ", query.strip().lower())
+    return query.rstrip("?!. ")
+
+
+def _unit(vector: Any) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32).ravel()
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
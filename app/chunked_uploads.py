@@ -0,0 +1,227 @@
+import hashlib
+import math
+import os
+import tempfile
+import threading
+import time
+import uuid
+from pydantic import BaseModel, Field
+from typing import Optional, Dict, List, Tuple
+
+from .agents.ingestion_agent import SpooledUpload, file_sha256
+
+
+# Raised for a part or upload that cannot be accepted (bad index, wrong length, hash mismatch).
+class ChunkedUploadError(ValueError):
+    pass
+
+
+# Raised when an upload is finalized before every part of every file has arrived.
+class IncompleteUploadError(ChunkedUploadError):
+    pass
+
+
+# Raised when an upload is changed (a part sent, finalized again, or cancelled) while it is being finalized.
+class UploadBusyError(ChunkedUploadError):
+    pass
+
+
+# --- Upload Status Models ---
+# One file of a chunked upload. Part n covers bytes [n * part_size, (n + 1) * part_size).
+class ChunkedUploadFile(BaseModel):
+    filename: str
+    size: int
+    # Optional SHA-256 (hex) of the whole file, checked when the upload is finalized.
+    sha256: Optional[str] = None
+    parts: int
+    # Parts not yet received and verified; a client resumes by sending just these.
+    missing_parts: List[int]
+    received_bytes: int = 0
+
+
+# Describes a resumable upload of one or more files, which become one ingestion job.
+class ChunkedUpload(BaseModel):
+    upload_id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    tenant_id: str
+    part_size: int
+    files: List[ChunkedUploadFile]
+    created_at: float = Field(default_factory=time.time)
+    # Idle uploads are discarded (with their spooled data) after this time.
+    expires_at: float = 0.0
+
+
+# A part being received. Bytes are written straight to their place in the spooled file
+# and hashed on the way; `finish` checks the length and hash before the part counts.
+class UploadPart:
+    def __init__(self, manager: "ChunkedUploadManager", upload_id: str, file_index: int, part_number: int,
+                 path: str, offset: int, length: int):
+        self.manager = manager
+        self.upload_id = upload_id
+        self.file_index = file_index
+        self.part_number = part_number
+        self.length = length
+        self.received = 0
+        self.seconds = 0.0
+        self._digest = hashlib.sha256()
+        self._file = open(path, "r+b")
+        self._file.seek(offset)
+
+    def write(self, data: bytes):
+        start = time.perf_counter()
+        self.received += len(data)
+        if self.received > self.length:
+            raise ChunkedUploadError(f"Part {self.part_number} is longer than its {self.length} bytes.")
+        self._digest.update(data)
+        self._file.write(data)
+        self.seconds += time.perf_counter() - start
+
+    def finish(self, sha256: str) -> ChunkedUpload:
+        self.close()
+        if self.received != self.length:
+            raise ChunkedUploadError(f"Part {self.part_number} has {self.received} bytes; expected {self.length}.")
+        if self._digest.hexdigest() != sha256.lower():
+            raise ChunkedUploadError(f"Part {self.part_number} does not match its SHA-256; send it again.")
+        return self.manager._complete_part(self)
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+
+# This class implements resumable uploads: a client declares its files, sends each one in
+# fixed-size parts (in any order, retrying or resuming any that fail), then finalizes the
+# upload, which verifies it and hands the files to ingestion as if they came from /upload.
+# Parts are written directly into a spool file per file, so neither the server nor the
+# client ever holds a whole file in memory, and a dropped connection only loses one part.
+# Upload state is kept in memory: an upload cannot be resumed across a server restart.
+class ChunkedUploadManager:
+    def __init__(self, spool_dir: str, part_size: int = 8 * 1024 * 1024, ttl_seconds: float = 3600.0):
+        self.spool_dir = spool_dir
+        self.part_size = part_size
+        self.ttl_seconds = ttl_seconds
+        self._uploads: Dict[str, ChunkedUpload] = {}
+        self._paths: Dict[str, List[str]] = {}
+        # Time spent writing parts, recorded as the "spool" stage of the job on finalize.
+        self._spool_seconds: Dict[str, float] = {}
+        # Uploads being verified by `finalize`, which accept no more parts.
+        self._finalizing = set()
+        self._lock = threading.Lock()
+
+    def create(self, files: List[Tuple[str, int, Optional[str]]], tenant_id: str) -> ChunkedUpload:
+        # `files` holds (filename, size, sha256 or None). Each file is preallocated in the spool directory.
+        upload = ChunkedUpload(tenant_id=tenant_id, part_size=self.part_size, files=[
+            ChunkedUploadFile(filename=filename, size=size, sha256=sha256, parts=math.ceil(size / self.part_size),
+                              missing_parts=list(range(math.ceil(size / self.part_size))))
+            for filename, size, sha256 in files
+        ])
+        upload.expires_at = upload.created_at + self.ttl_seconds
+        paths = []
+        for file in upload.files:
+            fd, path = tempfile.mkstemp(dir=self.spool_dir)
+            with os.fdopen(fd, "wb") as target:
+                target.truncate(file.size)
+            paths.append(path)
+        with self._lock:
+            self._prune_expired()
+            self._uploads[upload.upload_id] = upload
+            self._paths[upload.upload_id] = paths
+            self._spool_seconds[upload.upload_id] = 0.0
+        return upload.model_copy(deep=True)
+
+    def get(self, upload_id: str) -> Optional[ChunkedUpload]:
+        with self._lock:
+            self._prune_expired()
+            upload = self._uploads.get(upload_id)
+            return upload.model_copy(deep=True) if upload else None
+
+    def open_part(self, upload_id: str, file_index: int, part_number: int) -> Optional[UploadPart]:
+        # Returns None for an unknown upload. A part that is being sent again stops counting
+        # as received until its new bytes have been verified.
+        with self._lock:
+            upload = self._uploads.get(upload_id)
+            if upload is None:
+                return None
+            if upload_id in self._finalizing:
+                raise UploadBusyError(f"Upload {upload_id} is being finalized.")
+            if not 0 <= file_index < len(upload.files):
+                raise ChunkedUploadError(f"Upload {upload_id} has no file {file_index}.")
+            file = upload.files[file_index]
+            if not 0 <= part_number < file.parts:
+                raise ChunkedUploadError(f"{file.filename} has parts 0 to {file.parts - 1}; got {part_number}.")
+            offset = part_number * upload.part_size
+            length = min(upload.part_size, file.size - offset)
+            if part_number not in file.missing_parts:
+                file.missing_parts = sorted(file.missing_parts + [part_number])
+                file.received_bytes -= length
+            upload.expires_at = time.time() + self.ttl_seconds
+            path = self._paths[upload_id][file_index]
+        return UploadPart(self, upload_id, file_index, part_number, path, offset, length)
+
+    def _complete_part(self, part: UploadPart) -> ChunkedUpload:
+        with self._lock:
+            upload = self._uploads.get(part.upload_id)
+            if upload is None:
+                raise ChunkedUploadError(f"Upload {part.upload_id} expired or was cancelled.")
+            file = upload.files[part.file_index]
+            if part.part_number in file.missing_parts:
+                file.missing_parts = [number for number in file.missing_parts if number != part.part_number]
+                file.received_bytes += part.length
+            self._spool_seconds[part.upload_id] += part.seconds
+            upload.expires_at = time.time() + self.ttl_seconds
+            return upload.model_copy(deep=True)
+
+    def finalize(self, upload_id: str) -> Optional[Tuple[ChunkedUpload, List[SpooledUpload], float]]:
+        # Checks that every part arrived and that each file matches its declared SHA-256, then
+        # releases the spooled files to the caller (the ingestion job removes them when done).
+        # Returns the upload, its files and the seconds spent spooling them, or None if unknown.
+        with self._lock:
+            upload = self._uploads.get(upload_id)
+            if upload is None:
+                return None
+            incomplete = [file.filename for file in upload.files if file.missing_parts]
+            if incomplete:
+                raise IncompleteUploadError(f"Parts are still missing for: {', '.join(incomplete)}.")
+            if upload_id in self._finalizing:
+                raise UploadBusyError(f"Upload {upload_id} is already being finalized.")
+            self._finalizing.add(upload_id)
+            paths = self._paths[upload_id]
+
+        try:
+            spooled = []
+            for file, path in zip(upload.files, paths):
+                file_hash = file_sha256(path)
+                if file.sha256 is not None and file_hash != file.sha256.lower():
+                    raise ChunkedUploadError(f"{file.filename} does not match its SHA-256; cancel the upload and send it again.")
+                spooled.append(SpooledUpload(filename=file.filename, path=path, sha256=file_hash))
+        finally:
+            with self._lock:
+                self._finalizing.discard(upload_id)
+
+        with self._lock:
+            if self._uploads.pop(upload_id, None) is None:
+                return None
+            del self._paths[upload_id]
+            return upload.model_copy(deep=True), spooled, self._spool_seconds.pop(upload_id)
+
+    def cancel(self, upload_id: str) -> bool:
+        # An upload being finalized is hashing its files, which must not be removed under it.
+        with self._lock:
+            if upload_id not in self._uploads:
+                return False
+            if upload_id in self._finalizing:
+                raise UploadBusyError(f"Upload {upload_id} is being finalized and can no longer be cancelled.")
+            self._discard(upload_id)
+            return True
+
+    def _prune_expired(self):
+        now = time.time()
+        for upload_id in [upload_id for upload_id, upload in self._uploads.items()
+                          if upload.expires_at < now and upload_id not in self._finalizing]:
+            self._discard(upload_id)
+
+    def _discard(self, upload_id: str):
+        del self._uploads[upload_id]
+        del self._spool_seconds[upload_id]
+        for path in self._paths.pop(upload_id):
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,249 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from pydantic import BaseModel, Field
+from typing import Optional, Dict, List, Any, BinaryIO, Iterable
+
+from .agents.ingestion_agent import SpooledUpload, chunk_spooled_upload, iter_upload_chunks, iter_batches, file_sha256
+from .telemetry import Trace, activate, record
+
+# --- Job Status Model ---
+# Describes the state of one background ingestion job as reported by the API.
+class IngestionJob(BaseModel):
+    job_id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+
+    # One of "queued", "running", "completed" or "failed". A job whose files failed only in
+    # part completes; the files that failed are listed in file_errors.
+    status: str = "queued"
+
+    # Names of the files submitted with this job, and the tenant whose documents they join.
+    files: List[str]
+    tenant_id: str
+
+    # Progress counters, updated by the background worker as the job advances.
+    files_parsed: int = 0
+    # Files whose content matches what is already indexed, so nothing had to be done.
+    files_unchanged: int = 0
+    # Files that could not be parsed or indexed, with the error for each. Whatever such a
+    # file had already added is removed again, and its previously indexed version is kept.
+    files_failed: int = 0
+    file_errors: Dict[str, str] = Field(default_factory=dict)
+    chunks_total: int = 0
+    chunks_indexed: int = 0
+    # The chunks the indexed files would have made had their short paragraphs, slides and
+    # rows not been packed together, for comparison with chunks_total.
+    chunks_before_packing: int = 0
+    # Indexed chunks that duplicated a stored chunk, so only a reference to them was kept.
+    chunks_deduplicated: int = 0
+    progress: float = 0.0
+
+    # The trace this job's spans are recorded under, and the milliseconds spent so far in
+    # each stage (spool, parse, split, dedup, embed, add), summed over all files.
+    trace_id: str = ""
+    stage_ms: Dict[str, float] = Field(default_factory=dict)
+
+    error: Optional[str] = None
+    created_at: float = Field(default_factory=time.time)
+    finished_at: Optional[float] = None
+
+
+# This class runs uploads in the background so that /upload can return immediately.
+# Parsing happens in parallel across files on a process pool (the parsers are CPU-bound
+# and hold the GIL), while embedding and indexing run in batches on a single worker
+# thread so that writes to the vector database are serialized.
+# Files at or above `stream_threshold_bytes` skip the process pool: they are streamed
+# through parse, split and embed-and-add on the worker thread one batch at a time, so
+# peak memory is bounded by the batch size rather than by the size of the file.
+class IngestionJobManager:
+    def __init__(self, ingestion_agent: Any, retrieval_agent: Any, parse_workers: Optional[int] = None,
+                 embed_batch_size: int = 64, max_finished_jobs: int = 100,
+                 stream_threshold_bytes: int = 50 * 1024 * 1024):
+        self.ingestion_agent = ingestion_agent
+        self.retrieval_agent = retrieval_agent
+        self.embed_batch_size = embed_batch_size
+        self.max_finished_jobs = max_finished_jobs
+        self.stream_threshold_bytes = stream_threshold_bytes
+
+        # Uploaded files are copied here before being handed to the parser processes.
+        self.spool_dir = tempfile.mkdtemp(prefix="docubot-uploads-")
+
+        # Worker processes are only started when the first job is submitted. They are spawned
+        # rather than forked: by then the server runs threads (the embed worker, torch, Chroma)
+        # whose locks a forked child could inherit in a held state and deadlock on. A spawned
+        # worker imports only the parser module, whose entry point (chunk_spooled_upload) is
+        # a module-level function.
+        self._parse_pool = ProcessPoolExecutor(max_workers=parse_workers, mp_context=multiprocessing.get_context("spawn"))
+        self._embed_worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embed-worker")
+
+        self._jobs: Dict[str, IngestionJob] = {}
+        self._traces: Dict[str, Trace] = {}
+        self._lock = threading.Lock()
+
+    def spool(self, filename: str, source: BinaryIO) -> SpooledUpload:
+        # Copies an uploaded file to the spool directory so a worker process can read it.
+        fd, path = tempfile.mkstemp(dir=self.spool_dir)
+        with os.fdopen(fd, "wb") as target:
+            shutil.copyfileobj(source, target)
+        return SpooledUpload(filename=filename, path=path)
+
+    def submit(self, uploads: List[SpooledUpload], tenant_id: str, trace: Optional[Trace] = None) -> IngestionJob:
+        # Registers a new job and schedules it on the embedding worker. The job's stages are
+        # recorded under `trace`, so they share a trace_id with the upload request.
+        trace = trace or Trace(str(uuid.uuid4()))
+        job = IngestionJob(files=[upload.filename for upload in uploads], tenant_id=tenant_id,
+                           trace_id=trace.trace_id, stage_ms=trace.totals_ms())
+        with self._lock:
+            self._jobs[job.job_id] = job
+            self._traces[job.job_id] = trace
+            self._prune_finished_jobs()
+        self._embed_worker.submit(self._run, job, uploads)
+        return job.model_copy()
+
+    def get(self, job_id: str) -> Optional[IngestionJob]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job.model_copy() if job else None
+
+    def list_jobs(self) -> List[IngestionJob]:
+        with self._lock:
+            return [job.model_copy() for job in self._jobs.values()]
+
+    def shutdown(self):
+        self._embed_worker.shutdown(wait=False, cancel_futures=True)
+        self._parse_pool.shutdown(wait=False, cancel_futures=True)
+        shutil.rmtree(self.spool_dir, ignore_errors=True)
+
+    def _run(self, job: IngestionJob, uploads: List[SpooledUpload]):
+        # Executes on the embedding worker thread. Small files are parsed concurrently on the
+        # process pool while large files are streamed here; each file is indexed as soon as it is ready.
+        job.status = "running"
+        trace = self._traces[job.job_id]
+        try:
+            with activate(trace):
+                self._run_traced(job, uploads, trace)
+            job.progress = 1.0
+            if job.files_failed:
+                job.error = f"{job.files_failed} of {len(job.files)} files could not be indexed."
+            job.status = "failed" if job.files and job.files_failed == len(job.files) else "completed"
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+            job.stage_ms = trace.totals_ms()
+            for upload in uploads:
+                self._remove_spooled(upload)
+
+    def _run_traced(self, job: IngestionJob, uploads: List[SpooledUpload], trace: Trace):
+        # The body of `_run`, with `trace` active so embedding and indexing spans land on it.
+        # A file that fails is recorded in the job and the others carry on. Each spooled file
+        # is removed as soon as its own parsing and indexing are over.
+        futures = {}
+        streamed = []
+        try:
+            for upload in uploads:
+                try:
+                    # Re-uploads of an unchanged file are a no-op: skip parsing and embedding entirely.
+                    file_hash = upload.sha256 or file_sha256(upload.path)
+                    if self.retrieval_agent.is_source_unchanged(upload.filename, file_hash, tenant_id=job.tenant_id):
+                        self._remove_spooled(upload)
+                        with self._lock:
+                            job.files_parsed += 1
+                            job.files_unchanged += 1
+                            self._update_progress(job)
+                    elif os.path.getsize(upload.path) >= self.stream_threshold_bytes:
+                        streamed.append((upload, file_hash))
+                    else:
+                        futures[self._parse_pool.submit(chunk_spooled_upload, upload)] = (upload, file_hash)
+                except Exception as e:
+                    self._fail_file(job, upload, e)
+
+            # Large files are streamed first, while the pool works through the small ones.
+            for upload, file_hash in streamed:
+                timings: Dict[str, float] = {}
+                counts: Dict[str, int] = {}
+                try:
+                    self._index_file(job, upload, file_hash, iter_upload_chunks(upload, self.ingestion_agent, timings, counts), counts)
+                except Exception as e:
+                    self._fail_file(job, upload, e)
+                self._record_timings(timings, trace)
+
+            for future in as_completed(futures):
+                upload, file_hash = futures[future]
+                try:
+                    chunks, timings, counts = future.result()
+                    # Parsing and splitting ran in a worker process; their timings are recorded here.
+                    self._record_timings(timings, trace)
+                    with self._lock:
+                        job.chunks_total += len(chunks)
+                    self._index_file(job, upload, file_hash, chunks, counts, counted=True)
+                except Exception as e:
+                    self._fail_file(job, upload, e)
+        finally:
+            # Parser processes may still be reading spooled files if this exits early.
+            wait(futures)
+
+    def _fail_file(self, job: IngestionJob, upload: SpooledUpload, error: Exception):
+        self._remove_spooled(upload)
+        with self._lock:
+            job.files_failed += 1
+            job.file_errors[upload.filename] = str(error) or type(error).__name__
+            self._update_progress(job)
+
+    def _remove_spooled(self, upload: SpooledUpload):
+        if os.path.exists(upload.path):
+            os.remove(upload.path)
+
+    def _record_timings(self, timings: Dict[str, float], trace: Trace):
+        for stage, seconds in timings.items():
+            record(stage, seconds, [trace])
+
+    def _index_file(self, job: IngestionJob, upload: SpooledUpload, file_hash: str, chunks: Iterable[Dict[str, Any]],
+                    counts: Dict[str, int], counted: bool = False):
+        # Embeds and stores a file's chunks in fixed-size batches. Only the chunk IDs are kept
+        # for the whole file, so the previous version's stale chunks can be removed at the end.
+        # `counts` holds the file's packing counts, complete once `chunks` is exhausted.
+        # If the file fails part-way, the chunks it added so far are removed again.
+        chunk_ids = []
+        try:
+            for batch in iter_batches(chunks, self.embed_batch_size):
+                chunk_ids.extend(chunk["id"] for chunk in batch)
+                collapsed = self.retrieval_agent.add_documents(batch, tenant_id=job.tenant_id)
+                with self._lock:
+                    if not counted:
+                        job.chunks_total += len(batch)
+                    job.chunks_indexed += len(batch)
+                    job.chunks_deduplicated += collapsed
+                    self._update_progress(job)
+
+            # Drop chunks from the previous version of this file that no longer exist.
+            self.retrieval_agent.finalize_source(upload.filename, file_hash, chunk_ids, tenant_id=job.tenant_id)
+        except Exception:
+            self.retrieval_agent.discard_chunks(upload.filename, chunk_ids, tenant_id=job.tenant_id)
+            raise
+        finally:
+            self._remove_spooled(upload)
+        with self._lock:
+            job.files_parsed += 1
+            job.chunks_before_packing += len(chunk_ids) + counts.get("merged_units", 0)
+            self._update_progress(job)
+
+    def _update_progress(self, job: IngestionJob):
+        # Parsing and indexing each account for half of the reported progress.
+        parse_fraction = (job.files_parsed + job.files_failed) / len(job.files) if job.files else 1.0
+        index_fraction = job.chunks_indexed / job.chunks_total if job.chunks_total else parse_fraction
+        job.progress = round(0.5 * parse_fraction + 0.5 * index_fraction, 4)
+        job.stage_ms = self._traces[job.job_id].totals_ms()
+
+    def _prune_finished_jobs(self):
+        # Keeps the job table bounded by forgetting the oldest finished jobs.
+        finished = [job for job in self._jobs.values() if job.finished_at is not None]
+        excess = len(finished) - self.max_finished_jobs
+        for job in sorted(finished, key=lambda j: j.finished_at)[:max(excess, 0)]:
+            del self._jobs[job.job_id]
+            del self._traces[job.job_id]
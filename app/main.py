@@ -1,110 +1,699 @@
+import asyncio
+import json
+import os
+import threading
+import time
 import uuid
-from fastapi import FastAPI, UploadFile, HTTPException
-from pydantic import BaseModel
-from typing import Optional, Dict, List, Any
-from google.api_core.exceptions import ResourceExhausted
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, UploadFile, HTTPException, Form, Request, Header
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
+from pydantic import BaseModel, Field
+from typing import Optional, Dict, List, Any, AsyncIterator, Tuple, Union
 
 # Import the specialized agents and the MCP data models
-from .agents.retrieval_agent import RetrievalAgent
+from .agents.retrieval_agent import RetrievalAgent, DEFAULT_TENANT
 from .agents.ingestion_agent import IngestionAgent
 from .agents.llm_response_agent import LLMResponseAgent
+from .agents.llm_providers import ProviderQuotaError, ProviderTimeoutError, ProviderNotConfiguredError, UnknownModelError
+from .agents.context_builder import ContextBuilder, parse_token_budgets, estimate_tokens
 from .mcp_models import MCPMessage, MCPPayload
+from .ingestion_jobs import IngestionJob, IngestionJobManager
+from .chunked_uploads import ChunkedUpload, ChunkedUploadManager, ChunkedUploadError, IncompleteUploadError, UploadBusyError
+from .answer_cache import AnswerCache
+from .session_store import create_session_store
+from .telemetry import (
+    REGISTRY, REQUEST_SECONDS, LLM_TOKENS, CONTEXT_TOKENS_SAVED, CONTEXT_TOKENS_TRUNCATED, Trace, activate, current_trace, record, span
+)
 
 # --- Pydantic Models for API Data Validation ---
+# Optional metadata filters applied inside retrieval. Sources and file types accept a
+# single value or a list; the page range applies to paginated documents (PDFs).
+class SearchFilters(BaseModel):
+    source: Optional[Union[str, List[str]]] = None
+    file_type: Optional[Union[str, List[str]]] = None
+    page_from: Optional[int] = Field(default=None, ge=1)
+    page_to: Optional[int] = Field(default=None, ge=1)
+
 # Defines the expected JSON structure for incoming queries from the frontend.
 class QueryRequest(BaseModel):
     query: str
     session_id: Optional[str] = None
     model_name: str = "gemini"
+    # Relative contribution of dense (vector) and lexical (BM25) retrieval to the ranking.
+    vector_weight: float = Field(default=1.0, ge=0)
+    lexical_weight: float = Field(default=1.0, ge=0)
+    # The tenant whose documents are searched; each tenant has its own collection.
+    tenant_id: Optional[str] = None
+    filters: Optional[SearchFilters] = None
+
+# Optional body for /clear_session. A session ID clears that conversation, a tenant ID
+# clears that tenant's documents, and an empty body clears all state.
+class ClearSessionRequest(BaseModel):
+    session_id: Optional[str] = None
+    tenant_id: Optional[str] = None
+
+# Body of /query_batch: many independent questions that share a model, retrieval settings,
+# tenant and filters (e.g. an evaluation set). Batch questions are not added to any session.
+class QueryBatchRequest(BaseModel):
+    queries: List[str] = Field(min_length=1)
+    model_name: str = "gemini"
+    vector_weight: float = Field(default=1.0, ge=0)
+    lexical_weight: float = Field(default=1.0, ge=0)
+    tenant_id: Optional[str] = None
+    filters: Optional[SearchFilters] = None
+
+# Body of POST /uploads: the files of a resumable upload, sent in parts afterwards.
+class UploadFileSpec(BaseModel):
+    filename: str
+    size: int = Field(ge=0)
+    # SHA-256 (hex) of the whole file; if given, it is checked on finalize.
+    sha256: Optional[str] = None
+
+class ChunkedUploadRequest(BaseModel):
+    files: List[UploadFileSpec] = Field(min_length=1)
+    tenant_id: Optional[str] = None
 
 # Defines the JSON structure for responses sent back to the frontend.
 class QueryResponse(BaseModel):
     answer: str
     session_id: str
     sources: List[Dict[str, Any]]
+    # How the retrieved chunks were packed into the model's context, including tokens saved.
+    context_stats: Dict[str, int] = {}
+    # The MCP trace_id; per-stage timings for it are in the Server-Timing response header.
+    trace_id: Optional[str] = None
+
+# Conversation histories for the different sessions, bounded and evictable
+# (in memory by default, or SQLite-backed with SESSION_STORE=sqlite).
+session_store = create_session_store()
+
+# --- Agent Initialization ---
+# Create single, long-lived instances of our specialist agents. Constructing them is cheap:
+# the embedding model, parsing libraries and LLM SDK clients are loaded on first use, or
+# by the background warmup that starts with the server.
+retrieval_agent = RetrievalAgent()
+ingestion_agent = IngestionAgent()
+llm_response_agent = LLMResponseAgent()
+
+# Packs retrieved chunks into each model's token budget, merging overlaps and dropping duplicates.
+context_builder = ContextBuilder(token_budgets=parse_token_budgets(os.environ.get("CONTEXT_TOKEN_BUDGETS", "")))
+
+# Cache of final answers for repeated and near-duplicate questions. A tenant's entries
+# are flushed automatically whenever that tenant's documents change.
+answer_cache = AnswerCache(
+    embed_query=retrieval_agent.embed_query,
+    ttl_seconds=float(os.environ.get("ANSWER_CACHE_TTL_SECONDS", "3600")),
+    similarity_threshold=float(os.environ.get("ANSWER_CACHE_SIMILARITY", "0.95")),
+    max_entries=int(os.environ.get("ANSWER_CACHE_SIZE", "1000"))
+)
+retrieval_agent.add_change_listener(answer_cache.invalidate)
+
+# Background runner for uploads, so ingestion never blocks the event loop.
+ingestion_jobs = IngestionJobManager(
+    ingestion_agent,
+    retrieval_agent,
+    embed_batch_size=int(os.environ.get("INGEST_BATCH_SIZE", "64")),
+    stream_threshold_bytes=int(float(os.environ.get("INGEST_STREAM_THRESHOLD_MB", "50")) * 1024 * 1024)
+)
+
+# Resumable uploads, sent in parts and spooled next to the regular uploads.
+chunked_uploads = ChunkedUploadManager(
+    ingestion_jobs.spool_dir,
+    part_size=int(float(os.environ.get("UPLOAD_PART_SIZE_MB", "8")) * 1024 * 1024),
+    ttl_seconds=float(os.environ.get("UPLOAD_TTL_SECONDS", "3600"))
+)
+
+# --- Warmup and Readiness ---
+# The server accepts connections immediately while the embedding model is loaded in a
+# background thread. /readyz reports 503 until that has finished, so an orchestrator only
+# routes traffic to a warm instance; requests that arrive earlier still work, but wait
+# for the model to load.
+readiness = {"status": "warming", "error": None}
+
+def warm_up():
+    start = time.perf_counter()
+    try:
+        retrieval_agent.warmup()
+        llm_response_agent.warmup()
+        readiness["status"] = "ready"
+    except Exception as e:
+        readiness.update(status="failed", error=str(e))
+    # Feeds docubot_stage_seconds{stage="warmup"} on /metrics.
+    record("warmup", time.perf_counter() - start, [])
+
+# --- Tenant Retention ---
+# Every browser session of the UI gets its own tenant, so tenants that nobody has searched or
+# uploaded to for TENANT_RETENTION_DAYS are deleted from disk, checked once an hour.
+# 0 keeps every tenant forever. The default tenant is never deleted.
+TENANT_RETENTION_SECONDS = float(os.environ.get("TENANT_RETENTION_DAYS", "30")) * 86400
+TENANT_PURGE_INTERVAL_SECONDS = 3600
+
+async def purge_idle_tenants():
+    while True:
+        try:
+            await run_in_threadpool(retrieval_agent.purge_idle_tenants, TENANT_RETENTION_SECONDS)
+        except Exception as e:
+            print(f"Purging idle tenants failed: {e}")
+        await asyncio.sleep(TENANT_PURGE_INTERVAL_SECONDS)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    threading.Thread(target=warm_up, name="warmup", daemon=True).start()
+    purge_task = asyncio.create_task(purge_idle_tenants()) if TENANT_RETENTION_SECONDS > 0 else None
+    yield
+    if purge_task is not None:
+        purge_task.cancel()
+    # Stop the parser processes, remove any spooled files and close pooled LLM connections on shutdown.
+    ingestion_jobs.shutdown()
+    await llm_response_agent.aclose()
+
+# Message returned to the client when a provider reports an exhausted API quota.
+QUOTA_EXCEEDED_DETAIL = "The daily API quota for the selected model has been exceeded. Please try again tomorrow or switch models."
+# Message returned to the client when a provider does not answer in time.
+TIMEOUT_DETAIL = "The selected model took too long to respond. Please try again or switch models."
+# Message returned to the client when the selected model has no API key configured.
+NOT_CONFIGURED_DETAIL = "The selected model is not configured on this server. Please switch models."
+# Message returned to the client when the selected model does not exist.
+UNKNOWN_MODEL_DETAIL = "Invalid model selected."
+
+# /query_batch limits: questions per request, questions searched together, and questions
+# retrieved but not yet answered (which bounds the memory a large batch holds at once).
+BATCH_MAX_QUERIES = int(os.environ.get("QUERY_BATCH_MAX_QUERIES", "10000"))
+BATCH_SEARCH_SIZE = int(os.environ.get("QUERY_BATCH_SEARCH_SIZE", "32"))
+BATCH_MAX_IN_FLIGHT = max(1, int(os.environ.get("QUERY_BATCH_MAX_IN_FLIGHT", "128")))
 
 # Initialize the main FastAPI application instance. This acts as our CoordinatorAgent.
 app = FastAPI(
     title="Agentic RAG Coordinator",
-    description="The central orchestration agent for the RAG chatbot."
+    description="The central orchestration agent for the RAG chatbot.",
+    lifespan=lifespan
 )
 
-# In-memory dictionary to store conversation histories for different sessions.
-chat_histories: Dict[str, List[Dict[str, str]]] = {}
+# --- Tracing and Metrics ---
+# Every request gets a trace whose ID is used as the MCP trace_id. Pipeline stages add
+# spans to it, and the stage timings are returned in the X-Trace-Id and Server-Timing
+# headers. For streamed responses the headers only cover the stages that finished before
+# streaming began; the final "done" event carries the complete timings.
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    trace = Trace(str(uuid.uuid4()))
+    start = time.perf_counter()
+    with activate(trace):
+        response = await call_next(request)
+    route = request.scope.get("route")
+    REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=getattr(route, "path", "unmatched"))
+    response.headers["X-Trace-Id"] = trace.trace_id
+    if trace.spans:
+        response.headers["Server-Timing"] = trace.server_timing()
+    return response
 
-# --- Agent Initialization ---
-# Create single, long-lived instances of our specialist agents.
-retrieval_agent = RetrievalAgent()
-ingestion_agent = IngestionAgent()
-llm_response_agent = LLMResponseAgent()
+def cache_metrics():
+    # Cache and session counters are kept by their owners and read at scrape time.
+    embedding = retrieval_agent.embedding_cache.stats()
+    answers = answer_cache.stats()
+    sessions = session_store.summary()
+    return [
+        ("docubot_embedding_cache_lookups_total", "counter", "Embedding cache lookups by result.", [
+            ({"result": "memory_hit"}, embedding["memory_hits"]),
+            ({"result": "disk_hit"}, embedding["disk_hits"]),
+            ({"result": "miss"}, embedding["misses"])
+        ]),
+        ("docubot_answer_cache_lookups_total", "counter", "Answer cache lookups by result.", [
+            ({"result": "exact_hit"}, answers["exact_hits"]),
+            ({"result": "semantic_hit"}, answers["semantic_hits"]),
+            ({"result": "miss"}, answers["misses"])
+        ]),
+        ("docubot_answer_cache_entries", "gauge", "Answers currently cached.", [({}, answers["entries"])]),
+        ("docubot_sessions", "gauge", "Conversation sessions currently stored.", [({}, sessions["sessions"])]),
+        ("docubot_session_evictions_total", "counter", "Sessions evicted to stay within the store's limits.", [({}, sessions.get("evictions", 0))])
+    ]
+
+REGISTRY.add_collector(cache_metrics)
+
+def count_tokens(request: QueryRequest, mcp_message: MCPMessage, answer: str):
+    # Token counts are estimates (see estimate_tokens), comparable across providers.
+    stats = mcp_message.payload.context_stats
+    LLM_TOKENS.inc(stats.get("tokens_out", 0) + estimate_tokens(request.query), model=request.model_name, kind="prompt")
+    LLM_TOKENS.inc(estimate_tokens(answer), model=request.model_name, kind="completion")
+    CONTEXT_TOKENS_SAVED.inc(stats.get("tokens_saved", 0), model=request.model_name)
+    CONTEXT_TOKENS_TRUNCATED.inc(stats.get("tokens_truncated", 0), model=request.model_name)
+
+@app.get("/healthz")
+async def healthz():
+    # Liveness: the process is up and serving requests, whether or not it is warm yet.
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    # Readiness: 200 once the embedding model is loaded, 503 while warming up (or if warmup failed).
+    body = {
+        **readiness,
+        "models": list(llm_response_agent.providers),
+        "disabled_models": llm_response_agent.disabled
+    }
+    return JSONResponse(body, status_code=200 if readiness["status"] == "ready" else 503)
+
+@app.get("/metrics")
+async def get_metrics():
+    # Prometheus text exposition format.
+    # Rendering reads the session store, which may be a SQLite file, so it runs off the event loop.
+    return PlainTextResponse(await run_in_threadpool(REGISTRY.render), media_type="text/plain; version=0.0.4")
 
 # --- API Endpoints ---
-@app.post("/upload")
-async def handle_upload(files: List[UploadFile]):
-    # 1. IngestionAgent processes and chunks the uploaded files.
-    final_chunks = ingestion_agent.process_files(files)
-    # 2. RetrievalAgent embeds and stores the chunks in the vector database.
-    retrieval_agent.add_documents(final_chunks)
-    return {"status": "success", "message": f"{len(files)} files processed and indexed."}
+@app.post("/upload", status_code=202)
+async def handle_upload(files: List[UploadFile], tenant_id: Optional[str] = Form(None)):
+    # 1. Spool the uploads to disk so the parser processes can read them.
+    with span("spool"):
+        uploads = [await run_in_threadpool(ingestion_jobs.spool, file.filename, file.file) for file in files]
+    # 2. Hand the files to a background job; parsing and indexing happen off the event loop.
+    # The job records its stages under this request's trace; see GET /jobs/{job_id}.
+    job = ingestion_jobs.submit(uploads, tenant_id or DEFAULT_TENANT, trace=current_trace())
+    return {"status": "accepted", "job_id": job.job_id, "trace_id": job.trace_id, "message": f"{len(files)} files queued for ingestion."}
+
+# --- Resumable Uploads ---
+# POST /uploads declares the files and returns an upload_id and the part size. Each part
+# is then sent with PUT /uploads/{upload_id}/files/{file_index}/parts/{part_number} as the
+# raw request body, with its SHA-256 in the X-Part-SHA256 header; parts can be sent in any
+# order, in parallel, and again after a failure. GET /uploads/{upload_id} lists the parts
+# still missing, so an interrupted client resumes where it stopped. POST .../finalize
+# verifies the files and starts ingestion, returning the same job as /upload.
+
+@app.post("/uploads", response_model=ChunkedUpload, status_code=201)
+async def create_upload(request: ChunkedUploadRequest):
+    files = [(file.filename, file.size, file.sha256) for file in request.files]
+    return await run_in_threadpool(chunked_uploads.create, files, request.tenant_id or DEFAULT_TENANT)
+
+@app.get("/uploads/{upload_id}", response_model=ChunkedUpload)
+async def get_upload(upload_id: str):
+    upload = chunked_uploads.get(upload_id)
+    if upload is None:
+        raise HTTPException(status_code=404, detail=f"Unknown upload ID: {upload_id}")
+    return upload
+
+@app.put("/uploads/{upload_id}/files/{file_index}/parts/{part_number}", response_model=ChunkedUpload)
+async def upload_part(upload_id: str, file_index: int, part_number: int, request: Request,
+                      part_sha256: str = Header(alias="X-Part-SHA256")):
+    # The body is streamed to disk as it arrives, never held in memory as a whole.
+    try:
+        part = await run_in_threadpool(chunked_uploads.open_part, upload_id, file_index, part_number)
+        if part is None:
+            raise HTTPException(status_code=404, detail=f"Unknown upload ID: {upload_id}")
+        try:
+            async for data in request.stream():
+                if data:
+                    await run_in_threadpool(part.write, data)
+            return await run_in_threadpool(part.finish, part_sha256)
+        finally:
+            part.close()
+    except UploadBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ChunkedUploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/uploads/{upload_id}/finalize", status_code=202)
+async def finalize_upload(upload_id: str):
+    with span("spool"):
+        try:
+            finalized = await run_in_threadpool(chunked_uploads.finalize, upload_id)
+        except (IncompleteUploadError, UploadBusyError) as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        except ChunkedUploadError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    if finalized is None:
+        raise HTTPException(status_code=404, detail=f"Unknown upload ID: {upload_id}")
+    upload, spooled, spool_seconds = finalized
+    # The parts arrived in their own requests; their write time counts towards this job's spool stage.
+    record("spool", spool_seconds)
+    job = ingestion_jobs.submit(spooled, upload.tenant_id, trace=current_trace())
+    return {"status": "accepted", "job_id": job.job_id, "trace_id": job.trace_id, "message": f"{len(spooled)} files queued for ingestion."}
+
+@app.delete("/uploads/{upload_id}")
+async def cancel_upload(upload_id: str):
+    try:
+        cancelled = await run_in_threadpool(chunked_uploads.cancel, upload_id)
+    except UploadBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if not cancelled:
+        raise HTTPException(status_code=404, detail=f"Unknown upload ID: {upload_id}")
+    return {"status": "success", "message": f"Upload {upload_id} cancelled."}
+
+@app.get("/jobs", response_model=List[IngestionJob])
+async def list_jobs():
+    return ingestion_jobs.list_jobs()
+
+@app.get("/jobs/{job_id}", response_model=IngestionJob)
+async def get_job(job_id: str):
+    # Reports the status and progress of a single ingestion job.
+    job = ingestion_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job ID: {job_id}")
+    return job
+
+@app.get("/stats")
+async def get_stats():
+    # Cache statistics, useful for checking how much work the caches are saving.
+    return {
+        "embedding_cache": retrieval_agent.embedding_cache.stats(),
+        "answer_cache": answer_cache.stats(),
+        "sessions": await run_in_threadpool(session_store.summary),
+        "loaded_namespaces": len(retrieval_agent.loaded_namespaces())
+    }
+
+@app.get("/sessions/{session_id}")
+async def get_session(session_id: str):
+    # Reports the size of a single session's history.
+    stats = await run_in_threadpool(session_store.stats, session_id)
+    if stats is None:
+        raise HTTPException(status_code=404, detail=f"Unknown session ID: {session_id}")
+    return {"session_id": session_id, **stats}
 
 @app.post("/clear_session")
-async def clear_session():
-    global chat_histories
+async def clear_session(request: Optional[ClearSessionRequest] = None):
+    if request is not None and (request.session_id or request.tenant_id):
+        cleared = []
+        if request.session_id:
+            # Clear only this session's conversation history.
+            await run_in_threadpool(session_store.clear, request.session_id)
+            cleared.append(f"chat history for session {request.session_id}")
+        if request.tenant_id:
+            # Clear only this tenant's document knowledge base.
+            await run_in_threadpool(retrieval_agent.clear_collection, request.tenant_id)
+            cleared.append(f"document knowledge for tenant {request.tenant_id}")
+        return {"status": "success", "message": f"Cleared {' and '.join(cleared)}."}
+
     # Clear both the conversation history and the document knowledge base.
-    chat_histories = {}
-    retrieval_agent.clear_collection()
+    await run_in_threadpool(session_store.clear)
+    await run_in_threadpool(retrieval_agent.clear_collection)
     return {"status": "success", "message": "All chat histories and document knowledge have been cleared."}
 
-@app.post("/query", response_model=QueryResponse)
-async def handle_query(request: QueryRequest):
+def tenant_of(request: QueryRequest) -> str:
+    return request.tenant_id or DEFAULT_TENANT
+
+def search_filters(request: QueryRequest) -> Dict[str, Any]:
+    return request.filters.model_dump(exclude_none=True) if request.filters else {}
+
+def answer_cache_scope(request: QueryRequest) -> str:
+    # Cached answers are only reused for the same model, retrieval weighting and filters.
+    filters = json.dumps(search_filters(request), sort_keys=True)
+    return f"{request.model_name}|{request.vector_weight}|{request.lexical_weight}|{filters}"
+
+def open_session(request: QueryRequest) -> Tuple[str, List[Dict[str, str]]]:
     # Ensure a session ID exists, creating one if it's a new conversation.
     session_id = request.session_id or str(uuid.uuid4())
     
-    # Retrieve and update the chat history for the current session.
-    history = chat_histories.get(session_id, [])
+    # Retrieve the chat history for the current session and add the new question to it.
+    history = session_store.get_history(session_id)
     history.append({"role": "user", "content": request.query})
-    
+    return session_id, history
+
+def record_exchange(session_id: str, history: List[Dict[str, str]], answer: str):
+    # Persists the question (the last history entry) together with the assistant's answer.
+    session_store.append(session_id, [history[-1], {"role": "assistant", "content": answer}])
+
+def prepare_context(request: QueryRequest) -> Tuple[List[Dict[str, Any]], MCPMessage]:
+    # Shared retrieval half of the query pipeline used by both /query and /query_stream.
     # --- Agent Orchestration Step 1: Retrieval ---
-    retrieved_sources = retrieval_agent.search(request.query)
-    
+    with span("search"):
+        retrieved_sources = retrieval_agent.search(
+            request.query,
+            vector_weight=request.vector_weight,
+            lexical_weight=request.lexical_weight,
+            tenant_id=tenant_of(request),
+            filters=search_filters(request)
+        )
+    return retrieved_sources, build_mcp_message(request, retrieved_sources, current_trace())
+
+def build_mcp_message(request: QueryRequest, retrieved_sources: List[Dict[str, Any]], trace: Trace) -> MCPMessage:
     # --- Agent Orchestration Step 2: MCP Construction ---
-    # Package the retrieved context into a formal MCP message for inter-agent communication.
+    # Fit the retrieved chunks into the selected model's token budget, then package the
+    # packed context into a formal MCP message for inter-agent communication.
+    with span("build_prompt", [trace]):
+        packed_context, context_stats = context_builder.build(request.model_name, retrieved_sources)
     mcp_payload = MCPPayload(
-        retrieved_context=retrieved_sources,
-        query=request.query
+        retrieved_context=packed_context,
+        query=request.query,
+        context_stats=context_stats
     )
-    mcp_message = MCPMessage(
+    return MCPMessage(
         sender="CoordinatorAgent",
         receiver="LLMResponseAgent",
+        trace_id=trace.trace_id,
         payload=mcp_payload
     )
 
+@app.post("/query", response_model=QueryResponse)
+async def handle_query(request: QueryRequest):
+    session_id, history = await run_in_threadpool(open_session, request)
+
+    # Serve repeated and near-duplicate questions straight from the answer cache.
+    with span("cache_lookup"):
+        cached = await run_in_threadpool(answer_cache.lookup, request.query, tenant_of(request), answer_cache_scope(request))
+    if cached is not None:
+        await run_in_threadpool(record_exchange, session_id, history, cached["answer"])
+        return QueryResponse(answer=cached["answer"], session_id=session_id, sources=cached["sources"],
+                             trace_id=current_trace().trace_id)
+
+    cache_generation = answer_cache.generation(tenant_of(request))
+    # Retrieval runs on a worker thread so concurrent queries can be coalesced into batches.
+    retrieved_sources, mcp_message = await run_in_threadpool(prepare_context, request)
+
     # --- Agent Orchestration Step 3: Generation ---
     try:
         # Pass the MCP data to the LLMResponseAgent to get the final answer.
-        final_answer = llm_response_agent.generate_response(
-            model_name=request.model_name,
-            context_chunks=mcp_message.payload.retrieved_context,
-            history=history,
-            query=mcp_message.payload.query
-        )
+        with span("generate"):
+            final_answer = await llm_response_agent.generate_response(
+                model_name=request.model_name,
+                context_chunks=mcp_message.payload.retrieved_context,
+                history=history,
+                query=mcp_message.payload.query
+            )
     # Gracefully handle API quota errors from external services.
-    except ResourceExhausted as e:
-        raise HTTPException(
-            status_code=429, 
-            detail="The daily API quota for the selected model has been exceeded. Please try again tomorrow or switch models."
-        )
+    except ProviderQuotaError:
+        raise HTTPException(status_code=429, detail=QUOTA_EXCEEDED_DETAIL)
+    except ProviderTimeoutError:
+        raise HTTPException(status_code=504, detail=TIMEOUT_DETAIL)
+    except ProviderNotConfiguredError:
+        raise HTTPException(status_code=503, detail=NOT_CONFIGURED_DETAIL)
+    except UnknownModelError:
+        raise HTTPException(status_code=400, detail=UNKNOWN_MODEL_DETAIL)
     # Handle any other unexpected errors during generation.
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {e}")
     
     # Update the chat history with the assistant's response.
-    history.append({"role": "assistant", "content": final_answer})
-    chat_histories[session_id] = history
+    count_tokens(request, mcp_message, final_answer)
+    await run_in_threadpool(record_exchange, session_id, history, final_answer)
+    await run_in_threadpool(answer_cache.store, request.query, tenant_of(request), answer_cache_scope(request), final_answer, retrieved_sources, cache_generation)
     
     # Return the final, structured response to the frontend.
     return QueryResponse(
         answer=final_answer, 
         session_id=session_id,
-        sources=retrieved_sources
-    )
\ No newline at end of file
+        sources=retrieved_sources,
+        context_stats=mcp_message.payload.context_stats,
+        trace_id=mcp_message.trace_id
+    )
+
+def format_sse(event: str, data: Dict[str, Any]) -> str:
+    # Encodes a single server-sent event.
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/query_stream")
+async def handle_query_stream(request: QueryRequest):
+    # Same pipeline as /query, but the answer is streamed as server-sent events:
+    # one "sources" event, then a "token" event per fragment, then "done" (or "error").
+    session_id, history = await run_in_threadpool(open_session, request)
+
+    with span("cache_lookup"):
+        cached = await run_in_threadpool(answer_cache.lookup, request.query, tenant_of(request), answer_cache_scope(request))
+    if cached is not None:
+        # A cached answer is sent as a single token event.
+        await run_in_threadpool(record_exchange, session_id, history, cached["answer"])
+        trace = current_trace()
+        events = [
+            format_sse("sources", {"session_id": session_id, "sources": cached["sources"], "trace_id": trace.trace_id}),
+            format_sse("token", {"text": cached["answer"]}),
+            format_sse("done", {"session_id": session_id, "trace_id": trace.trace_id, "timings_ms": trace.totals_ms()})
+        ]
+        return StreamingResponse(iter(events), media_type="text/event-stream")
+
+    cache_generation = answer_cache.generation(tenant_of(request))
+    # Retrieval runs on a worker thread so concurrent queries can be coalesced into batches.
+    retrieved_sources, mcp_message = await run_in_threadpool(prepare_context, request)
+    trace = current_trace()
+
+    async def event_stream() -> AsyncIterator[str]:
+        yield format_sse("sources", {
+            "session_id": session_id,
+            "sources": retrieved_sources,
+            "context_stats": mcp_message.payload.context_stats,
+            "trace_id": mcp_message.trace_id
+        })
+
+        answer_parts = []
+        try:
+            with span("generate", [trace]):
+                async for token in llm_response_agent.stream_response(
+                    model_name=request.model_name,
+                    context_chunks=mcp_message.payload.retrieved_context,
+                    history=history,
+                    query=mcp_message.payload.query
+                ):
+                    answer_parts.append(token)
+                    yield format_sse("token", {"text": token})
+        # Headers are already sent, so errors are reported in-band instead of as HTTP status codes.
+        except ProviderQuotaError:
+            yield format_sse("error", {"status_code": 429, "detail": QUOTA_EXCEEDED_DETAIL})
+            return
+        except ProviderTimeoutError:
+            yield format_sse("error", {"status_code": 504, "detail": TIMEOUT_DETAIL})
+            return
+        except ProviderNotConfiguredError:
+            yield format_sse("error", {"status_code": 503, "detail": NOT_CONFIGURED_DETAIL})
+            return
+        except UnknownModelError:
+            yield format_sse("error", {"status_code": 400, "detail": UNKNOWN_MODEL_DETAIL})
+            return
+        except Exception as e:
+            yield format_sse("error", {"status_code": 500, "detail": f"An unexpected error occurred: {e}"})
+            return
+
+        # Only record the exchange once the full answer has been produced.
+        final_answer = "".join(answer_parts)
+        count_tokens(request, mcp_message, final_answer)
+        await run_in_threadpool(record_exchange, session_id, history, final_answer)
+        await run_in_threadpool(answer_cache.store, request.query, tenant_of(request), answer_cache_scope(request), final_answer, retrieved_sources, cache_generation)
+        yield format_sse("done", {"session_id": session_id, "trace_id": trace.trace_id, "timings_ms": trace.totals_ms()})
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+def provider_error_status(error: Exception) -> Tuple[int, str]:
+    # The HTTP status code and message for an error raised while generating an answer.
+    if isinstance(error, ProviderQuotaError):
+        return 429, QUOTA_EXCEEDED_DETAIL
+    if isinstance(error, ProviderTimeoutError):
+        return 504, TIMEOUT_DETAIL
+    if isinstance(error, ProviderNotConfiguredError):
+        return 503, NOT_CONFIGURED_DETAIL
+    if isinstance(error, UnknownModelError):
+        return 400, UNKNOWN_MODEL_DETAIL
+    return 500, f"An unexpected error occurred: {error}"
+
+def batch_error(index: int, item: QueryRequest, error: Exception) -> Dict[str, Any]:
+    status_code, detail = provider_error_status(error)
+    return {"index": index, "query": item.query, "error": {"status_code": status_code, "detail": detail}}
+
+def retrieve_batch(block: List[Tuple[int, QueryRequest]], trace: Trace) -> List[Any]:
+    # Retrieval half of /query_batch for one block of questions. Returns, per question, either
+    # a finished result line (a cached answer, or an error) or (sources, MCP message, cache generation).
+    first = block[0][1]
+    # One forward pass embeds the whole block; the cache lookups and the search below
+    # then find these embeddings in the embedding cache.
+    with span("embed_query", [trace]):
+        retrieval_agent.embedder([item.query for _, item in block])
+    with span("cache_lookup", [trace]):
+        cached = [answer_cache.lookup(item.query, tenant_of(item), answer_cache_scope(item)) for _, item in block]
+    cache_generation = answer_cache.generation(tenant_of(first))
+    misses = [item for (_, item), hit in zip(block, cached) if hit is None]
+    with span("search", [trace]):
+        found = iter(retrieval_agent.search_batch(
+            [item.query for item in misses],
+            vector_weight=first.vector_weight,
+            lexical_weight=first.lexical_weight,
+            tenant_id=tenant_of(first),
+            filters=search_filters(first),
+            trace=trace
+        ))
+
+    prepared = []
+    for (index, item), hit in zip(block, cached):
+        if hit is not None:
+            prepared.append({"index": index, "query": item.query, "answer": hit["answer"], "sources": hit["sources"], "cached": True})
+            continue
+        sources = next(found)
+        prepared.append((sources, build_mcp_message(item, sources, trace), cache_generation))
+    return prepared
+
+@app.post("/query_batch")
+async def handle_query_batch(request: QueryBatchRequest):
+    # Answers many questions in one call. Results are streamed back as newline-delimited JSON
+    # in the order they complete: one line per question, tagged with its index and holding
+    # either the answer and sources or an error, then a final summary line. Questions are
+    # embedded and searched in blocks of BATCH_SEARCH_SIZE, and their answers are generated
+    # concurrently within each provider's concurrency limit. A question that fails (e.g. on
+    # an exhausted quota) only fails its own line.
+    if len(request.queries) > BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=413, detail=f"A batch can hold at most {BATCH_MAX_QUERIES} queries.")
+    settings = request.model_dump(exclude={"queries"})
+    items = [QueryRequest(query=query, **settings) for query in request.queries]
+    trace = current_trace()
+
+    async def answer(index: int, item: QueryRequest, sources: List[Dict[str, Any]], mcp_message: MCPMessage,
+                     cache_generation: Tuple[int, int]) -> Dict[str, Any]:
+        try:
+            with span("generate", [trace]):
+                final_answer = await llm_response_agent.generate_response(
+                    model_name=item.model_name,
+                    context_chunks=mcp_message.payload.retrieved_context,
+                    history=[],
+                    query=item.query
+                )
+        except Exception as e:
+            return batch_error(index, item, e)
+        count_tokens(item, mcp_message, final_answer)
+        await run_in_threadpool(answer_cache.store, item.query, tenant_of(item), answer_cache_scope(item), final_answer, sources, cache_generation)
+        return {"index": index, "query": item.query, "answer": final_answer, "sources": sources,
+                "context_stats": mcp_message.payload.context_stats, "cached": False}
+
+    async def batch_lines() -> AsyncIterator[str]:
+        results: asyncio.Queue = asyncio.Queue()
+        in_flight = asyncio.Semaphore(BATCH_MAX_IN_FLIGHT)
+        tasks = set()
+
+        async def finish(index: int, item: QueryRequest, prepared: Tuple[Any, ...]):
+            try:
+                await results.put(await answer(index, item, *prepared))
+            finally:
+                in_flight.release()
+
+        async def produce():
+            # Retrieval of the next block overlaps with generation for the previous ones.
+            # A block takes one in-flight slot per question, so it cannot be larger than the limit.
+            block_size = min(BATCH_SEARCH_SIZE, BATCH_MAX_IN_FLIGHT)
+            indexed = list(enumerate(items))
+            for start in range(0, len(indexed), block_size):
+                block = indexed[start:start + block_size]
+                for _ in block:
+                    await in_flight.acquire()
+                try:
+                    prepared = await run_in_threadpool(retrieve_batch, block, trace)
+                except Exception as e:
+                    # A failed search fails only the questions in its block.
+                    prepared = [batch_error(index, item, e) for index, item in block]
+                for (index, item), entry in zip(block, prepared):
+                    if isinstance(entry, dict):
+                        results.put_nowait(entry)
+                        in_flight.release()
+                        continue
+                    task = asyncio.create_task(finish(index, item, entry))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+
+        producer = asyncio.create_task(produce())
+        failed = 0
+        try:
+            for _ in items:
+                line = await results.get()
+                if "error" in line:
+                    failed += 1
+                yield json.dumps(line) + "\n"
+        finally:
+            # Stops the remaining work if the client disconnects before the batch is done.
+            producer.cancel()
+            for task in list(tasks):
+                task.cancel()
+        yield json.dumps({"done": True, "completed": len(items) - failed, "failed": failed,
+                          "trace_id": trace.trace_id, "timings_ms": trace.totals_ms()}) + "\n"
+
+    return StreamingResponse(batch_lines(), media_type="application/x-ndjson")
@@ -13,6 +13,10 @@ class MCPPayload(BaseModel):
     # The original user query that triggered the retrieval.
     query: str
 
+    # Bookkeeping from packing the context into the model's token budget
+    # (tokens in/out/saved, passages dropped, ...). Empty if no packing was done.
+    context_stats: Dict[str, int] = Field(default_factory=dict)
+
 # --- Main Message Structure ---
 # This class defines the "envelope" for all inter-agent communication,
 # ensuring every message has a consistent and predictable format.
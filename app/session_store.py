@@ -0,0 +1,259 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, List, Any
+
+# --- Session Store Interface ---
+# Chat histories are kept behind this small interface so the coordinator does not
+# care whether they live in process memory or in a database. A history is a list of
+# {"role": ..., "content": ...} messages, oldest first.
+class SessionStore:
+    def get_history(self, session_id: str) -> List[Dict[str, str]]:
+        raise NotImplementedError
+
+    def append(self, session_id: str, messages: List[Dict[str, str]]):
+        raise NotImplementedError
+
+    def clear(self, session_id: Optional[str] = None):
+        # Clears one session, or every session when no ID is given.
+        raise NotImplementedError
+
+    def stats(self, session_id: str) -> Optional[Dict[str, Any]]:
+        # Returns {"messages", "bytes", "last_access"} for a session, or None if it does not exist.
+        raise NotImplementedError
+
+    def summary(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
+
+def message_size(message: Dict[str, str]) -> int:
+    return len(message["role"].encode("utf-8")) + len(message["content"].encode("utf-8"))
+
+
+# Keeps histories in process memory with a cap on total bytes and on the number of
+# sessions. Sessions idle for longer than `ttl_seconds` expire, and when a cap is
+# exceeded the least recently used sessions are evicted first.
+class InMemorySessionStore(SessionStore):
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, max_sessions: int = 10000, ttl_seconds: float = 24 * 3600):
+        self.max_bytes = max_bytes
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._sessions: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get_history(self, session_id: str) -> List[Dict[str, str]]:
+        with self._lock:
+            self._expire(time.time())
+            session = self._touch(session_id)
+            return list(session["messages"]) if session else []
+
+    def append(self, session_id: str, messages: List[Dict[str, str]]):
+        with self._lock:
+            now = time.time()
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = {"messages": [], "bytes": 0, "last_access": now}
+            added = sum(message_size(message) for message in messages)
+            session["messages"].extend(messages)
+            session["bytes"] += added
+            self._total_bytes += added
+            self._touch(session_id)
+            self._expire(now)
+            self._evict_over_capacity(keep=session_id)
+
+    def clear(self, session_id: Optional[str] = None):
+        with self._lock:
+            if session_id is None:
+                self._sessions.clear()
+                self._total_bytes = 0
+            else:
+                self._drop(session_id)
+
+    def stats(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            return {"messages": len(session["messages"]), "bytes": session["bytes"], "last_access": session["last_access"]}
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"backend": "memory", "sessions": len(self._sessions), "bytes": self._total_bytes, "evictions": self.evictions}
+
+    def _touch(self, session_id: str) -> Optional[Dict[str, Any]]:
+        session = self._sessions.get(session_id)
+        if session is not None:
+            session["last_access"] = time.time()
+            self._sessions.move_to_end(session_id)
+        return session
+
+    def _drop(self, session_id: str):
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            self._total_bytes -= session["bytes"]
+
+    def _expire(self, now: float):
+        # Sessions are ordered by last access, so expired ones are always at the front.
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if now - session["last_access"] < self.ttl_seconds:
+                break
+            self._drop(session_id)
+            self.evictions += 1
+
+    def _evict_over_capacity(self, keep: str):
+        # The session being written is never evicted; a single oversized session is trimmed instead.
+        while (len(self._sessions) > self.max_sessions or self._total_bytes > self.max_bytes) and len(self._sessions) > 1:
+            oldest = next(iter(self._sessions))
+            if oldest == keep:
+                break
+            self._drop(oldest)
+            self.evictions += 1
+        session = self._sessions.get(keep)
+        while session and self._total_bytes > self.max_bytes and len(session["messages"]) > 1:
+            removed = message_size(session["messages"].pop(0))
+            session["bytes"] -= removed
+            self._total_bytes -= removed
+
+
+# Keeps histories in a SQLite file so they survive restarts and can be shared by
+# several worker processes. The limits are the same as InMemorySessionStore's: idle
+# sessions expire after `ttl_seconds`, and the least recently used sessions are evicted
+# beyond `max_sessions` or `max_bytes`, after which a single oversized session is trimmed.
+class SQLiteSessionStore(SessionStore):
+    def __init__(self, path: str, max_bytes: int = 64 * 1024 * 1024, max_sessions: int = 100000,
+                 ttl_seconds: float = 7 * 24 * 3600):
+        self.max_bytes = max_bytes
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        # Sessions evicted by this process since it started.
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript("""
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, last_access REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                bytes INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS messages_by_session ON messages (session_id, id);
+            CREATE INDEX IF NOT EXISTS sessions_by_access ON sessions (last_access);
+        """)
+        self._db.commit()
+
+    def get_history(self, session_id: str) -> List[Dict[str, str]]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT role, content FROM messages WHERE session_id = ? ORDER BY id", (session_id,)
+            ).fetchall()
+            if rows:
+                self._db.execute("UPDATE sessions SET last_access = ? WHERE session_id = ?", (time.time(), session_id))
+                self._db.commit()
+            return [{"role": role, "content": content} for role, content in rows]
+
+    def append(self, session_id: str, messages: List[Dict[str, str]]):
+        with self._lock:
+            now = time.time()
+            self._db.execute(
+                "INSERT INTO sessions (session_id, last_access) VALUES (?, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET last_access = excluded.last_access",
+                (session_id, now)
+            )
+            self._db.executemany(
+                "INSERT INTO messages (session_id, role, content, bytes) VALUES (?, ?, ?, ?)",
+                [(session_id, m["role"], m["content"], message_size(m)) for m in messages]
+            )
+            self._evict(now, keep=session_id)
+            self._db.commit()
+
+    def clear(self, session_id: Optional[str] = None):
+        with self._lock:
+            if session_id is None:
+                self._db.execute("DELETE FROM messages")
+                self._db.execute("DELETE FROM sessions")
+            else:
+                self._db.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+                self._db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            self._db.commit()
+
+    def stats(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT s.last_access, COUNT(m.id), COALESCE(SUM(m.bytes), 0) FROM sessions s "
+                "LEFT JOIN messages m ON m.session_id = s.session_id WHERE s.session_id = ? GROUP BY s.session_id",
+                (session_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"messages": row[1], "bytes": row[2], "last_access": row[0]}
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            sessions = self._db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+            total_bytes = self._db.execute("SELECT COALESCE(SUM(bytes), 0) FROM messages").fetchone()[0]
+        return {"backend": "sqlite", "sessions": sessions, "bytes": total_bytes, "evictions": self.evictions}
+
+    def _evict(self, now: float, keep: str):
+        # Expired sessions first, then the least recently used ones beyond the session cap.
+        evicted = self._db.execute(
+            "SELECT session_id FROM sessions WHERE last_access < ? UNION "
+            "SELECT session_id FROM (SELECT session_id FROM sessions ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+            (now - self.ttl_seconds, self.max_sessions)
+        ).fetchall()
+        self._drop(evicted)
+
+        # Then, over the byte cap, the least recently used ones other than the session being
+        # written, which is trimmed from its oldest message instead if it is still too large.
+        total_bytes = self._db.execute("SELECT COALESCE(SUM(bytes), 0) FROM messages").fetchone()[0]
+        if total_bytes <= self.max_bytes:
+            return
+        evicted = []
+        for session_id, session_bytes in self._db.execute(
+            "SELECT s.session_id, COALESCE(SUM(m.bytes), 0) FROM sessions s LEFT JOIN messages m ON m.session_id = s.session_id "
+            "WHERE s.session_id != ? GROUP BY s.session_id ORDER BY s.last_access", (keep,)
+        ).fetchall():
+            if total_bytes <= self.max_bytes:
+                break
+            evicted.append((session_id,))
+            total_bytes -= session_bytes
+        self._drop(evicted)
+        trimmed = []
+        messages = self._db.execute("SELECT id, bytes FROM messages WHERE session_id = ? ORDER BY id", (keep,)).fetchall()
+        for message_id, message_bytes in messages[:-1]:
+            if total_bytes <= self.max_bytes:
+                break
+            trimmed.append((message_id,))
+            total_bytes -= message_bytes
+        self._db.executemany("DELETE FROM messages WHERE id = ?", trimmed)
+
+    def _drop(self, evicted: List[Any]):
+        self._db.executemany("DELETE FROM messages WHERE session_id = ?", evicted)
+        self._db.executemany("DELETE FROM sessions WHERE session_id = ?", evicted)
+        self.evictions += len(evicted)
+
+
+def create_session_store() -> SessionStore:
+    # Selects the backend from the environment: SESSION_STORE=memory (default) or sqlite.
+    ttl_seconds = float(os.environ.get("SESSION_TTL_SECONDS", str(24 * 3600)))
+    max_sessions = int(os.environ.get("SESSION_MAX_COUNT", "10000"))
+    max_bytes = int(float(os.environ.get("SESSION_MAX_MB", "64")) * 1024 * 1024)
+    if os.environ.get("SESSION_STORE", "memory") == "sqlite":
+        return SQLiteSessionStore(
+            path=os.environ.get("SESSION_DB_PATH", "sessions.sqlite"),
+            max_bytes=max_bytes,
+            max_sessions=max_sessions,
+            ttl_seconds=ttl_seconds
+        )
+    return InMemorySessionStore(
+        max_bytes=max_bytes,
+        max_sessions=max_sessions,
+        ttl_seconds=ttl_seconds
+    )
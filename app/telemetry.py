@@ -0,0 +1,202 @@
+import contextvars
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Tuple, Callable, Iterable, Iterator
+
+# --- Metrics ---
+# A small in-process registry rendered in the Prometheus text exposition format, so
+# /metrics can be scraped without running a separate exporter.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    escaped = (key + '="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"' for key, value in labels)
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._values: Dict[Tuple[Tuple[str, str], ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # labels -> ([count per bucket], sum, count)
+        self._series: Dict[Tuple[Tuple[str, str], ...], List[Any]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, (bucket_counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, bucket_counts):
+                    cumulative += bucket_count
+                    bucket_labels = labels + (("le", _format_value(bound)),)
+                    lines.append(f"{self.name}_bucket{_format_labels(bucket_labels)} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+                lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+# A collector returns (name, type, help, [(labels, value), ...]) tuples computed at scrape
+# time, for values that are already counted elsewhere (such as the cache statistics).
+Collector = Callable[[], List[Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]]]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[Any] = []
+        self._collectors: List[Collector] = []
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        metric = Counter(name, help_text)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, help_text, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Collector):
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            for name, metric_type, help_text, samples in collector():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(tuple(sorted(labels.items())))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram("docubot_stage_seconds", "Time spent in each pipeline stage.")
+REQUEST_SECONDS = REGISTRY.histogram("docubot_request_seconds", "End-to-end HTTP request latency.")
+LLM_REQUESTS = REGISTRY.counter("docubot_llm_requests_total", "LLM provider calls by outcome (success, quota, timeout, error).")
+LLM_TOKENS = REGISTRY.counter("docubot_llm_tokens_total", "Estimated tokens sent to (prompt) and received from (completion) each model.")
+CONTEXT_TOKENS_SAVED = REGISTRY.counter("docubot_context_tokens_saved_total", "Estimated tokens removed by merging overlapping chunks and dropping near-duplicates.")
+CONTEXT_TOKENS_TRUNCATED = REGISTRY.counter("docubot_context_tokens_truncated_total", "Estimated retrieved tokens cut off to fit the model's context budget.")
+
+
+# --- Tracing ---
+# A trace collects the spans of one request (or one ingestion job) under its MCP trace_id.
+# The trace being recorded is held in a context variable, so code deep in the agents can
+# add spans without the trace being passed down explicitly; FastAPI's threadpool copies
+# the context into its worker threads.
+class Trace:
+    def __init__(self, trace_id: str):
+        self.trace_id = trace_id
+        self.spans: List[Tuple[str, float]] = []
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float):
+        with self._lock:
+            self.spans.append((name, seconds))
+
+    def totals_ms(self) -> Dict[str, float]:
+        # Total milliseconds per stage, in the order the stages first ran.
+        totals: Dict[str, float] = {}
+        with self._lock:
+            for name, seconds in self.spans:
+                totals[name] = totals.get(name, 0.0) + seconds * 1000
+        return {name: round(ms, 3) for name, ms in totals.items()}
+
+    def server_timing(self) -> str:
+        # Value for the standard Server-Timing response header, e.g. "embed;dur=3.1, search;dur=12.0".
+        return ", ".join(f"{name};dur={ms}" for name, ms in self.totals_ms().items())
+
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("current_trace", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def activate(trace: Trace) -> Iterator[Trace]:
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+def record(name: str, seconds: float, traces: Optional[Iterable[Optional[Trace]]] = None):
+    # Observes a stage duration and adds it to the given traces (default: the current one).
+    # A trace listed more than once (batch items of one request share it) gets the span once.
+    STAGE_SECONDS.observe(seconds, stage=name)
+    for trace in set(traces if traces is not None else [current_trace()]):
+        if trace is not None:
+            trace.add(name, seconds)
+
+
+@contextmanager
+def span(name: str, traces: Optional[Iterable[Optional[Trace]]] = None) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start, traces)
+
+
+def timed(items: Iterable[Any], timings: Dict[str, float], name: str) -> Iterator[Any]:
+    # Passes a stream through, adding the time spent producing each item to timings[name].
+    # Used where stages are interleaved generators (parse feeds split feeds embed).
+    iterator = iter(items)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+            return
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+        yield item
@@ -0,0 +1,131 @@
+# Parity check and throughput comparison of the embedding backends: sentence-transformers
+# on torch, and the ONNX export of the same model (float32 and int8) on ONNX Runtime.
+#
+# Parity: every text is embedded by each backend and compared with the torch vector by
+# cosine similarity; retrieval agreement is the overlap of each query's top-k documents.
+# The script exits with status 1 if any cosine falls below --min-cosine, so it can gate
+# a newly exported model before EMBEDDING_BACKEND=onnx is switched on.
+#
+# Throughput: texts per second for short queries and for chunk-sized passages, at each
+# batch size and thread count, plus the time to load each backend.
+#
+# Usage (from the project root, after `python -m app.agents.onnx_export --output onnx_model`):
+#   python -m benchmarks.embedding_backends --onnx-dir onnx_model --threads 1,4 --batch-sizes 8,32
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from typing import List, Dict, Any, Callable
+
+import numpy as np
+
+from app.agents.embedding_backends import LazySentenceTransformerEmbeddingFunction, OnnxEmbeddingFunction
+from app.agents.retrieval_agent import EMBEDDING_MODEL_NAME
+from benchmarks.query_batching import WORDS
+
+
+def make_texts(count: int, words: int, seed: int) -> List[str]:
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(WORDS) for _ in range(rng.randint(words // 2, words))).capitalize() + "."
+            for _ in range(count)]
+
+
+def as_matrix(vectors: List[np.ndarray]) -> np.ndarray:
+    matrix = np.asarray(vectors, dtype=np.float32)
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+
+def parity(reference: np.ndarray, candidate: np.ndarray) -> Dict[str, float]:
+    cosines = np.sum(reference * candidate, axis=1)
+    return {"min_cosine": float(cosines.min()), "mean_cosine": float(cosines.mean()), "p01_cosine": float(np.quantile(cosines, 0.01))}
+
+
+def top_k_overlap(reference: Dict[str, np.ndarray], candidate: Dict[str, np.ndarray], k: int) -> float:
+    # Fraction of each query's top-k passages (by the reference vectors) that the candidate also ranks in its top k.
+    expected = np.argsort(-(reference["queries"] @ reference["passages"].T), axis=1)[:, :k]
+    found = np.argsort(-(candidate["queries"] @ candidate["passages"].T), axis=1)[:, :k]
+    return float(np.mean([len(set(a) & set(b)) / k for a, b in zip(expected, found)]))
+
+
+def throughput(encode: Callable[[List[str]], Any], texts: List[str], repeats: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeats):
+        encode(texts)
+    return len(texts) * repeats / (time.perf_counter() - start)
+
+
+def torch_backend(batch_size: int, threads: int) -> Callable[[List[str]], Any]:
+    import torch
+    if threads:
+        torch.set_num_threads(threads)
+    model = LazySentenceTransformerEmbeddingFunction(model_name=EMBEDDING_MODEL_NAME)._model
+    return lambda texts: model.encode(texts, batch_size=batch_size, convert_to_numpy=True)
+
+
+def onnx_backend(onnx_dir: str, model_file: str, batch_size: int, threads: int) -> Callable[[List[str]], Any]:
+    function = OnnxEmbeddingFunction(EMBEDDING_MODEL_NAME, onnx_dir, model_file=model_file, threads=threads, batch_size=batch_size)
+    function.load()
+    return function
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the torch and ONNX embedding backends for parity and speed.")
+    parser.add_argument("--onnx-dir", default="onnx_model")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--passages", type=int, default=1000)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--threads", default="1", help="Comma-separated thread counts (0 lets the runtime decide).")
+    parser.add_argument("--batch-sizes", default="32", help="Comma-separated batch sizes.")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--min-cosine", type=float, default=0.95)
+    parser.add_argument("--skip-torch", action="store_true", help="Only time the ONNX models (no parity check).")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    texts = {
+        "queries": make_texts(args.queries, 12, args.seed),
+        # Roughly one ingestion chunk (about 1000 characters) each.
+        "passages": make_texts(args.passages, 160, args.seed + 1)
+    }
+    backends = {} if args.skip_torch else {"torch": lambda b, t: torch_backend(b, t)}
+    for model_file in ("model.onnx", "model_int8.onnx"):
+        if os.path.exists(os.path.join(args.onnx_dir, model_file)):
+            backends[f"onnx:{model_file}"] = lambda b, t, model_file=model_file: onnx_backend(args.onnx_dir, model_file, b, t)
+
+    thread_counts = [int(value) for value in args.threads.split(",")]
+    batch_sizes = [int(value) for value in args.batch_sizes.split(",")]
+    report: Dict[str, Any] = {"settings": vars(args), "backends": {}}
+    vectors: Dict[str, Dict[str, np.ndarray]] = {}
+    for name, build in backends.items():
+        start = time.perf_counter()
+        encode = build(batch_sizes[0], thread_counts[0])
+        encode(["warmup"])
+        result: Dict[str, Any] = {"load_seconds": time.perf_counter() - start, "texts_per_second": {}}
+        vectors[name] = {kind: as_matrix(list(encode(items))) for kind, items in texts.items()}
+        for threads in thread_counts:
+            for batch_size in batch_sizes:
+                encode = build(batch_size, threads)
+                for kind, items in texts.items():
+                    result["texts_per_second"][f"{kind}/threads={threads}/batch={batch_size}"] = throughput(encode, items, args.repeats)
+        report["backends"][name] = result
+
+    failed = False
+    if "torch" in vectors:
+        for name in vectors:
+            if name == "torch":
+                continue
+            stats = {kind: parity(vectors["torch"][kind], vectors[name][kind]) for kind in texts}
+            stats[f"top_{args.top_k}_overlap"] = top_k_overlap(vectors["torch"], vectors[name], args.top_k)
+            report["backends"][name]["parity_with_torch"] = stats
+            failed = failed or any(stats[kind]["min_cosine"] < args.min_cosine for kind in texts)
+
+    print(json.dumps(report, indent=2))
+    if failed:
+        print(f"Parity check failed: a cosine similarity with the torch backend is below {args.min_cosine}.", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+# End-to-end offline benchmark of the ingestion and query pipeline.
+#
+# Synthetic PDF, DOCX, PPTX, CSV and TXT files are generated at a configurable size and
+# uploaded through /upload, then /query is driven at a configurable concurrency. Both run
+# in-process through FastAPI's test client against a throwaway store, and every query
+# goes to the deterministic "stub" model, so no network access or API quota is needed.
+#
+# Reported: ingest throughput (chunks/s, per file type and overall), query latency
+# percentiles and throughput, the throughput of the same number of queries sent as one
+# /query_batch request, and peak RSS of the server process and of its largest
+# parser worker (workers are spawned, so theirs covers only the parsing libraries).
+# The report is printed and written as JSON so runs can be compared over time.
+#
+# Usage (from the project root):
+#   python -m benchmarks.pipeline --files-per-type 4 --units 200 --queries 500 --concurrency 16
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Tuple
+
+import docx
+import pandas as pd
+from pptx import Presentation
+from pptx.util import Inches
+
+from benchmarks.query_batching import WORDS, percentile
+
+FILE_TYPES = ("pdf", "docx", "pptx", "csv", "txt")
+
+
+# --- Synthetic Corpus ---
+def sentence(rng: random.Random, words: int = 14) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + f" ref PN-{rng.randint(1000, 9999)}."
+
+
+def paragraph(rng: random.Random, sentences: int = 5) -> str:
+    return " ".join(sentence(rng) for _ in range(sentences))
+
+
+def make_pdf(rng: random.Random, pages: int) -> bytes:
+    # A minimal text-only PDF (one Helvetica text object per page), written by hand so the
+    # benchmark needs no PDF authoring library. pypdf extracts it like any other PDF.
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for _ in range(pages):
+        lines = [sentence(rng) for _ in range(30)]
+        text = " ".join(f"({line.replace('(', '').replace(')', '')}) '" for line in lines)
+        stream = f"BT /F1 9 Tf 12 TL 40 780 Td {text} ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        page_ids.append(len(objects))
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(f'{i} 0 R' for i in page_ids)}] /Count {pages} >>"
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1"))
+    xref = out.tell()
+    out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1"))
+    for offset in offsets:
+        out.write(f"{offset:010d} 00000 n \n".encode("latin-1"))
+    out.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1"))
+    return out.getvalue()
+
+
+def make_docx(rng: random.Random, paragraphs: int) -> bytes:
+    document = docx.Document()
+    for _ in range(paragraphs):
+        document.add_paragraph(paragraph(rng))
+    out = io.BytesIO()
+    document.save(out)
+    return out.getvalue()
+
+
+def make_pptx(rng: random.Random, slides: int) -> bytes:
+    pres = Presentation()
+    for _ in range(slides):
+        slide = pres.slides.add_slide(pres.slide_layouts[6])
+        box = slide.shapes.add_textbox(Inches(0.5), Inches(0.5), Inches(9), Inches(6))
+        box.text_frame.text = paragraph(rng, sentences=4)
+    out = io.BytesIO()
+    pres.save(out)
+    return out.getvalue()
+
+
+def make_csv(rng: random.Random, rows: int) -> bytes:
+    frame = pd.DataFrame({
+        "order_id": [f"AB-{rng.randint(10000, 99999)}" for _ in range(rows)],
+        "customer": [rng.choice(WORDS) for _ in range(rows)],
+        "amount": [round(rng.uniform(5, 500), 2) for _ in range(rows)],
+        "note": [sentence(rng, words=8) for _ in range(rows)]
+    })
+    return frame.to_csv(index=False).encode("utf-8")
+
+
+def make_txt(rng: random.Random, paragraphs: int) -> bytes:
+    return "\n\n".join(paragraph(rng) for _ in range(paragraphs)).encode("utf-8")
+
+
+GENERATORS = {"pdf": make_pdf, "docx": make_docx, "pptx": make_pptx, "csv": make_csv, "txt": make_txt}
+CONTENT_TYPES = {
+    "pdf": "application/pdf",
+    "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "pptx": "application/vnd.openxmlformats-officedocument.presentationml.presentation",
+    "csv": "text/csv",
+    "txt": "text/plain"
+}
+
+
+def make_corpus(files_per_type: int, units: int, seed: int) -> Dict[str, List[Tuple[str, bytes]]]:
+    # `units` is pages per PDF, paragraphs per DOCX/TXT, slides per PPTX and rows per CSV
+    # (CSV rows are short, so CSVs get ten times as many).
+    rng = random.Random(seed)
+    corpus = {}
+    for file_type in FILE_TYPES:
+        count = units * 10 if file_type == "csv" else units
+        corpus[file_type] = [
+            (f"bench-{i}.{file_type}", GENERATORS[file_type](rng, count))
+            for i in range(files_per_type)
+        ]
+    return corpus
+
+
+# --- Measurements ---
+def peak_rss_mb(who: int) -> float:
+    # ru_maxrss is reported in kilobytes on Linux and in bytes on macOS.
+    peak = resource.getrusage(who).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def wait_for_job(client, job_id: str) -> Dict[str, Any]:
+    while True:
+        job = client.get(f"/jobs/{job_id}").json()
+        if job["status"] in ("completed", "failed"):
+            return job
+        time.sleep(0.05)
+
+
+def bench_ingest(client, corpus: Dict[str, List[Tuple[str, bytes]]]) -> Dict[str, Any]:
+    # Each file type is uploaded as one job, so throughput can be compared across parsers.
+    results, total_chunks, total_seconds = {}, 0, 0.0
+    for file_type, files in corpus.items():
+        payload = [("files", (name, data, CONTENT_TYPES[file_type])) for name, data in files]
+        start = time.perf_counter()
+        response = client.post("/upload", files=payload)
+        response.raise_for_status()
+        job = wait_for_job(client, response.json()["job_id"])
+        elapsed = time.perf_counter() - start
+        if job["status"] != "completed":
+            raise RuntimeError(f"Ingesting {file_type} files failed: {job['error']}")
+
+        results[file_type] = {
+            "files": len(files),
+            "bytes": sum(len(data) for _, data in files),
+            "chunks": job["chunks_indexed"],
+            "chunks_before_packing": job.get("chunks_before_packing", job["chunks_indexed"]),
+            "chunks_deduplicated": job.get("chunks_deduplicated", 0),
+            "seconds": elapsed,
+            "chunks_per_second": job["chunks_indexed"] / elapsed
+        }
+        total_chunks += job["chunks_indexed"]
+        total_seconds += elapsed
+
+    results["total"] = {"chunks": total_chunks, "seconds": total_seconds, "chunks_per_second": total_chunks / total_seconds}
+    return results
+
+
+def bench_queries(client, queries: List[str], concurrency: int) -> Dict[str, Any]:
+    latencies, errors = [], 0
+
+    def one(query: str):
+        nonlocal errors
+        start = time.perf_counter()
+        response = client.post("/query", json={"query": query, "model_name": "stub"})
+        latencies.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            errors += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, queries))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "queries": len(queries),
+        "concurrency": concurrency,
+        "errors": errors,
+        "throughput_qps": len(queries) / elapsed,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "max_ms": latencies[-1] * 1000
+    }
+
+
+def bench_query_batch(client, queries: List[str]) -> Dict[str, Any]:
+    # The same kind of workload sent as a single /query_batch request. (The test client
+    # buffers streamed responses, so only the total time is meaningful here.)
+    start = time.perf_counter()
+    response = client.post("/query_batch", json={"queries": queries, "model_name": "stub"})
+    elapsed = time.perf_counter() - start
+    response.raise_for_status()
+    summary = json.loads(response.text.splitlines()[-1])
+    return {
+        "queries": len(queries),
+        "errors": summary["failed"],
+        "throughput_qps": len(queries) / elapsed,
+        "total_ms": elapsed * 1000
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ingestion throughput and query latency end to end.")
+    parser.add_argument("--files-per-type", type=int, default=2)
+    parser.add_argument("--units", type=int, default=50, help="Pages, paragraphs or slides per file (rows per CSV are 10x).")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--llm-delay-ms", type=float, default=0.0, help="Simulated latency of the stub model.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Where to write the JSON report (default: benchmarks/results/).")
+    args = parser.parse_args()
+
+    # The app reads its configuration at import time, so it is set up before importing it:
+    # a throwaway store, the stub model enabled, and enough stub concurrency that the model
+    # is never the bottleneck.
+    os.environ["CHROMA_PERSIST_DIR"] = tempfile.mkdtemp(prefix="docubot-bench-")
+    os.environ["SESSION_STORE"] = "memory"
+    os.environ["LLM_ENABLE_STUB"] = "1"
+    os.environ.setdefault("STUB_MAX_CONCURRENCY", str(max(args.concurrency, 8)))
+
+    from fastapi.testclient import TestClient
+    from app import main as app_main
+
+    app_main.llm_response_agent.providers["stub"].delay = args.llm_delay_ms / 1000
+
+    corpus = make_corpus(args.files_per_type, args.units, args.seed)
+    # Every query is distinct, so the answer cache cannot short-circuit the pipeline.
+    rng = random.Random(args.seed + 1)
+    queries = [" ".join(rng.choice(WORDS) for _ in range(6)) + f" PN-{1000 + i}" for i in range(args.queries)]
+    batch_queries = [" ".join(rng.choice(WORDS) for _ in range(6)) + f" PN-{5000 + i}" for i in range(args.queries)]
+
+    with TestClient(app_main.app) as client:
+        ingest = bench_ingest(client, corpus)
+        query = bench_queries(client, queries, args.concurrency)
+        query_batch = bench_query_batch(client, batch_queries)
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": vars(args),
+        "ingest": ingest,
+        "query": query,
+        "query_batch": query_batch,
+        "peak_rss_mb": {
+            "server": peak_rss_mb(resource.RUSAGE_SELF),
+            "largest_parser_worker": peak_rss_mb(resource.RUSAGE_CHILDREN)
+        }
+    }
+
+    output = args.output or os.path.join("benchmarks", "results", f"pipeline-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    print(f"Report written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+# Compares the micro-batched query path in RetrievalAgent against the per-request path.
+#
+# A synthetic corpus is indexed into a throwaway store, then a pool of threads issues
+# vector searches concurrently, first with the QueryBatcher disabled and then enabled.
+# Throughput and latency percentiles are printed for both runs.
+#
+# Usage (from the project root):
+#   python -m benchmarks.query_batching --chunks 5000 --concurrency 32 --queries 2000
+import argparse
+import json
+import random
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.agents.retrieval_agent import RetrievalAgent, DEFAULT_TENANT
+from app.agents.query_batcher import QueryBatcher
+
+WORDS = ("invoice shipment warranty battery sensor firmware contract payment "
+         "delivery module voltage report policy customer refund network").split()
+
+
+def make_chunks(count: int):
+    rng = random.Random(0)
+    return [
+        {
+            "id": f"bench-{i}",
+            "content": " ".join(rng.choice(WORDS) for _ in range(60)) + f" item PN-{i}",
+            "metadata": {"source": "bench.txt", "row": i}
+        }
+        for i in range(count)
+    ]
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run(agent: RetrievalAgent, queries, concurrency: int, top_k: int):
+    latencies = []
+    namespace = agent._namespace(DEFAULT_TENANT)
+
+    def one(query):
+        start = time.perf_counter()
+        agent._vector_search(namespace, query, top_k, None)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, queries))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "queries": len(queries),
+        "throughput_qps": len(queries) / elapsed,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark micro-batched vs per-request query embedding.")
+    parser.add_argument("--chunks", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--top-k", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--wait-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    agent = RetrievalAgent(persist_dir=tempfile.mkdtemp(prefix="docubot-bench-"))
+    chunks = make_chunks(args.chunks)
+    for start in range(0, len(chunks), 256):
+        agent.add_documents(chunks[start:start + 256])
+
+    # Unique queries, so the embedding cache cannot hide the cost of encoding.
+    rng = random.Random(1)
+    queries = [" ".join(rng.choice(WORDS) for _ in range(8)) + f" #{i}" for i in range(args.queries)]
+    half = len(queries) // 2
+
+    agent.query_batcher = None
+    per_request = run(agent, queries[:half], args.concurrency, args.top_k)
+
+    agent.query_batcher = QueryBatcher(agent._vector_search_batch, max_batch_size=args.batch_size, max_wait_ms=args.wait_ms)
+    batched = run(agent, queries[half:], args.concurrency, args.top_k)
+    batched["batcher"] = agent.query_batcher.stats()
+
+    print(json.dumps({"per_request": per_request, "batched": batched}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
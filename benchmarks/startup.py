@@ -0,0 +1,135 @@
+# Measures how quickly a freshly started server can take traffic.
+#
+# Each run starts `uvicorn app.main:app` in a new process against a throwaway store and
+# records, from the moment the process is launched:
+#   - import_seconds: how long `import app.main` takes on its own (a separate process),
+#   - listening_seconds: until the server answers HTTP at all (GET /healthz),
+#   - ready_seconds: until GET /readyz returns 200 (for a tree without /readyz, this is the
+#     same as listening, since such a server does all of its loading before it listens),
+#   - first_query_ms: latency of the first /query (offline "stub" model) once ready.
+#
+# `--tree` points at another checkout, so two revisions can be compared, e.g.:
+#   git worktree add /tmp/docubot-before <revision>
+#   python -m benchmarks.startup --tree /tmp/docubot-before --dummy-keys
+#   python -m benchmarks.startup
+#
+# Usage (from the project root):
+#   python -m benchmarks.startup --runs 5
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from typing import Dict, Any, Optional, Tuple
+
+from benchmarks.query_batching import percentile
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def http(method: str, url: str, body: Optional[Dict[str, Any]] = None) -> Tuple[int, bytes]:
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    request = urllib.request.Request(url, data=data, method=method, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request, timeout=60) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+
+def wait_until(check, process: subprocess.Popen, timeout: float) -> float:
+    # Polls `check` until it returns True and returns the time that took.
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        if process.poll() is not None:
+            raise RuntimeError(f"The server exited during startup with code {process.returncode}.")
+        try:
+            if check():
+                return time.perf_counter() - start
+        except OSError:
+            pass
+        time.sleep(0.01)
+    raise TimeoutError(f"The server was not up within {timeout} seconds.")
+
+
+def measure_import(tree: str, env: Dict[str, str]) -> float:
+    code = "import time; start = time.perf_counter(); import app.main; print(time.perf_counter() - start)"
+    result = subprocess.run([sys.executable, "-c", code], cwd=tree, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing app.main failed:\n{result.stderr}")
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def measure_start(tree: str, env: Dict[str, str], timeout: float) -> Dict[str, Any]:
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=tree, env=env
+    )
+    try:
+        # Any HTTP answer (even a 404 from a tree without /healthz) means the server is listening.
+        wait_until(lambda: http("GET", base + "/healthz")[0] > 0, process, timeout)
+        listening = time.perf_counter() - start
+        readyz_status = http("GET", base + "/readyz")[0]
+        if readyz_status != 404:
+            wait_until(lambda: http("GET", base + "/readyz")[0] == 200, process, timeout)
+        ready = time.perf_counter() - start
+
+        query_start = time.perf_counter()
+        status, _ = http("POST", base + "/query", {"query": "What does the warranty cover?", "model_name": "stub"})
+        first_query = time.perf_counter() - query_start
+        if status != 200:
+            raise RuntimeError(f"The first query failed with status {status}.")
+        return {
+            "listening_seconds": listening,
+            "ready_seconds": ready,
+            "first_query_ms": first_query * 1000,
+            "has_readiness_probe": readyz_status != 404
+        }
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure server startup time and time to readiness.")
+    parser.add_argument("--tree", default=".", help="Checkout to start the server from (default: the current one).")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--dummy-keys", action="store_true",
+                        help="Set placeholder API keys for the hosted models (never called), for revisions that require them.")
+    args = parser.parse_args()
+
+    runs = []
+    for _ in range(args.runs):
+        store = tempfile.mkdtemp(prefix="docubot-startup-")
+        env = {**os.environ, "CHROMA_PERSIST_DIR": store, "SESSION_STORE": "memory", "LLM_ENABLE_STUB": "1"}
+        if args.dummy_keys:
+            for variable in ("GOOGLE_API_KEY", "GROQ_API_KEY", "HUGGINGFACE_API_KEY"):
+                env.setdefault(variable, "unused")
+        try:
+            runs.append({"import_seconds": measure_import(args.tree, env), **measure_start(args.tree, env, args.timeout)})
+        finally:
+            shutil.rmtree(store, ignore_errors=True)
+
+    summary = {}
+    for key in ("import_seconds", "listening_seconds", "ready_seconds", "first_query_ms"):
+        values = sorted(run[key] for run in runs)
+        summary[key] = {"p50": percentile(values, 0.50), "max": values[-1]}
+    print(json.dumps({"tree": os.path.abspath(args.tree), "settings": vars(args), "summary": summary, "runs": runs}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
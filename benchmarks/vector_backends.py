@@ -0,0 +1,145 @@
+# Compares the vector stores behind RetrievalAgent: ChromaDB and the memory-mapped NumPy
+# store at float32, float16 and int8 precision.
+#
+# A synthetic, clustered set of unit vectors is indexed into each store. Each store is
+# then reopened from disk in a fresh process, which is how a restarted server sees it,
+# and queried. Reported per store: build time, reopen time, peak RSS of the serving
+# process, size on disk, query latency, and recall@k against exact float32 search.
+#
+# Usage (from the project root):
+#   python -m benchmarks.vector_backends --vectors 100000 --dim 384 --queries 200
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from typing import Dict, Any, List
+
+import numpy as np
+
+from benchmarks.query_batching import percentile
+
+BACKENDS = ("chroma", "memmap-float32", "memmap-float16", "memmap-int8")
+COLLECTION = "document_collection"
+
+
+def make_vectors(count: int, dim: int, seed: int) -> np.ndarray:
+    # Clustered data, closer to real sentence embeddings than uniform noise.
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(count // 500, 1), dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, len(centers), size=count)] + 0.5 * rng.normal(size=(count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def open_store(backend: str, path: str, create: bool):
+    if backend == "chroma":
+        import chromadb
+        client = chromadb.PersistentClient(path=path)
+        if create:
+            return client.get_or_create_collection(COLLECTION, embedding_function=None, metadata={"hnsw:space": "cosine"})
+        return client.get_collection(COLLECTION, embedding_function=None)
+    from app.agents.memmap_store import MemmapVectorStore
+    return MemmapVectorStore(path, dtype=backend.split("-", 1)[1]).get_or_create_collection(COLLECTION)
+
+
+def build(backend: str, path: str, args: Dict[str, Any]) -> Dict[str, Any]:
+    vectors = make_vectors(args["vectors"], args["dim"], args["seed"])
+    start = time.perf_counter()
+    collection = open_store(backend, path, create=True)
+    # ChromaDB caps the size of a single add.
+    for offset in range(0, len(vectors), 5000):
+        block = vectors[offset:offset + 5000]
+        ids = [str(offset + i) for i in range(len(block))]
+        collection.add(ids=ids, embeddings=block.tolist() if backend == "chroma" else block,
+                       documents=[f"chunk {i}" for i in ids], metadatas=[{"source": "bench.txt"} for _ in ids])
+    return {"build_seconds": time.perf_counter() - start}
+
+
+def serve(backend: str, path: str, args: Dict[str, Any]) -> Dict[str, Any]:
+    queries = make_vectors(args["queries"], args["dim"], args["seed"] + 1)
+    # Interpreter, NumPy and client imports are a fixed cost shared by every backend.
+    if backend == "chroma":
+        import chromadb
+    else:
+        from app.agents import memmap_store
+    baseline = rss_mb("VmRSS")
+    start = time.perf_counter()
+    collection = open_store(backend, path, create=False)
+    reopen_seconds = time.perf_counter() - start
+
+    latencies, results = [], []
+    for query in queries:
+        start = time.perf_counter()
+        hits = collection.query(query_embeddings=[query.tolist()], n_results=args["top_k"], include=[])
+        latencies.append(time.perf_counter() - start)
+        results.append([int(chunk_id) for chunk_id in hits["ids"][0]])
+
+    latencies.sort()
+    return {
+        "reopen_seconds": reopen_seconds,
+        "rss_before_open_mb": baseline,
+        "peak_rss_mb": rss_mb("VmHWM"),
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "results": results
+    }
+
+
+def rss_mb(field: str) -> float:
+    # Current (VmRSS) or peak (VmHWM) resident memory. On Linux ru_maxrss survives fork and
+    # exec, so a child would report the parent's peak; VmHWM starts afresh in the new process.
+    # Mapped vector pages that were touched are included.
+    if os.path.exists("/proc/self/status"):
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    # Elsewhere only the peak is available; ru_maxrss is in bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def exact_top_k(args: Dict[str, Any]) -> List[List[int]]:
+    vectors = make_vectors(args["vectors"], args["dim"], args["seed"])
+    queries = make_vectors(args["queries"], args["dim"], args["seed"] + 1)
+    scores = queries @ vectors.T
+    return np.argsort(-scores, axis=1)[:, :args["top_k"]].tolist()
+
+
+def disk_mb(path: str) -> float:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names) / (1024 * 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare memory use, speed and recall of the vector backends.")
+    parser.add_argument("--vectors", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--backends", default=",".join(BACKENDS))
+    args = vars(parser.parse_args())
+
+    truth = exact_top_k(args)
+    # Every phase runs in a fresh process so peak RSS reflects only that store.
+    context = multiprocessing.get_context("spawn")
+    report = {"settings": args, "backends": {}}
+    for backend in args["backends"].split(","):
+        path = tempfile.mkdtemp(prefix=f"docubot-{backend}-")
+        with context.Pool(1) as pool:
+            built = pool.apply(build, (backend, path, args))
+        with context.Pool(1) as pool:
+            served = pool.apply(serve, (backend, path, args))
+
+        results = served.pop("results")
+        recall = np.mean([len(set(found) & set(expected)) / len(expected) for found, expected in zip(results, truth)])
+        report["backends"][backend] = {**built, **served, "disk_mb": disk_mb(path), f"recall_at_{args['top_k']}": float(recall)}
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
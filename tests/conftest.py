@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+# The app builds its agents when it is imported; keep the files they create out of the working tree.
+os.environ.setdefault("CHROMA_PERSIST_DIR", tempfile.mkdtemp(prefix="docubot-tests-"))
+# Tests answer with the offline stub model.
+os.environ.setdefault("LLM_ENABLE_STUB", "1")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
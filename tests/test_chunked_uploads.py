@@ -0,0 +1,45 @@
+import hashlib
+import threading
+
+import pytest
+
+from app import chunked_uploads
+from app.chunked_uploads import ChunkedUploadManager, UploadBusyError
+
+CONTENT = b"The warranty for part PN-41 lasts twenty four months."
+
+
+def test_cancel_is_refused_while_the_upload_is_being_finalized(tmp_path, monkeypatch):
+    manager = ChunkedUploadManager(str(tmp_path), part_size=16)
+    upload = manager.create([("notes.txt", len(CONTENT), hashlib.sha256(CONTENT).hexdigest())], tenant_id="default")
+    for number in range(upload.files[0].parts):
+        data = CONTENT[number * 16:(number + 1) * 16]
+        part = manager.open_part(upload.upload_id, 0, number)
+        part.write(data)
+        part.finish(hashlib.sha256(data).hexdigest())
+
+    hashing, finish_hashing = threading.Event(), threading.Event()
+    file_sha256 = chunked_uploads.file_sha256
+
+    def slow_sha256(path):
+        hashing.set()
+        finish_hashing.wait(10)
+        return file_sha256(path)
+
+    monkeypatch.setattr(chunked_uploads, "file_sha256", slow_sha256)
+    finalized = []
+    finalizer = threading.Thread(target=lambda: finalized.append(manager.finalize(upload.upload_id)))
+    finalizer.start()
+    try:
+        assert hashing.wait(10)
+        with pytest.raises(UploadBusyError):
+            manager.cancel(upload.upload_id)
+    finally:
+        finish_hashing.set()
+        finalizer.join(10)
+
+    _, spooled, _ = finalized[0]
+    with open(spooled[0].path, "rb") as f:
+        assert f.read() == CONTENT
+    # Once finalized, the upload is gone and cancelling it finds nothing.
+    assert manager.cancel(upload.upload_id) is False
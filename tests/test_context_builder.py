@@ -0,0 +1,36 @@
+from app.agents.context_builder import ContextBuilder, estimate_tokens
+
+SENTENCE = "The warranty for part PN-41 lasts twenty four months. "
+
+
+def chunk(content, source):
+    return {"content": content, "metadata": {"source": source}}
+
+
+def test_the_passage_that_overflows_the_budget_is_truncated_to_fit():
+    builder = ContextBuilder(token_budgets={"groq": 100})
+    first, second, third = SENTENCE * 4, (SENTENCE * 8).replace("PN-41", "PN-77"), SENTENCE.replace("PN-41", "PN-99") * 4
+    chunks = [chunk(first, "a.txt"), chunk(second, "b.txt"), chunk(third, "c.txt")]
+
+    packed, stats = builder.build("groq", chunks)
+
+    assert [passage["metadata"]["source"] for passage in packed] == ["a.txt", "b.txt"]
+    assert packed[0]["content"] == first
+    assert second.startswith(packed[1]["content"]) and packed[1]["content"].endswith("months.")
+    assert stats["tokens_out"] <= 100
+    assert stats["passages_truncated"] == 1 and stats["over_budget_dropped"] == 1
+    # Nothing was merged or deduplicated; everything removed was cut for the budget.
+    assert stats["tokens_saved"] == 0
+    assert stats["tokens_truncated"] == stats["tokens_in"] - stats["tokens_out"]
+
+
+def test_tokens_saved_by_merging_overlaps_are_reported_apart_from_truncation():
+    builder = ContextBuilder(token_budgets={"groq": 1000})
+    text = "".join(f"Sentence number {i} about part PN-41. " for i in range(20))
+    chunks = [chunk(text[:400], "a.txt"), chunk(text[300:], "a.txt")]
+
+    packed, stats = builder.build("groq", chunks)
+
+    assert [passage["content"] for passage in packed] == [text]
+    assert stats["tokens_truncated"] == 0
+    assert stats["tokens_saved"] == stats["tokens_in"] - estimate_tokens(text)
@@ -0,0 +1,71 @@
+import hashlib
+
+from app.agents.retrieval_agent import RetrievalAgent
+
+
+def fake_embedder(texts):
+    # Bag-of-words vectors hashed into 64 dimensions, so no embedding model is needed.
+    vectors = []
+    for text in texts:
+        vector = [0.0] * 64
+        for word in text.lower().split():
+            vector[int(hashlib.sha256(word.encode("utf-8")).hexdigest(), 16) % 64] += 1.0
+        vectors.append(vector)
+    return vectors
+
+
+SHARED = "The warranty for part PN-41 lasts twenty four months from the date of purchase."
+
+
+def make_agent(tmp_path):
+    agent = RetrievalAgent(persist_dir=str(tmp_path), vector_backend="memmap")
+    agent.embedder = fake_embedder
+    return agent
+
+
+def index(agent, source, texts, file_hash="v1"):
+    chunks = [{"id": f"{source}-{file_hash}-{i}", "content": text, "metadata": {"source": source, "file_type": "txt"}}
+              for i, text in enumerate(texts)]
+    collapsed = agent.add_documents(chunks)
+    agent.finalize_source(source, file_hash, [chunk["id"] for chunk in chunks])
+    return collapsed
+
+
+def test_copies_are_stored_once_and_filtered_by_their_own_source(tmp_path):
+    agent = make_agent(tmp_path)
+    index(agent, "a.txt", [SHARED])
+    assert index(agent, "b.txt", [SHARED, SHARED.replace("PN-41", "PN-42")]) == 1
+
+    for vector_weight, lexical_weight in ((1.0, 0.0), (0.0, 1.0)):
+        results = agent.search("warranty PN-41", vector_weight=vector_weight, lexical_weight=lexical_weight,
+                               filters={"source": "b.txt"})
+        assert [result["metadata"]["source"] for result in results] == ["b.txt", "b.txt"]
+        assert results[0]["duplicates"] == [{"file_type": "txt", "source": "a.txt"}]
+
+
+def test_surviving_copy_replaces_a_removed_original(tmp_path):
+    agent = make_agent(tmp_path)
+    index(agent, "a.txt", [SHARED])
+    index(agent, "b.txt", [SHARED])
+    index(agent, "a.txt", ["Completely different text about rockets."], file_hash="v2")
+
+    assert all("PN-41" not in result["content"] for result in agent.search("warranty PN-41", filters={"source": "a.txt"}))
+    results = agent.search("warranty PN-41")
+    assert results[0]["content"] == SHARED
+    assert results[0]["metadata"]["source"] == "b.txt"
+    assert results[0]["duplicate_count"] == 0
+
+
+def test_filtered_vector_search_only_lists_collapsed_copies_by_id(tmp_path):
+    agent = make_agent(tmp_path)
+    index(agent, "a.txt", [SHARED, "Rockets need fuel."])
+    index(agent, "b.txt", [SHARED, "Boats need sails.", "Trains need rails."])
+    collection = agent._namespace("default").collection
+    queries = []
+    query = collection.query
+    collection.query = lambda **kwargs: queries.append(kwargs) or query(**kwargs)
+
+    results = agent.search("warranty PN-41 need", vector_weight=1.0, lexical_weight=0.0, filters={"source": "b.txt"})
+
+    assert sorted(result["content"] for result in results) == sorted([SHARED, "Boats need sails.", "Trains need rails."])
+    assert [kwargs.get("ids") for kwargs in queries] == [None, ["a.txt-v1-0"]]
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from app.agents.embedding_backends import LazySentenceTransformerEmbeddingFunction, OnnxEmbeddingFunction
+
+onnx = pytest.importorskip("onnx")
+pytest.importorskip("onnxruntime")
+tokenizers = pytest.importorskip("tokenizers")
+
+VOCAB = ["[PAD]", "[UNK]", "the", "warranty", "lasts", "two", "years", "supplier", "is", "acme", "for", "part"]
+DIMENSIONS = 8
+
+
+def write_model(model_dir, table):
+    # A stand-in for the exported transformer: each token's embedding is its row of `table`.
+    # It takes the same inputs as the real export and produces last_hidden_state.
+    from onnx import helper, numpy_helper, TensorProto
+    inputs = [helper.make_tensor_value_info(name, TensorProto.INT64, ["batch", "sequence"])
+              for name in ("input_ids", "attention_mask", "token_type_ids")]
+    output = helper.make_tensor_value_info("last_hidden_state", TensorProto.FLOAT, ["batch", "sequence", DIMENSIONS])
+    graph = helper.make_graph([helper.make_node("Gather", ["table", "input_ids"], ["last_hidden_state"])],
+                              "token_embeddings", inputs, [output],
+                              initializer=[numpy_helper.from_array(table, name="table")])
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 17)])
+    model.ir_version = 8
+    onnx.save(model, str(model_dir / "model.onnx"))
+
+    tokenizer = tokenizers.Tokenizer(tokenizers.models.WordLevel({word: i for i, word in enumerate(VOCAB)}, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = tokenizers.pre_tokenizers.Whitespace()
+    tokenizer.save(str(model_dir / "tokenizer.json"))
+
+
+def reference_embedding(text, table):
+    # Tokenize, mean-pool the token embeddings and L2-normalize, in plain NumPy.
+    ids = [VOCAB.index(word) if word in VOCAB else VOCAB.index("[UNK]") for word in text.split()]
+    pooled = table[ids].mean(axis=0)
+    return pooled / np.linalg.norm(pooled)
+
+
+def test_onnx_backend_matches_numpy_reference(tmp_path):
+    table = np.random.default_rng(0).normal(size=(len(VOCAB), DIMENSIONS)).astype(np.float32)
+    write_model(tmp_path, table)
+    # Texts of different lengths share a batch, so the shorter ones are padded.
+    texts = ["the warranty lasts two years for part", "acme", "the supplier is acme", "warranty for an unknown part"]
+    function = OnnxEmbeddingFunction("test-model", str(tmp_path), model_file="model.onnx", batch_size=3)
+
+    vectors = function(texts)
+
+    assert len(vectors) == len(texts)
+    for text, vector in zip(texts, vectors):
+        np.testing.assert_allclose(vector, reference_embedding(text, table), rtol=1e-5, atol=1e-6)
+
+
+def test_backends_and_model_files_have_separate_cache_names(tmp_path):
+    names = {
+        LazySentenceTransformerEmbeddingFunction("test-model").cache_name,
+        OnnxEmbeddingFunction("test-model", str(tmp_path), model_file="model.onnx").cache_name,
+        OnnxEmbeddingFunction("test-model", str(tmp_path), model_file="model_int8.onnx").cache_name
+    }
+    assert len(names) == 3
@@ -0,0 +1,36 @@
+import io
+from types import SimpleNamespace
+
+from app.agents import ingestion_agent
+from app.agents.ingestion_agent import IngestionAgent
+
+
+class RecordingFile(io.BytesIO):
+    def __init__(self, data):
+        super().__init__(data)
+        self.read_sizes = []
+
+    def read(self, size=-1):
+        self.read_sizes.append(size)
+        return super().read(size)
+
+
+def test_text_files_are_decoded_and_yielded_in_blocks(monkeypatch):
+    monkeypatch.setattr(ingestion_agent, "TXT_READ_BYTES", 3)
+    monkeypatch.setattr(ingestion_agent, "TXT_BLOCK_CHARS", 12)
+    # Multi-byte characters straddle the 3-byte reads.
+    text = "Übergrößen\n\nfirst line\nsecond line\n\ntail"
+    file = RecordingFile(text.encode("utf-8"))
+
+    docs = list(IngestionAgent()._parse_txt(SimpleNamespace(filename="notes.txt", file=file)))
+
+    assert "".join(doc["content"] for doc in docs) == text
+    assert [doc["content"] for doc in docs] == ["Übergrößen\n\n", "first line\n", "second line\n", "\ntail"]
+    assert all(doc["metadata"] == {"source": "notes.txt"} for doc in docs)
+    assert set(file.read_sizes) == {3}
+
+
+def test_a_small_text_file_is_one_document():
+    text = "One paragraph.\n\nAnother paragraph."
+    file = SimpleNamespace(filename="notes.txt", file=io.BytesIO(text.encode("utf-8")))
+    assert [doc["content"] for doc in IngestionAgent()._parse_txt(file)] == [text]
@@ -0,0 +1,51 @@
+import hashlib
+import os
+import time
+
+import pytest
+
+from app.agents.ingestion_agent import IngestionAgent, SpooledUpload
+from app.ingestion_jobs import IngestionJobManager
+from tests.test_deduplication import make_agent
+
+GOOD = "The warranty for part PN-41 lasts twenty four months.\n" * 40
+# Valid text first, so a streamed parse yields chunks before it fails on the invalid bytes.
+BAD = GOOD.replace("PN-41", "PN-99").encode("utf-8") + b"\xff\xfe not utf-8\n"
+
+
+def spool(manager, filename, content):
+    path = os.path.join(manager.spool_dir, filename)
+    with open(path, "wb") as f:
+        f.write(content)
+    return SpooledUpload(filename=filename, path=path)
+
+
+def wait_for(manager, job_id):
+    for _ in range(600):
+        job = manager.get(job_id)
+        if job.status in ("completed", "failed"):
+            return job
+        time.sleep(0.1)
+    raise TimeoutError("The ingestion job did not finish.")
+
+
+# Large files are streamed on the worker thread (threshold 0); small ones go to the process pool.
+@pytest.mark.parametrize("stream_threshold_bytes", [0, 1024 * 1024 * 1024])
+def test_a_failing_file_does_not_fail_the_others(tmp_path, stream_threshold_bytes):
+    agent = make_agent(tmp_path)
+    manager = IngestionJobManager(IngestionAgent(), agent, parse_workers=1, embed_batch_size=1,
+                                  stream_threshold_bytes=stream_threshold_bytes)
+    try:
+        uploads = [spool(manager, "bad.txt", BAD), spool(manager, "good.txt", GOOD.encode("utf-8"))]
+        job = wait_for(manager, manager.submit(uploads, tenant_id="default").job_id)
+
+        assert job.status == "completed"
+        assert job.files_failed == 1 and list(job.file_errors) == ["bad.txt"]
+        assert agent.search("warranty PN-41", filters={"source": "good.txt"})
+        assert agent.is_source_unchanged("good.txt", hashlib.sha256(GOOD.encode("utf-8")).hexdigest())
+        # Nothing the failed file added is left behind, and every spooled file is gone.
+        assert agent.search("warranty PN-99", filters={"source": "bad.txt"}) == []
+        assert os.listdir(manager.spool_dir) == []
+    finally:
+        manager.shutdown()
+
@@ -0,0 +1,31 @@
+from fastapi.testclient import TestClient
+
+from app import main
+from app.agents.llm_response_agent import LLMResponseAgent
+
+
+def fake_embedder(texts):
+    # A constant vector per text, so no embedding model is needed.
+    return [[1.0] + [0.0] * 63 for _ in texts]
+
+
+def test_stub_model_is_only_offered_when_enabled(monkeypatch):
+    monkeypatch.delenv("LLM_ENABLE_STUB", raising=False)
+    assert "stub" not in LLMResponseAgent().providers
+
+    monkeypatch.setenv("LLM_ENABLE_STUB", "1")
+    assert "stub" in LLMResponseAgent().providers
+
+
+def test_unknown_model_is_a_client_error_and_not_cached(monkeypatch):
+    monkeypatch.setattr(main.retrieval_agent, "embedder", fake_embedder)
+    client = TestClient(main.app)
+    request = {"query": "What is the warranty?", "model_name": "no-such-model", "tenant_id": "unknown-model-test"}
+
+    for _ in range(2):
+        response = client.post("/query", json=request)
+        assert response.status_code == 400
+
+    stream = client.post("/query_stream", json=request)
+    assert "event: error" in stream.text and '"status_code": 400' in stream.text
+    assert main.answer_cache.lookup(request["query"], request["tenant_id"], main.answer_cache_scope(main.QueryRequest(**request))) is None
@@ -0,0 +1,17 @@
+from fastapi.testclient import TestClient
+
+from app import main
+from app.session_store import SQLiteSessionStore
+
+
+def test_metrics_with_sqlite_session_store(tmp_path, monkeypatch):
+    store = SQLiteSessionStore(str(tmp_path / "sessions.sqlite"), max_sessions=1)
+    monkeypatch.setattr(main, "session_store", store)
+    store.append("first", [{"role": "user", "content": "hello"}])
+    store.append("second", [{"role": "user", "content": "hello again"}])
+
+    response = TestClient(main.app).get("/metrics")
+
+    assert response.status_code == 200
+    assert "docubot_sessions 1" in response.text
+    assert "docubot_session_evictions_total 1" in response.text
@@ -0,0 +1,39 @@
+import threading
+
+from app.agents.retrieval_agent import RetrievalAgent
+from tests.test_deduplication import fake_embedder
+
+
+def test_loading_one_tenant_does_not_block_another(tmp_path):
+    agent = RetrievalAgent(persist_dir=str(tmp_path), vector_backend="memmap")
+    agent.embedder = fake_embedder
+    index_tenant = lambda tenant_id: agent.add_documents(
+        [{"id": f"{tenant_id}-0", "content": f"Notes of {tenant_id}.", "metadata": {"source": "notes.txt", "file_type": "txt"}}],
+        tenant_id=tenant_id
+    )
+    index_tenant("small")
+    index_tenant("large")
+    # Forget the loaded namespaces, as after a restart.
+    agent._namespaces.clear()
+
+    load_started, finish_load = threading.Event(), threading.Event()
+    load_lexical_index = agent._load_lexical_index
+
+    def slow_load(namespace, *args, **kwargs):
+        if namespace.tenant_id == "large":
+            load_started.set()
+            finish_load.wait(10)
+        load_lexical_index(namespace, *args, **kwargs)
+
+    agent._load_lexical_index = slow_load
+    large_results = []
+    loader = threading.Thread(target=lambda: large_results.append(agent.search("notes", tenant_id="large")))
+    loader.start()
+    try:
+        assert load_started.wait(10)
+        assert agent.search("notes", tenant_id="small")[0]["content"] == "Notes of small."
+        assert loader.is_alive()
+    finally:
+        finish_load.set()
+        loader.join(10)
+    assert large_results[0][0]["content"] == "Notes of large."
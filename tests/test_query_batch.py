@@ -0,0 +1,37 @@
+import asyncio
+import hashlib
+import json
+
+import httpx
+
+from app import main
+
+
+def fake_embedder(texts):
+    # One-hot vectors from a hash of the text, so no embedding model is needed.
+    vectors = []
+    for text in texts:
+        vector = [0.0] * 64
+        vector[int(hashlib.sha256(text.encode("utf-8")).hexdigest(), 16) % 64] = 1.0
+        vectors.append(vector)
+    return vectors
+
+
+def test_query_batch_with_search_size_above_in_flight_limit(monkeypatch):
+    monkeypatch.setattr(main.retrieval_agent, "embedder", fake_embedder)
+    monkeypatch.setattr(main, "BATCH_SEARCH_SIZE", 8)
+    monkeypatch.setattr(main, "BATCH_MAX_IN_FLIGHT", 2)
+    queries = [f"question {i}" for i in range(5)]
+
+    async def post():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/query_batch", json={"queries": queries, "model_name": "stub",
+                                                           "tenant_id": "query-batch-test"})
+
+    response = asyncio.run(asyncio.wait_for(post(), timeout=30))
+
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert sorted(line["index"] for line in lines[:-1]) == list(range(len(queries)))
+    assert lines[-1]["done"] and lines[-1]["completed"] == len(queries)
@@ -0,0 +1,34 @@
+import pytest
+
+from app.session_store import InMemorySessionStore, SQLiteSessionStore, message_size
+
+MESSAGE = {"role": "user", "content": "x" * 96}
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_store(request, tmp_path):
+    def make(max_bytes):
+        if request.param == "memory":
+            return InMemorySessionStore(max_bytes=max_bytes)
+        return SQLiteSessionStore(str(tmp_path / "sessions.sqlite"), max_bytes=max_bytes)
+    return make
+
+
+def test_least_recently_used_sessions_are_evicted_over_the_byte_cap(make_store):
+    store = make_store(max_bytes=3 * message_size(MESSAGE))
+    store.append("old", [MESSAGE, MESSAGE])
+    store.append("new", [MESSAGE, MESSAGE])
+
+    assert store.stats("old") is None
+    assert store.stats("new")["messages"] == 2
+    assert store.summary()["evictions"] == 1
+
+
+def test_an_oversized_session_is_trimmed_from_its_oldest_message(make_store):
+    store = make_store(max_bytes=3 * message_size(MESSAGE))
+    for i in range(5):
+        store.append("long", [{"role": "user", "content": f"{i}" * 96}])
+
+    history = store.get_history("long")
+    assert [message["content"][0] for message in history] == ["2", "3", "4"]
+    assert store.summary()["bytes"] <= 3 * message_size(MESSAGE)
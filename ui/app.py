@@ -1,6 +1,10 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+import hashlib
+import json
 import time
+import uuid
 
 # --- Page Configuration ---
 st.set_page_config(page_title="DocuBot", page_icon="📄", layout="wide")
@@ -8,6 +12,80 @@ st.set_page_config(page_title="DocuBot", page_icon="📄", layout="wide")
 # --- Constants ---
 # URL of the FastAPI backend server
 BACKEND_URL = "http://127.0.0.1:8000"
+# How many times an upload resumes after a part fails before it gives up.
+UPLOAD_RETRIES = 3
+
+# --- Backend Connection ---
+# One pooled HTTP session for every call to the backend, kept across reruns, so uploads,
+# job polling and questions reuse open connections instead of reconnecting each time.
+@st.cache_resource
+def http_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=8)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def upload_files(files, tenant_id, progress_bar):
+    # Sends the files through the backend's resumable upload API: declare them, send each
+    # in parts (read from the file one part at a time, with its SHA-256), then finalize.
+    # If a part fails, the backend is asked which parts it still lacks and only those are
+    # sent again. Returns the finalize (or failed) response.
+    http = http_session()
+    specs = []
+    for file in files:
+        digest = hashlib.sha256()
+        file.seek(0)
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(block)
+        specs.append({"filename": file.name, "size": file.size, "sha256": digest.hexdigest()})
+    response = http.post(f"{BACKEND_URL}/uploads", json={"files": specs, "tenant_id": tenant_id}, timeout=30)
+    if response.status_code != 201:
+        return response
+    upload = response.json()
+    upload_url = f"{BACKEND_URL}/uploads/{upload['upload_id']}"
+    total = max(sum(spec["size"] for spec in specs), 1)
+
+    for attempt in range(UPLOAD_RETRIES + 1):
+        missing = [(index, part) for index, file in enumerate(upload["files"]) for part in file["missing_parts"]]
+        if not missing:
+            break
+        try:
+            for index, part in missing:
+                files[index].seek(part * upload["part_size"])
+                data = files[index].read(upload["part_size"])
+                response = http.put(f"{upload_url}/files/{index}/parts/{part}", data=data,
+                                    headers={"X-Part-SHA256": hashlib.sha256(data).hexdigest()}, timeout=120)
+                response.raise_for_status()
+                upload = response.json()
+                sent = sum(file["received_bytes"] for file in upload["files"])
+                progress_bar.progress(sent / total, text=f"Uploaded {sent / 1e6:.1f} of {total / 1e6:.1f} MB")
+        except requests.exceptions.RequestException:
+            if attempt == UPLOAD_RETRIES:
+                raise
+            time.sleep(2 ** attempt)
+            upload = http.get(upload_url, timeout=30).json()
+    return http.post(f"{upload_url}/finalize", timeout=300)
+
+
+# --- Citation Formatting ---
+# Where in its file a chunk came from, e.g. "report.docx (Paragraphs: 12-19)". Short
+# paragraphs, slides and rows are packed together at ingest, so chunks can span a range.
+LOCATION_LABELS = (("page", "Page"), ("paragraph", "Paragraph"), ("slide", "Slide"), ("row", "Row"))
+
+
+def describe_location(metadata):
+    location = metadata.get('source', 'N/A')
+    for key, label in LOCATION_LABELS:
+        if key in metadata:
+            end = metadata.get(f"{key}_end", metadata[key])
+            if end != metadata[key]:
+                location += f" ({label}s: {metadata[key]}-{end})"
+            else:
+                location += f" ({label}: {metadata[key]})"
+    return location
+
 
 # --- Custom Styling ---
 # Inject custom CSS for a cleaner look
@@ -23,6 +101,13 @@ st.markdown("""
 # Initialize a unique session ID for the conversation
 if 'session_id' not in st.session_state:
     st.session_state.session_id = None
+# Each user uploads into, and searches, their own document namespace. Its ID is kept in
+# the page URL, so reloading or bookmarking the page finds the same documents again
+# instead of starting an empty namespace (the backend deletes ones left unused).
+if 'tenant_id' not in st.session_state:
+    if "tenant" not in st.query_params:
+        st.query_params["tenant"] = str(uuid.uuid4())
+    st.session_state.tenant_id = st.query_params["tenant"]
 # Initialize the list to store chat messages
 if "messages" not in st.session_state:
     st.session_state.messages = []
@@ -54,14 +139,33 @@ with st.sidebar:
         if uploaded_files:
             # Use a status container for better user feedback during processing
             with st.status("Processing documents...", expanded=True) as status:
-                # Prepare files in the format required by FastAPI for multipart/form-data
-                files_to_send = [("files", (file.name, file.getvalue(), file.type)) for file in uploaded_files]
                 try:
-                    # Make the API call to the backend's /upload endpoint
-                    response = requests.post(f"{BACKEND_URL}/upload", files=files_to_send, timeout=600)
-                    if response.status_code == 200:
-                        status.update(label="✅ Documents Processed!", state="complete", expanded=False)
-                        st.session_state.processed = True
+                    # Send the files to the backend in parts, resuming after any failed part.
+                    progress_bar = st.progress(0.0, text="Uploading...")
+                    response = upload_files(uploaded_files, st.session_state.tenant_id, progress_bar)
+                    if response.status_code == 202:
+                        # The backend ingests in the background; poll the job until it finishes.
+                        job_id = response.json()["job_id"]
+                        progress_bar.progress(0.0, text="Parsing and indexing...")
+                        while True:
+                            job = http_session().get(f"{BACKEND_URL}/jobs/{job_id}", timeout=30).json()
+                            progress_bar.progress(job["progress"], text=f"Indexed {job['chunks_indexed']} chunks")
+                            if job["status"] in ("completed", "failed"):
+                                break
+                            time.sleep(1)
+
+                        if job["status"] == "completed" and job.get("file_errors"):
+                            # Some files could not be indexed; the others were.
+                            status.update(label="⚠️ Some documents could not be processed", state="error", expanded=True)
+                            for filename, error in job["file_errors"].items():
+                                st.warning(f"{filename}: {error}")
+                            st.session_state.processed = True
+                        elif job["status"] == "completed":
+                            status.update(label="✅ Documents Processed!", state="complete", expanded=False)
+                            st.session_state.processed = True
+                        else:
+                            status.update(label="⚠️ Error processing!", state="error", expanded=True)
+                            st.error(f"Error: {job['error']}")
                     else:
                         status.update(label="⚠️ Error processing!", state="error", expanded=True)
                         st.error(f"Error: {response.text}")
@@ -75,8 +179,11 @@ with st.sidebar:
     # Button to clear both the backend (DB and history) and frontend state
     if st.button("Clear Session (Chat & Docs)"):
         try:
-            # Call the backend endpoint to clear its state
-            requests.post(f"{BACKEND_URL}/clear_session")
+            # Call the backend endpoint to clear this session's history and documents
+            http_session().post(f"{BACKEND_URL}/clear_session", json={
+                "session_id": st.session_state.session_id,
+                "tenant_id": st.session_state.tenant_id
+            })
             # Clear the local frontend state
             st.session_state.messages = []
             st.session_state.session_id = None
@@ -101,11 +208,13 @@ for message in st.session_state.messages:
         if "sources" in message:
             with st.expander("📚 View Sources"):
                 for source in message["sources"]:
-                    metadata = source.get('metadata', {})
-                    source_info = f"**{metadata.get('source', 'N/A')}**"
-                    if 'page' in metadata:
-                        source_info += f" (Page: {metadata['page']})"
+                    source_info = describe_location(source.get('metadata', {}))
                     st.markdown(f"**{source_info}**")
+                    # The same passage found elsewhere, collapsed into this one at ingest.
+                    if source.get('duplicates'):
+                        locations = [describe_location(duplicate) for duplicate in source['duplicates']]
+                        hidden = source.get('duplicate_count', len(locations)) - len(locations)
+                        st.caption("Also appears in: " + ", ".join(locations) + (f" and {hidden} more" if hidden > 0 else ""))
                     st.markdown(f"> {source.get('content', 'No content available.')}")
                     st.markdown("---")
 
@@ -122,32 +231,51 @@ if prompt := st.chat_input("What is this document about?"):
 
         # Process and display the assistant's response
         with st.chat_message("assistant"):
-            with st.spinner("Thinking..."):
-                # Construct the payload to send to the backend
-                payload = {
-                    "query": prompt, 
-                    "session_id": st.session_state.session_id,
-                    "model_name": model_choice
-                }
-                try:
-                    # Make the API call to the backend's /query endpoint
-                    response = requests.post(f"{BACKEND_URL}/query", json=payload, timeout=300)
+            # Construct the payload to send to the backend
+            payload = {
+                "query": prompt, 
+                "session_id": st.session_state.session_id,
+                "model_name": model_choice,
+                "tenant_id": st.session_state.tenant_id
+            }
+            try:
+                # Stream the answer from the backend's /query_stream endpoint as server-sent events
+                with http_session().post(f"{BACKEND_URL}/query_stream", json=payload, stream=True, timeout=300) as response:
                     if response.status_code == 200:
-                        response_data = response.json()
-                        response_text = response_data["answer"]
-                        sources = response_data["sources"]
-                        
-                        # Display the main answer
-                        st.markdown(response_text)
-                        
-                        # Update the session ID with the one from the backend (important for the first message)
-                        st.session_state.session_id = response_data["session_id"]
-                        # Add the full response (including sources) to our local history
-                        st.session_state.messages.append({"role": "assistant", "content": response_text, "sources": sources})
-                        # Rerun the script to display the sources correctly
-                        st.rerun()
+                        placeholder = st.empty()
+                        placeholder.markdown("Thinking...")
+                        response_text = ""
+                        sources = []
+                        error = None
+                        event = None
+                        for line in response.iter_lines(decode_unicode=True):
+                            if line.startswith("event: "):
+                                event = line[len("event: "):]
+                            elif line.startswith("data: "):
+                                data = json.loads(line[len("data: "):])
+                                if event == "sources":
+                                    # Sources arrive first; keep them for the expander shown after the answer.
+                                    sources = data["sources"]
+                                    # Update the session ID with the one from the backend (important for the first message)
+                                    st.session_state.session_id = data["session_id"]
+                                elif event == "token":
+                                    # Render each token as it arrives, with a cursor while the answer is still streaming.
+                                    response_text += data["text"]
+                                    placeholder.markdown(response_text + "▌")
+                                elif event == "error":
+                                    error = data["detail"]
+
+                        if error:
+                            placeholder.empty()
+                            st.error(f"Error from backend: {error}")
+                        else:
+                            placeholder.markdown(response_text)
+                            # Add the full response (including sources) to our local history
+                            st.session_state.messages.append({"role": "assistant", "content": response_text, "sources": sources})
+                            # Rerun the script to display the sources correctly
+                            st.rerun()
 
                     else:
                         st.error(f"Error from backend: {response.text}")
-                except requests.exceptions.RequestException as e:
-                    st.error(f"Connection to backend failed: {e}")
\ No newline at end of file
+            except requests.exceptions.RequestException as e:
+                st.error(f"Connection to backend failed: {e}")